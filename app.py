@@ -2,24 +2,48 @@ import os
 import io
 import json
 import base64
+import binascii
 import random
-import urllib.request
 import urllib.parse
+import requests
 import websocket
 import uuid
+import queue
+import threading
+import collections
+import contextlib
+import hashlib
+import hmac
+import tempfile
+import shutil
+import sqlite3
+import functools
+import select
+import socket
+import ipaddress
+import ssl
+import struct
+import re
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, render_template, send_file, send_from_directory
+from flask import Flask, Response, request, jsonify, render_template, send_file, send_from_directory, g, has_request_context
 from PIL import Image
+import prometheus_client
+import prometheus_client.multiprocess
 from werkzeug.utils import secure_filename
-import urllib.parse
-import urllib.request
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import math
 import time
 
 # Load environment variables from the .env file
 load_dotenv()
 
-# Initialize Flask app
-app = Flask(__name__)
+# Initialize Flask app; /static is served by serve_static from STATIC_DIR, not Flask's built-in static folder
+app = Flask(__name__, static_folder=None)
+
+# Let a fronting nginx/Apache serve cached files via X-Sendfile when enabled
+app.config['USE_X_SENDFILE'] = os.getenv("USE_X_SENDFILE", "false").lower() in ('1', 'true', 'yes')
 
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'webp'}  # Define supported image types
 
@@ -27,87 +51,3012 @@ ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'webp'}  # Define supported image ty
 server_address = os.getenv("SERVER_ADDRESS")
 ws_address = os.getenv("WS_ADDRESS")
 
-# Generate a unique client ID
-client_id = str(uuid.uuid4())
+# ComfyUI backend pool: comma-separated "http://host:port[|weight[|ws://host:port/ws]]" entries.
+# When unset, SERVER_ADDRESS/WS_ADDRESS form a pool of one.
+COMFYUI_BACKENDS = os.getenv("COMFYUI_BACKENDS", "")
+BACKEND_HEALTH_INTERVAL = float(os.getenv("BACKEND_HEALTH_INTERVAL", "10"))
+BACKEND_HEALTH_TIMEOUT = float(os.getenv("BACKEND_HEALTH_TIMEOUT", "3"))
+BACKEND_PIN_LIMIT = int(os.getenv("BACKEND_PIN_LIMIT", "10000"))
+COMFYUI_HEALTH_TOKEN = os.getenv("COMFYUI_HEALTH_TOKEN")
+
+# Pooled HTTP client settings
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "300"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", "0.5"))
+
+# Output image transcoding settings
+IMAGE_TRANSCODE_WORKERS = int(os.getenv("IMAGE_TRANSCODE_WORKERS", "4"))
+DEFAULT_OUTPUT_QUALITY = int(os.getenv("DEFAULT_OUTPUT_QUALITY", "90"))
+
+# Video proxy settings
+VIDEO_CHUNK_SIZE = int(os.getenv("VIDEO_CHUNK_SIZE", str(256 * 1024)))
+
+# Local result cache settings
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'results'))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", str(24 * 3600)))
+RESULT_CACHE_SWEEP_INTERVAL = float(os.getenv("RESULT_CACHE_SWEEP_INTERVAL", "60"))
+
+# Asynchronous image job settings
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "https://gosign-de-comfyui-api.hf.space").rstrip('/')
+JOB_CALLBACK_WORKERS = int(os.getenv("JOB_CALLBACK_WORKERS", "8"))
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+# Callback hosts exempt from the public-address check, comma-separated (e.g. an internal webhook relay)
+CALLBACK_ALLOWED_HOSTS = {host.strip().lower() for host in os.getenv("CALLBACK_ALLOWED_HOSTS", "").split(',') if host.strip()}
+
+# Server-Sent Events progress stream settings
+SSE_KEEPALIVE_INTERVAL = float(os.getenv("SSE_KEEPALIVE_INTERVAL", "15"))
+SSE_QUEUE_REFRESH_INTERVAL = float(os.getenv("SSE_QUEUE_REFRESH_INTERVAL", "2"))
+
+# Input image delivery: 'upload' pushes inputs to ComfyUI's /upload/image, 'url' has ComfyUI download them from us
+IMAGE_INPUT_MODE = os.getenv("IMAGE_INPUT_MODE", "upload").lower()
+
+# Output image delivery for synchronous requests: 'history' saves to disk and fetches through /view,
+# 'websocket' swaps SaveImage for SaveImageWebsocket and takes the images from binary frames
+IMAGE_DELIVERY = os.getenv("IMAGE_DELIVERY", "history").lower()
+
+# Input ingestion limits
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(32 * 1024 * 1024)))
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(40 * 1000 * 1000)))
+INPUT_DOWNSCALE = os.getenv("INPUT_DOWNSCALE", "true").lower() in ('1', 'true', 'yes')
+INPUT_IMAGE_FORMATS = {'png', 'jpeg', 'webp'}
+
+# Reject oversized request bodies (JSON or multipart) before they are read
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+
+# static/ storage manager settings
+# Absolute, so files are written and served from the same place whatever the working directory
+STATIC_DIR = os.path.abspath(os.getenv("STATIC_DIR", "static"))
+STATIC_MAX_BYTES = int(os.getenv("STATIC_MAX_BYTES", str(5 * 1024 ** 3)))
+STATIC_FILE_TTL = float(os.getenv("STATIC_FILE_TTL", str(6 * 3600)))
+STATIC_EVICT_GRACE = float(os.getenv("STATIC_EVICT_GRACE", "600"))
+STATIC_SWEEP_INTERVAL = float(os.getenv("STATIC_SWEEP_INTERVAL", "60"))
+
+# Admission control (0 disables a limit)
+ADMISSION_RATE = float(os.getenv("ADMISSION_RATE", "2"))
+ADMISSION_BURST = float(os.getenv("ADMISSION_BURST", "100"))
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "100"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "200"))
+ADMISSION_FAIR_SHARE_AT = float(os.getenv("ADMISSION_FAIR_SHARE_AT", "0.5"))
+ADMISSION_RETRY_AFTER = float(os.getenv("ADMISSION_RETRY_AFTER", "10"))
+ADMISSION_INFLIGHT_TTL = float(os.getenv("ADMISSION_INFLIGHT_TTL", "3600"))
+
+# Local job scheduler in front of ComfyUI
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() in ('1', 'true', 'yes')
+SCHEDULER_DB = os.getenv("SCHEDULER_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'jobs.db'))
+SCHEDULER_MAX_DISPATCHED = int(os.getenv("SCHEDULER_MAX_DISPATCHED", "2"))
+SCHEDULER_POLL_INTERVAL = float(os.getenv("SCHEDULER_POLL_INTERVAL", "0.5"))
+SCHEDULER_AGING = float(os.getenv("SCHEDULER_AGING", "300"))
+SCHEDULER_RECONCILE_INTERVAL = float(os.getenv("SCHEDULER_RECONCILE_INTERVAL", "15"))
+SCHEDULER_OWNER_TIMEOUT = float(os.getenv("SCHEDULER_OWNER_TIMEOUT", "30"))
+SCHEDULER_RETENTION = float(os.getenv("SCHEDULER_RETENTION", str(24 * 3600)))
+
+# Model affinity: keep prompts that load the same weights together (0 disables)
+MODEL_AFFINITY_MAX_WAIT = float(os.getenv("MODEL_AFFINITY_MAX_WAIT", "30"))
+MODEL_AFFINITY_LOOKAHEAD = int(os.getenv("MODEL_AFFINITY_LOOKAHEAD", "50"))
+MODEL_AFFINITY_BACKEND_BONUS = float(os.getenv("MODEL_AFFINITY_BACKEND_BONUS", "2"))
+
+# Durable task state shared by all workers (JOB_STORE=none keeps no state)
+JOB_STORE = os.getenv("JOB_STORE", "sqlite").lower()
+JOB_STORE_DB = os.getenv("JOB_STORE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'tasks.db'))
+JOB_STORE_RETENTION = float(os.getenv("JOB_STORE_RETENTION", str(7 * 24 * 3600)))
+JOB_STORE_HEARTBEAT_INTERVAL = float(os.getenv("JOB_STORE_HEARTBEAT_INTERVAL", "10"))
+JOB_STORE_LISTENER_TIMEOUT = float(os.getenv("JOB_STORE_LISTENER_TIMEOUT", "60"))
+
+# Batch generation limits
+MAX_BATCH_PROMPTS = int(os.getenv("MAX_BATCH_PROMPTS", "100"))
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "16"))
+
+# Shared WebSocket listener settings
+WS_CONNECT_TIMEOUT = float(os.getenv("WS_CONNECT_TIMEOUT", "10"))
+WS_RECONNECT_DELAY = float(os.getenv("WS_RECONNECT_DELAY", "1"))
+WS_RECONNECT_MAX_DELAY = float(os.getenv("WS_RECONNECT_MAX_DELAY", "30"))
+WS_LISTENER_IDLE_TIMEOUT = float(os.getenv("WS_LISTENER_IDLE_TIMEOUT", "600"))
+WS_EVENT_BACKLOG = int(os.getenv("WS_EVENT_BACKLOG", "256"))
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "20"))
+WS_PING_TIMEOUT = float(os.getenv("WS_PING_TIMEOUT", "60"))
+
+# Prompt deadlines (0 waits forever) and cancellation of prompts whose client went away
+IMAGE_PROMPT_TIMEOUT = float(os.getenv("IMAGE_PROMPT_TIMEOUT", "600"))
+VIDEO_PROMPT_TIMEOUT = float(os.getenv("VIDEO_PROMPT_TIMEOUT", "3600"))
+CANCEL_ON_DISCONNECT = os.getenv("CANCEL_ON_DISCONNECT", "true").lower() in ('1', 'true', 'yes')
+DISCONNECT_CHECK_INTERVAL = float(os.getenv("DISCONNECT_CHECK_INTERVAL", "1"))
+
+# Prometheus metrics: /metrics is open unless METRICS_TOKEN is set
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+METRICS_PROMPT_LIMIT = int(os.getenv("METRICS_PROMPT_LIMIT", "10000"))
+
+# Operator routes (/v1/backends, /v1/storage_stats) need this Bearer token and are closed while it is unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+                ################################################
+                # Prometheus metrics                           #
+                ################################################
+
+# Latency buckets span sub-millisecond helpers up to multi-minute video renders
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+SIZE_BUCKETS = (1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2, 256 * 1024 ** 2)
+
+REQUEST_SECONDS = prometheus_client.Histogram(
+    'comfyui_api_request_seconds', 'Time until a response starts, by route',
+    ['route', 'workflow', 'status'], buckets=STAGE_BUCKETS)
+STAGE_SECONDS = prometheus_client.Histogram(
+    'comfyui_api_stage_seconds', 'Time spent in each stage of serving a request',
+    ['route', 'workflow', 'stage'], buckets=STAGE_BUCKETS)
+RESPONSE_BYTES = prometheus_client.Histogram(
+    'comfyui_api_response_bytes', 'Size of response bodies, including streamed ones',
+    ['route', 'workflow'], buckets=SIZE_BUCKETS)
+UPSTREAM_ERRORS = prometheus_client.Counter(
+    'comfyui_api_upstream_errors', 'Failed calls to ComfyUI, by operation and kind of failure',
+    ['operation', 'kind'])
+CANCELLED_PROMPTS = prometheus_client.Counter(
+    'comfyui_api_cancelled_prompts', 'Prompts cancelled because of a deadline or a departed client',
+    ['reason', 'outcome'])
+MODEL_SWITCHES = prometheus_client.Counter(
+    'comfyui_api_model_switches', 'Prompts sent to a backend that last ran a different model', ['backend'])
+MODEL_SWITCHES_AVOIDED = prometheus_client.Counter(
+    'comfyui_api_model_switches_avoided', 'Prompts dispatched out of priority order to reuse the loaded model', ['backend'])
+
+def metric_labels():
+    """(route, workflow) of the current request; work on background threads is labelled 'background'."""
+    if not has_request_context():
+        return 'background', 'none'
+    return request.endpoint or 'unknown', g.get('workflow', 'none')
+
+def observe_stage(stage, seconds, labels=None):
+    route, workflow = labels or metric_labels()
+    STAGE_SECONDS.labels(route, workflow, stage).observe(seconds)
+
+@contextlib.contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+def timed_stage(stage):
+    """Decorator recording every call of a function as one observation of stage."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count_upstream_error(operation, error):
+    if isinstance(error, requests.Timeout):
+        kind = 'timeout'
+    elif isinstance(error, requests.ConnectionError):
+        kind = 'connection'
+    elif isinstance(error, requests.HTTPError):
+        kind = 'http'
+    elif isinstance(error, websocket.WebSocketException):
+        kind = 'websocket'
+    else:
+        kind = 'other'
+    UPSTREAM_ERRORS.labels(operation, kind).inc()
+
+class PromptTimer:
+    """Times the queue wait and execution of prompts from the events ComfyUI sends for them.
+
+    Labels are captured when the prompt is queued, on the request thread, and
+    observations are made later by the listener thread.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._prompts = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def queued(self, prompt_id):
+        with self._lock:
+            self._prompts[prompt_id] = {'labels': metric_labels(), 'queued_at': time.time(), 'started_at': None}
+            while len(self._prompts) > self.limit:
+                self._prompts.popitem(last=False)
+
+    def dispatched(self, prompt_id):
+        """The scheduler handed a held prompt to ComfyUI."""
+        with self._lock:
+            entry = self._prompts.get(prompt_id)
+        if entry is not None:
+            observe_stage('scheduler_hold', time.time() - entry['queued_at'], entry['labels'])
+
+    def on_event(self, message):
+        prompt_id = (message.get('data') or {}).get('prompt_id')
+        with self._lock:
+            entry = self._prompts.get(prompt_id)
+            if entry is None:
+                return
+            if is_prompt_finished(message):
+                self._prompts.pop(prompt_id)
+        now = time.time()
+        if message.get('type') == 'execution_start' and entry['started_at'] is None:
+            entry['started_at'] = now
+            observe_stage('queue_wait', now - entry['queued_at'], entry['labels'])
+        elif is_prompt_finished(message):
+            # Fully cached prompts finish without an execution_start
+            observe_stage('execution', now - (entry['started_at'] or now), entry['labels'])
+
+prompt_timer = PromptTimer(METRICS_PROMPT_LIMIT)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+def count_streamed_bytes(body, labels):
+    """Pass a streamed body through, recording its size once the client has it all."""
+    size = 0
+    try:
+        for chunk in body:
+            size += len(chunk)
+            yield chunk
+    finally:
+        RESPONSE_BYTES.labels(*labels).observe(size)
+        if hasattr(body, 'close'):
+            body.close()
+
+@app.after_request
+def record_request_metrics(response):
+    if request.endpoint in (None, 'metrics', 'serve_static'):
+        return response
+    labels = metric_labels()
+    if 'request_started' in g:
+        REQUEST_SECONDS.labels(*labels, str(response.status_code)).observe(time.perf_counter() - g.request_started)
+    if response.content_length is not None:
+        RESPONSE_BYTES.labels(*labels).observe(response.content_length)
+    elif response.is_streamed:
+        response.response = count_streamed_bytes(response.response, labels)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        return jsonify({'error': 'Valid Bearer token required'}), 401
+
+    registry = prometheus_client.REGISTRY
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        # Several gunicorn workers: merge the per-process files they write
+        registry = prometheus_client.CollectorRegistry()
+        prometheus_client.multiprocess.MultiProcessCollector(registry)
+    return Response(prometheus_client.generate_latest(registry), mimetype=prometheus_client.CONTENT_TYPE_LATEST)
 
 def allowed_file(filename):
     """Check if the uploaded file has an allowed extension."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def save_base64_image(b64_string):
-    """Decode a base64 string and save it as an image in the static folder."""
+class ImageValidationError(ValueError):
+    """Raised when an input image is too large, malformed or not a supported image."""
+
+# Decode base64 in slices of this many characters (a multiple of 4) to bound memory
+BASE64_DECODE_CHUNK = 256 * 1024
+# Copy multipart uploads to disk in slices of this many bytes
+UPLOAD_COPY_CHUNK = 256 * 1024
+
+def inspect_image(image_path):
+    """Read format and dimensions from the image header only and enforce the input limits."""
     try:
-        # Handle Data URI scheme if present
-        if ',' in b64_string:
-            header, encoded = b64_string.split(',', 1)
-            ext = header.split('/')[1].split(';')[0] if '/' in header else 'png'
-        else:
-            encoded = b64_string
-            ext = 'png'
+        with Image.open(image_path) as image:
+            image_format = (image.format or '').lower()
+            width, height = image.size
+    except Exception as e:
+        raise ImageValidationError(f"Not a readable image: {e}")
+
+    if image_format not in INPUT_IMAGE_FORMATS:
+        raise ImageValidationError(f"Unsupported image format '{image_format}'")
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageValidationError(f"Image is {width}x{height}; at most {MAX_IMAGE_PIXELS} pixels are accepted")
+    return image_format, (width, height)
+
+def downscale_image(image_path, image_format, size, target_size):
+    """Shrink an image in place so it just covers target_size, the model's native resolution."""
+    scale = max(target_size[0] / size[0], target_size[1] / size[1])
+    if scale >= 1:
+        return size
+
+    new_size = (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+    with Image.open(image_path) as image:
+        resized = image.resize(new_size, Image.LANCZOS)
+    save_kwargs = {'quality': 95} if image_format in ('jpeg', 'webp') else {}
+    resized.save(image_path, format=OUTPUT_FORMATS.get(image_format, image_format.upper()), **save_kwargs)
+    print(f"Downscaled {image_path} from {size[0]}x{size[1]} to {new_size[0]}x{new_size[1]}", flush=True)
+    return new_size
+
+@timed_stage('validate_input')
+def prepare_input_image(image_path, workflow_name):
+    """Validate a saved input image and downscale it for the workflow that will consume it."""
+    image_format, size = inspect_image(image_path)
+    target_size = workflow_registry[workflow_name].input_size
+    if INPUT_DOWNSCALE and target_size:
+        size = downscale_image(image_path, image_format, size, target_size)
+    return image_format, size
+
+def static_url(path):
+    """Public URL of a file saved in STATIC_DIR, as served by the /static route."""
+    return f"{PUBLIC_BASE_URL}/static/{urllib.parse.quote(os.path.basename(path))}"
+
+@timed_stage('decode')
+def save_base64_image(b64_string):
+    """Decode a base64 string and save it as an image in the static folder.
+
+    The string is decoded slice by slice straight to disk, after checking the
+    decoded size against MAX_IMAGE_BYTES and the first bytes against the
+    supported image signatures.
+    """
+    # Handle Data URI scheme if present, without copying the payload
+    comma = b64_string.find(',', 0, 256)
+    start = comma + 1 if comma != -1 else 0
+    if any(char in b64_string for char in ' \n\r\t'):
+        b64_string, start = ''.join(b64_string[start:].split()), 0
+
+    encoded_length = len(b64_string) - start
+    if encoded_length == 0:
+        raise ImageValidationError("Empty image data")
+    if encoded_length * 3 // 4 > MAX_IMAGE_BYTES:
+        raise ImageValidationError(f"Image exceeds the {MAX_IMAGE_BYTES} byte limit")
+
+    # Ensure directory exists
+    os.makedirs(STATIC_DIR, exist_ok=True)
+    tmp_path = os.path.join(STATIC_DIR, f"{uuid.uuid4()}.part")
 
-        # Decode the image data
-        image_data = base64.b64decode(encoded)
+    try:
+        image_format = None
+        with open(tmp_path, 'wb') as f:
+            for offset in range(start, len(b64_string), BASE64_DECODE_CHUNK):
+                try:
+                    chunk = base64.b64decode(b64_string[offset:offset + BASE64_DECODE_CHUNK], validate=True)
+                except binascii.Error as e:
+                    raise ImageValidationError(f"Invalid base64 data: {e}")
+                if image_format is None:
+                    image_format = sniff_image_format(chunk)
+                    if image_format not in INPUT_IMAGE_FORMATS:
+                        raise ImageValidationError("Data is not a PNG, JPEG or WebP image")
+                f.write(chunk)
 
         # Generate a unique path for the image in the static folder
-        image_path = f"static/{uuid.uuid4()}.{ext}"
+        image_path = f"{tmp_path[:-len('.part')]}.{'jpg' if image_format == 'jpeg' else image_format}"
+        os.replace(tmp_path, image_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
-        # Ensure directory exists
-        os.makedirs('static', exist_ok=True)
+    print(f"Image saved at: {image_path}", flush=True)
 
-        # Save the image
-        with open(image_path, 'wb') as f:
-            f.write(image_data)
+    # Return the path and URL of the saved image
+    image_url = static_url(image_path)
 
-        print(f"Image saved at: {image_path}", flush=True)
+    print(f"Image path (local): {image_path}", flush=True)
+    print(f"Image URL (public): {image_url}", flush=True)
 
-        # Return the path and URL of the saved image
-        image_url = f"https://gosign-de-comfyui-api.hf.space/{image_path}"
+    return image_path, image_url
 
-        print(f"Image path (local): {image_path}", flush=True)
-        print(f"Image URL (public): {image_url}", flush=True)
+def get_request_data():
+    """Parse the JSON body, or the form fields of a multipart upload."""
+    if request.is_json:
+        return request.get_json(silent=True) or {}
+    return request.form.to_dict()
 
-        return image_path, image_url
+def save_upload_image(image_file):
+    """Save a multipart image upload to the static folder. Returns (path, public URL).
 
+    The upload is copied in slices, checking the running size against
+    MAX_IMAGE_BYTES and the first bytes against the supported image signatures.
+    """
+    if not allowed_file(image_file.filename):
+        raise ImageValidationError('Unsupported image format')
+
+    os.makedirs(STATIC_DIR, exist_ok=True)
+    image_path = os.path.join(STATIC_DIR, f"{uuid.uuid4()}_{secure_filename(image_file.filename)}")
+    tmp_path = f"{image_path}.part"
+
+    try:
+        size = 0
+        with timed('upload'), open(tmp_path, 'wb') as f:
+            while True:
+                chunk = image_file.stream.read(UPLOAD_COPY_CHUNK)
+                if not chunk:
+                    break
+                if size == 0 and sniff_image_format(chunk) not in INPUT_IMAGE_FORMATS:
+                    raise ImageValidationError("Data is not a PNG, JPEG or WebP image")
+                size += len(chunk)
+                if size > MAX_IMAGE_BYTES:
+                    raise ImageValidationError(f"Image exceeds the {MAX_IMAGE_BYTES} byte limit")
+                f.write(chunk)
+        if size == 0:
+            raise ImageValidationError("Empty image data")
+        os.replace(tmp_path, image_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return image_path, static_url(image_path)
+
+def save_request_image(data):
+    """Save the request's `image` upload or `base64_image` to static/. Returns (path, public URL) or (None, None)."""
+    image_file = request.files.get('image')
+    if image_file:
+        return save_upload_image(image_file)
+
+    if data.get('base64_image'):
+        try:
+            return save_base64_image(data['base64_image'])
+        except ImageValidationError:
+            raise
+        except Exception as e:
+            raise ImageValidationError(f'Invalid base64 image data: {str(e)}')
+    return None, None
+
+                ################################################
+                # Workflow template registry                   #
+                ################################################
+
+WORKFLOWS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'workflows')
+WORKFLOW_SCHEMAS_DIR = os.path.join(WORKFLOWS_DIR, 'schemas')
+WORKFLOW_RELOAD_INTERVAL = float(os.getenv("WORKFLOW_RELOAD_INTERVAL", "2"))
+
+def random_seed():
+    """Generate a random 15-digit seed as an integer."""
+    return random.randint(100000000000000, 999999999999999)
+
+# Each workflow is declared by workflows/schemas/<name>.json:
+#   workflow     the ComfyUI API-format JSON in workflows/ it fills in
+#   params       request-level names mapped onto one node input each, with a
+#                type and optional required/default/min/max/choices/error/format
+#   image_node   the URL loader swapped for LoadImage when the input image has
+#                been uploaded to ComfyUI directly
+#   input_size   the resolution the model works at; input images are downscaled to cover it
+#   output_node  the SaveImage node swapped for SaveImageWebsocket on WebSocket delivery
+# A default, min or max may name a runtime value from SCHEMA_REFERENCES;
+# callables are evaluated per request.
+SCHEMA_KEYS = {'description', 'workflow', 'params', 'image_node', 'input_size', 'output_node'}
+SCHEMA_PARAM_KEYS = {'node', 'input', 'type', 'required', 'default', 'min', 'max', 'choices', 'error', 'format', 'description'}
+SCHEMA_TYPES = {'string': str, 'integer': int, 'number': float}
+SCHEMA_REFERENCES = {
+    '$random_seed': random_seed,
+    '$MAX_BATCH_SIZE': MAX_BATCH_SIZE,
+}
+WORKFLOW_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-]+$')
+
+def workflow_kind(workflow):
+    return 'video' if any(node.get('class_type') == 'VHS_VideoCombine' for node in workflow.values()) else 'image'
+
+class WorkflowParameterError(ValueError):
+    """Raised when a request parameter does not satisfy its schema declaration."""
+
+def resolve_schema_value(value):
+    if isinstance(value, str) and value.startswith('$'):
+        if value not in SCHEMA_REFERENCES:
+            raise ValueError(f"Unknown schema reference '{value}'")
+        return SCHEMA_REFERENCES[value]
+    return value
+
+def compile_param(param, spec):
+    """Check one schema parameter and return a function that coerces and validates a request value."""
+    unknown = set(spec) - SCHEMA_PARAM_KEYS
+    if unknown:
+        raise ValueError(f"'{param}' has unknown keys {sorted(unknown)}")
+    if not isinstance(spec.get('node'), str) or not isinstance(spec.get('input'), str):
+        raise ValueError(f"'{param}' needs a node id and an input name")
+    if spec.get('type') not in SCHEMA_TYPES:
+        raise ValueError(f"'{param}' has type {spec.get('type')!r}; expected one of {sorted(SCHEMA_TYPES)}")
+
+    convert = SCHEMA_TYPES[spec['type']]
+    type_name = spec['type']
+    error = spec.get('error')
+    choices = spec.get('choices')
+    allowed = frozenset(convert(choice) for choice in choices) if choices is not None else None
+    low = resolve_schema_value(spec.get('min'))
+    high = resolve_schema_value(spec.get('max'))
+
+    def check(value):
+        try:
+            value = convert(value)
+        except (TypeError, ValueError):
+            raise WorkflowParameterError(error or f"{param} must be of type {type_name}")
+        if allowed is not None and value not in allowed:
+            raise WorkflowParameterError(error or f"{param} must be one of {choices}")
+        if low is not None and value < low:
+            raise WorkflowParameterError(error or f"{param} must be at least {low}")
+        if high is not None and value > high:
+            raise WorkflowParameterError(error or f"{param} must be at most {high}")
+        return value
+
+    # A constant default has to pass its own checks
+    default = resolve_schema_value(spec.get('default'))
+    if default is not None and not callable(default):
+        check(default)
+    return check
+
+class WorkflowTemplate:
+    """A workflow schema and its JSON, parsed and compiled once, reloaded when either file changes,
+    and copied cheaply per request."""
+
+    def __init__(self, name, schema_path):
+        self.name = name
+        self.schema_path = schema_path
+        self._lock = threading.Lock()
+        self._checked_at = 0
+        self.load()
+
+    def load(self):
+        mtimes = (os.path.getmtime(self.schema_path), None)
+        with open(self.schema_path, 'r', encoding='utf-8') as f:
+            schema = json.load(f)
+        unknown = set(schema) - SCHEMA_KEYS
+        if unknown:
+            raise ValueError(f"Workflow schema '{self.name}' has unknown keys {sorted(unknown)}")
+
+        path = os.path.join(WORKFLOWS_DIR, schema['workflow'])
+        mtimes = (mtimes[0], os.path.getmtime(path))
+        with open(path, 'r', encoding='utf-8') as f:
+            nodes = json.load(f)
+
+        params, validators, defaults = schema.get('params', {}), {}, {}
+        for param, spec in params.items():
+            try:
+                validators[param] = compile_param(param, spec)
+            except WorkflowParameterError as e:
+                raise ValueError(f"Workflow schema '{self.name}': default of '{param}' is invalid: {e}")
+            except ValueError as e:
+                raise ValueError(f"Workflow schema '{self.name}': {e}")
+            if spec['input'] not in nodes.get(spec['node'], {}).get('inputs', {}):
+                raise KeyError(f"Workflow '{self.name}' has no input {spec['node']}.{spec['input']} for '{param}'")
+            if 'default' in spec:
+                defaults[param] = resolve_schema_value(spec['default'])
+
+        image_node, output_node = schema.get('image_node'), schema.get('output_node')
+        for role, node_id in (('image_node', image_node), ('output_node', output_node)):
+            if node_id is not None and node_id not in nodes:
+                raise KeyError(f"Workflow '{self.name}' has no node {node_id} for its {role}")
+
+        self.path = path
+        self.description = schema.get('description', '')
+        self.params = params
+        self.validators = validators
+        self.defaults = defaults
+        self.required = [param for param, spec in params.items() if spec.get('required')]
+        self.formats = {param: spec['format'] for param, spec in params.items() if 'format' in spec}
+        self.image_node = image_node
+        self.image_param = next((param for param, spec in params.items() if spec['node'] == image_node), None)
+        self.input_size = tuple(schema['input_size']) if schema.get('input_size') else None
+        self.output_node = output_node
+        self.kind = workflow_kind(nodes)
+        # Only nodes with injectable inputs are copied per request; all other
+        # nodes are shared with the template and must be treated as read-only.
+        self.touched_nodes = sorted({spec['node'] for spec in params.values()})
+        self.nodes, self.mtimes = nodes, mtimes
+        print(f"Loaded workflow template '{self.name}' from {self.schema_path}", flush=True)
+
+    def maybe_reload(self):
+        now = time.time()
+        if now - self._checked_at < WORKFLOW_RELOAD_INTERVAL:
+            return
+        with self._lock:
+            self._checked_at = now
+            try:
+                if (os.path.getmtime(self.schema_path), os.path.getmtime(self.path)) != self.mtimes:
+                    self.load()
+            except Exception as e:
+                # Keep serving the last good template if a file is mid-write or broken
+                print(f"Failed to reload workflow '{self.name}': {e}", flush=True)
+
+    def describe(self):
+        """The schema as shown to API clients."""
+        params = {}
+        for param, spec in self.params.items():
+            info = {key: spec[key] for key in ('type', 'required', 'min', 'max', 'choices', 'description') if key in spec}
+            for key in ('min', 'max'):
+                if key in info:
+                    info[key] = resolve_schema_value(info[key])
+            default = self.defaults.get(param)
+            if default is not None:
+                info['default'] = 'random' if callable(default) else default
+            params[param] = info
+        return {'description': self.description, 'kind': self.kind, 'input_image': self.image_node is not None,
+                'websocket_output': self.output_node is not None, 'params': params}
+
+    def validate(self, **values):
+        """Coerce and check the provided values, ignoring any that are None."""
+        resolved = {}
+        for param, value in values.items():
+            check = self.validators.get(param)
+            if check is None:
+                raise WorkflowParameterError(f"Unknown parameter '{param}' for workflow '{self.name}'")
+            if value is not None:
+                resolved[param] = check(value)
+        return resolved
+
+    def prepare(self, input_image=None, websocket_output=False, **values):
+        """Return a per-request copy of the workflow with the parameters injected.
+
+        input_image is the name of an image already uploaded to ComfyUI; it
+        replaces the template's URL loader node with a LoadImage node.
+        websocket_output replaces the SaveImage node with SaveImageWebsocket.
+        """
+        self.maybe_reload()
+        resolved = self.validate(**values)
+        if input_image is not None:
+            resolved.pop(self.image_param, None)
+        for param in self.required:
+            if param not in resolved and not (input_image is not None and param == self.image_param):
+                raise WorkflowParameterError(f"{param} is required")
+        for param, default in self.defaults.items():
+            if param not in resolved and not (input_image is not None and param == self.image_param):
+                resolved[param] = default() if callable(default) else default
+        for param, template in self.formats.items():
+            if param in resolved:
+                resolved[param] = template.format(resolved[param])
+
+        nodes = self.nodes
+        workflow = dict(nodes)
+        for node_id in self.touched_nodes:
+            workflow[node_id] = dict(nodes[node_id], inputs=dict(nodes[node_id]['inputs']))
+        for param, value in resolved.items():
+            spec = self.params[param]
+            workflow[spec['node']]['inputs'][spec['input']] = value
+
+        if input_image is not None:
+            if self.image_node is None:
+                raise WorkflowParameterError(f"Workflow '{self.name}' does not take an input image")
+            # LoadImage's IMAGE output sits in the same slot as the URL loader's
+            workflow[self.image_node] = {
+                'class_type': 'LoadImage',
+                'inputs': {'image': input_image, 'upload': 'image'},
+                '_meta': {'title': 'Load Image'},
+            }
+
+        if websocket_output:
+            if self.output_node is None:
+                raise WorkflowParameterError(f"Workflow '{self.name}' cannot deliver images over the WebSocket")
+            # Same IMAGE input, but the images are sent to our socket instead of the output folder
+            workflow[self.output_node] = {
+                'class_type': 'SaveImageWebsocket',
+                'inputs': {'images': nodes[self.output_node]['inputs']['images']},
+                '_meta': {'title': 'SaveImageWebsocket'},
+            }
+        return workflow
+
+def load_workflow_registry():
+    """Compile every schema in workflows/schemas; a broken built-in schema stops the app from starting."""
+    registry = {}
+    for filename in sorted(os.listdir(WORKFLOW_SCHEMAS_DIR)):
+        name, extension = os.path.splitext(filename)
+        if extension == '.json' and WORKFLOW_NAME_PATTERN.match(name):
+            registry[name] = WorkflowTemplate(name, os.path.join(WORKFLOW_SCHEMAS_DIR, filename))
+    return registry
+
+workflow_registry = load_workflow_registry()
+
+def get_workflow_template(name):
+    """Look up a workflow, picking up schema files added since startup. Returns None if there is none."""
+    template = workflow_registry.get(name)
+    if template is not None or not WORKFLOW_NAME_PATTERN.match(name):
+        return template
+    schema_path = os.path.join(WORKFLOW_SCHEMAS_DIR, f"{name}.json")
+    if not os.path.exists(schema_path):
+        return None
+    try:
+        template = WorkflowTemplate(name, schema_path)
     except Exception as e:
-        raise ValueError(f"Failed to save image: {e}")
+        print(f"Failed to load workflow '{name}': {e}", flush=True)
+        return None
+    return workflow_registry.setdefault(name, template)
+
+def validate_workflow_params(name, **values):
+    return workflow_registry[name].validate(**values)
+
+@timed_stage('prepare')
+def prepare_workflow(name, **values):
+    if has_request_context():
+        g.workflow = name  # Labels the rest of this request's metrics
+    return workflow_registry[name].prepare(**values)
+
+def create_http_session():
+    """Build the keep-alive session used for every ComfyUI REST call."""
+    # Connection errors are retried for every method since the request never
+    # reached ComfyUI; 5xx and read errors only for idempotent GET/HEAD so a
+    # POST /prompt is never queued twice.
+    retry = Retry(
+        total=HTTP_MAX_RETRIES,
+        connect=HTTP_MAX_RETRIES,
+        read=HTTP_MAX_RETRIES,
+        status=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset({'GET', 'HEAD'}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+http_session = create_http_session()
+http_timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+                ################################################
+                # ComfyUI backend pool                         #
+                ################################################
+
+class ComfyBackend:
+    """One ComfyUI server: its REST and WebSocket addresses, weight and last known load."""
+
+    def __init__(self, address, ws_address=None, weight=1.0):
+        self.address = address.rstrip('/')
+        if not ws_address:
+            scheme, rest = self.address.split('://', 1)
+            ws_address = f"{'wss' if scheme == 'https' else 'ws'}://{rest}/ws"
+        self.ws_address = ws_address
+        self.weight = weight
+        self.healthy = True
+        self.queue_remaining = 0
+        self.held = 0  # Prompts waiting in the local scheduler for this backend
+        self.last_error = None
+        self.last_checked = None
+        self.loaded_model = ''  # Model signature of the last prompt sent here
+        self.model_switches = 0
+        self.switches_avoided = 0
+
+    def score(self, model=''):
+        """Expected wait relative to capacity; lower is better. Having `model` loaded counts as a head start."""
+        bonus = MODEL_AFFINITY_BACKEND_BONUS if model and model == self.loaded_model else 0
+        return (self.queue_remaining + self.held + 1 - bonus) / self.weight
+
+    def to_dict(self):
+        return {
+            'address': self.address,
+            'weight': self.weight,
+            'healthy': self.healthy,
+            'queue_remaining': self.queue_remaining,
+            'held': self.held,
+            'loaded_model': self.loaded_model,
+            'model_switches': self.model_switches,
+            'switches_avoided': self.switches_avoided,
+            'last_error': self.last_error,
+            'last_checked': self.last_checked
+        }
+
+def parse_backends(spec):
+    """Build the backend list from COMFYUI_BACKENDS, falling back to SERVER_ADDRESS/WS_ADDRESS."""
+    backends = []
+    for entry in spec.split(','):
+        if not entry.strip():
+            continue
+        parts = [part.strip() for part in entry.split('|')]
+        weight = float(parts[1]) if len(parts) > 1 and parts[1] else 1.0
+        if weight <= 0:
+            raise ValueError(f"Backend weight must be positive: {entry}")
+        backends.append(ComfyBackend(parts[0], parts[2] if len(parts) > 2 else None, weight))
+
+    if not backends:
+        backends.append(ComfyBackend(server_address or 'http://127.0.0.1:8188', ws_address))
+    return backends
+
+class BackendPool:
+    """Routes prompts to the least loaded healthy backend and remembers where each prompt runs.
+
+    Load comes from the listeners' status events and a background health check
+    of GET /queue. Each prompt_id is pinned to the backend it was queued on so
+    history, view and queue calls reach the right server; prompts queued by
+    another worker process are located by probing the backends once.
+    """
+
+    def __init__(self, backends, health_interval, pin_limit):
+        self.backends = backends
+        self.health_interval = health_interval
+        self.pin_limit = pin_limit
+        self._pins = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+        # Health checks skip the retrying pool so a dead server is noticed at once
+        self._health_session = requests.Session()
+
+    def start(self):
+        """Start the health check thread once per process when there is more than one backend."""
+        with self._lock:
+            if self._thread is None and len(self.backends) > 1 and self.health_interval > 0:
+                self._thread = threading.Thread(target=self._run, name='backend-health', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self.check_health()
+            time.sleep(self.health_interval)
+
+    def check_health(self):
+        for backend in self.backends:
+            # Probes never borrow a client's token: without COMFYUI_HEALTH_TOKEN they go
+            # unauthenticated, and an auth rejection still shows the server is up
+            headers = {'Authorization': f'Bearer {COMFYUI_HEALTH_TOKEN}'} if COMFYUI_HEALTH_TOKEN else {}
+            try:
+                response = self._health_session.get(f"{backend.address}/queue", headers=headers,
+                                                    timeout=BACKEND_HEALTH_TIMEOUT)
+                if response.status_code in (401, 403):
+                    queue_state = None
+                else:
+                    response.raise_for_status()
+                    queue_state = response.json()
+            except (requests.RequestException, ValueError) as e:
+                count_upstream_error('health', e)
+                self.mark_failed(backend, e)
+                continue
+
+            with self._lock:
+                if not backend.healthy:
+                    print(f"ComfyUI backend {backend.address} is healthy again", flush=True)
+                backend.healthy = True
+                backend.last_error = None
+                backend.last_checked = time.time()
+                if queue_state is not None:
+                    backend.queue_remaining = len(queue_state.get('queue_running', [])) + \
+                        len(queue_state.get('queue_pending', []))
+
+    def candidates(self, model=''):
+        """Healthy backends from least to most loaded (ties broken at random), then unhealthy ones as a last resort.
+
+        Backends that last ran `model` (a model_signature) are favoured so the
+        weights need not be swapped in VRAM.
+        """
+        with self._lock:
+            ranked = sorted(self.backends, key=lambda backend: (not backend.healthy, backend.score(model), random.random()))
+        return ranked
+
+    def choose(self):
+        return self.candidates()[0]
+
+    def mark_failed(self, backend, error):
+        with self._lock:
+            if backend.healthy:
+                print(f"ComfyUI backend {backend.address} marked unhealthy: {error}", flush=True)
+            backend.healthy = False
+            backend.last_error = str(error)
+            backend.last_checked = time.time()
+
+    def mark_queued(self, backend, prompt_id):
+        """Pin prompt_id to backend and count it towards its load until the next status update."""
+        with self._lock:
+            backend.queue_remaining += 1
+            backend.healthy = True
+        self.pin(prompt_id, backend)
+
+    def note_model(self, backend, model, previous=None):
+        """Record that a prompt loading `model` went to backend, counting a switch if it last ran another one."""
+        if not model:
+            return
+        with self._lock:
+            previous = backend.loaded_model if previous is None else previous
+            if previous and previous != model:
+                backend.model_switches += 1
+                MODEL_SWITCHES.labels(backend.address).inc()
+            backend.loaded_model = model
+
+    def pin(self, prompt_id, backend):
+        with self._lock:
+            self._pins[prompt_id] = backend
+            self._pins.move_to_end(prompt_id)
+            while len(self._pins) > self.pin_limit:
+                self._pins.popitem(last=False)
+
+    def pinned(self, prompt_id):
+        with self._lock:
+            return self._pins.get(prompt_id)
+
+    def by_address(self, address):
+        return next((backend for backend in self.backends if backend.address == address), None)
+
+    def locate(self, prompt_id, token):
+        """Find the backend that knows prompt_id from its history or queue, pinning it."""
+        headers = {'Authorization': f'Bearer {token}'}
+        for backend in self.candidates():
+            if not backend.healthy:
+                continue
+            try:
+                response = http_session.get(f"{backend.address}/history/{prompt_id}", headers=headers, timeout=http_timeout)
+                if response.ok and prompt_id in response.json():
+                    self.pin(prompt_id, backend)
+                    return backend
+
+                response = http_session.get(f"{backend.address}/queue", headers=headers, timeout=http_timeout)
+                queue_state = response.json() if response.ok else {}
+                items = queue_state.get('queue_running', []) + queue_state.get('queue_pending', [])
+                if any(item[1] == prompt_id for item in items):
+                    self.pin(prompt_id, backend)
+                    return backend
+            except (requests.RequestException, ValueError) as e:
+                print(f"Could not look up {prompt_id} on {backend.address}: {e}", flush=True)
+        return None
+
+backend_pool = BackendPool(parse_backends(COMFYUI_BACKENDS), BACKEND_HEALTH_INTERVAL, BACKEND_PIN_LIMIT)
+backend_pool.start()
+
+def backend_for_prompt(prompt_id, token):
+    """Return the backend running prompt_id, or the least loaded one if it is not known anywhere."""
+    if len(backend_pool.backends) == 1:
+        return backend_pool.backends[0]
+    if prompt_id is None:
+        return backend_pool.choose()
+    return backend_pool.pinned(prompt_id) or job_scheduler.backend_of(prompt_id) or \
+        backend_pool.locate(prompt_id, token) or backend_pool.choose()
+
+                ################################################
+                # Admission control                            #
+                ################################################
+
+class AdmissionRejected(Exception):
+    """Raised when a token may not queue more prompts right now; retry_after is in seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """Per-token token buckets and in-flight limits plus a global queue depth limit.
+
+    Once the backends' combined queue passes fair_share_at of max_queue, each
+    token may only hold its fair share of max_queue among the tokens with
+    prompts in flight, so one heavy client cannot crowd out the others.
+    Counts are per worker process.
+    """
 
-def get_image(filename, subfolder, image_type, token):
+    def __init__(self, rate, burst, max_inflight, max_queue, fair_share_at, retry_after, inflight_ttl):
+        self.rate = rate
+        self.burst = burst
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.fair_share_at = fair_share_at
+        self.retry_after = retry_after
+        self.inflight_ttl = inflight_ttl
+        self._lock = threading.Lock()
+        self._buckets = {}  # token -> [tokens, updated_at]
+        self._reserved = collections.Counter()  # token -> admitted but not yet queued
+        self._inflight = {}  # prompt_id -> (token, queued_at)
+        self.rejected = collections.Counter()
+
+    def _inflight_counts(self, now):
+        for prompt_id in [p for p, (_, queued_at) in self._inflight.items() if now - queued_at > self.inflight_ttl]:
+            del self._inflight[prompt_id]  # Completion was never seen, e.g. lost while reconnecting
+        counts = collections.Counter(token for token, _ in self._inflight.values())
+        counts.update(self._reserved)
+        return counts
+
+    def _reject(self, reason, retry_after):
+        self.rejected[reason] += 1
+        return AdmissionRejected(reason, max(1, math.ceil(retry_after)))
+
+    def admit(self, token, count=1):
+        """Reserve count prompts for token or raise AdmissionRejected."""
+        queue_depth = sum(backend.queue_remaining + backend.held for backend in backend_pool.backends)
+        now = time.time()
+        with self._lock:
+            if self.max_queue and queue_depth + count > self.max_queue:
+                raise self._reject('queue_full', self.retry_after)
+
+            counts = self._inflight_counts(now)
+            limit = self.max_inflight or math.inf
+            if self.max_queue and queue_depth >= self.fair_share_at * self.max_queue:
+                active = len([t for t, n in counts.items() if n > 0 and t != token]) + 1
+                limit = min(limit, max(1, self.max_queue // active))
+            if counts[token] + count > limit:
+                raise self._reject('too_many_in_flight', self.retry_after)
+
+            if self.rate:
+                tokens, updated_at = self._buckets.get(token, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+                if tokens < count:
+                    self._buckets[token] = [tokens, now]
+                    raise self._reject('rate_limited', (count - tokens) / self.rate)
+                self._buckets[token] = [tokens - count, now]
+                # Drop buckets that have refilled completely; they carry no state
+                if len(self._buckets) > 1000:
+                    full = [t for t, (n, at) in self._buckets.items() if n + (now - at) * self.rate >= self.burst]
+                    for stale in full:
+                        del self._buckets[stale]
+
+            self._reserved[token] += count
+
+    def bind(self, token, prompt_id):
+        """Turn one reservation into a prompt in flight."""
+        with self._lock:
+            self._reserved[token] -= 1
+            if self._reserved[token] <= 0:
+                del self._reserved[token]
+            self._inflight[prompt_id] = (token, time.time())
+
+    def cancel(self, token, count=1):
+        """Return reservations that never became prompts."""
+        with self._lock:
+            self._reserved[token] -= count
+            if self._reserved[token] <= 0:
+                del self._reserved[token]
+
+    def release(self, prompt_id):
+        with self._lock:
+            self._inflight.pop(prompt_id, None)
+
+    def stats(self):
+        with self._lock:
+            counts = self._inflight_counts(time.time())
+            return {
+                'tokens_in_flight': len([n for n in counts.values() if n > 0]),
+                'prompts_in_flight': sum(counts.values()),
+                'queue_depth': sum(backend.queue_remaining + backend.held for backend in backend_pool.backends),
+                'rejected': dict(self.rejected)
+            }
+
+admission_controller = AdmissionController(ADMISSION_RATE, ADMISSION_BURST, ADMISSION_MAX_INFLIGHT, ADMISSION_MAX_QUEUE,
+                                           ADMISSION_FAIR_SHARE_AT, ADMISSION_RETRY_AFTER, ADMISSION_INFLIGHT_TTL)
+
+@app.errorhandler(AdmissionRejected)
+def admission_rejected_response(e):
+    return jsonify({'error': 'Too many requests', 'reason': e.reason, 'retry_after': e.retry_after}), 429, \
+        {'Retry-After': str(e.retry_after)}
+
+@timed_stage('view')
+def get_image(filename, subfolder, image_type, token, prompt_id=None):
     url_values = {'filename': filename, 'subfolder': subfolder, 'type': image_type}
-    url = f"{server_address}/view?{urllib.parse.urlencode(url_values)}"
-    req = urllib.request.Request(url)
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        return urllib.request.urlopen(req).read()
-    except urllib.error.HTTPError as e:
-        print(f"HTTP Error: {e.code} - {e.reason}")
-        print(e.read())
+    url = f"{backend_for_prompt(prompt_id, token).address}/view?{urllib.parse.urlencode(url_values)}"
+    try:
+        response = http_session.get(url, headers={"Authorization": f"Bearer {token}"}, timeout=http_timeout)
+        response.raise_for_status()
+        return response.content
+    except requests.RequestException as e:
+        count_upstream_error('view', e)
+        if e.response is not None:
+            print(f"HTTP Error: {e.response.status_code} - {e.response.reason}")
+            print(e.response.content)
         raise
 
-def get_images(ws, workflow, token):
-    prompt_id = queue_prompt(workflow, token)
+                ################################################
+                # Shared ComfyUI WebSocket event listener      #
+                ################################################
+
+def is_prompt_finished(message):
+    """ComfyUI signals the end of a prompt (success or error) with an 'executing' event for node None."""
+    return message.get('type') == 'executing' and message['data'].get('node') is None
+
+# ComfyUI's binary preview event: 4-byte event type, 4-byte image format, then the image
+PREVIEW_IMAGE_EVENT = 1
+
+# prompt_id -> SaveImageWebsocket node id of prompts whose images arrive as binary frames
+websocket_outputs = {}
+
+# Runs completion callbacks so they never block the listener thread
+callback_executor = ThreadPoolExecutor(max_workers=JOB_CALLBACK_WORKERS, thread_name_prefix='prompt-callback')
+
+class PromptEventListener:
+    """One long-lived WebSocket per backend and token that hands ComfyUI events to waiting requests by prompt_id."""
+
+    def __init__(self, token, backend):
+        self.token = token
+        self.backend = backend
+        # ComfyUI only delivers prompt events to the socket registered under the
+        # client_id the prompt was queued with, so each listener owns its own id.
+        self.client_id = str(uuid.uuid4())
+        self.queue_remaining = 0
+        self.last_used = time.time()
+        # Binary frames carry no prompt_id; ComfyUI runs one prompt at a time, so
+        # they belong to the node of the last 'executing' event
+        self._executing = (None, None)
+        self._subscribers = {}
+        self._watchers = {}
+        self._backlog = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._connected = threading.Event()
+        self._closed = False
+        self._ws = None
+        self._thread = threading.Thread(target=self._run, name=f"comfyui-ws-{self.client_id[:8]}", daemon=True)
+        self._thread.start()
+
+    def wait_connected(self, timeout=WS_CONNECT_TIMEOUT):
+        if not self._connected.wait(timeout):
+            raise websocket.WebSocketException(f"Could not connect to {self.backend.ws_address} within {timeout}s")
+
+    def is_idle(self):
+        with self._lock:
+            return not self._subscribers and not self._watchers and \
+                time.time() - self.last_used > WS_LISTENER_IDLE_TIMEOUT
+
+    def subscribe(self, prompt_id, events=None):
+        """Return a queue receiving every event for prompt_id, including any that arrived early.
+
+        Passing an existing queue lets one consumer follow several prompts.
+        """
+        if events is None:
+            events = queue.Queue()
+        with self._lock:
+            self.last_used = time.time()
+            self._subscribers.setdefault(prompt_id, []).append(events)
+            for message in self._backlog.pop(prompt_id, []):
+                events.put(message)
+        return events
+
+    def unsubscribe(self, prompt_id, events):
+        with self._lock:
+            self.last_used = time.time()
+            subscribers = self._subscribers.get(prompt_id, [])
+            if events in subscribers:
+                subscribers.remove(events)
+            if not subscribers:
+                self._subscribers.pop(prompt_id, None)
+
+    def on_complete(self, prompt_id, callback):
+        """Run callback() on a worker thread once prompt_id has finished executing."""
+        with self._lock:
+            self.last_used = time.time()
+            if any(is_prompt_finished(message) for message in self._backlog.get(prompt_id, [])):
+                callback_executor.submit(callback)
+            else:
+                self._watchers.setdefault(prompt_id, []).append(callback)
+
+    def _check_watchers(self):
+        """After a reconnect, fire callbacks of watched prompts that finished while we were away."""
+        with self._lock:
+            watched = list(self._watchers)
+
+        for prompt_id in watched:
+            try:
+                finished = prompt_id in (get_history(prompt_id, self.token) or {})
+            except Exception:
+                finished = False
+            if finished:
+                with self._lock:
+                    callbacks = self._watchers.pop(prompt_id, [])
+                for callback in callbacks:
+                    callback_executor.submit(callback)
+
+    def _settle_tasks(self):
+        """After a reconnect, save the outcome of stored tasks that finished while we were away."""
+        try:
+            for prompt_id in job_store.unfinished(self.client_id):
+                history = (get_history(prompt_id, self.token) or {}).get(prompt_id)
+                if history:
+                    job_store.settle(prompt_id, history)
+        except Exception as e:
+            print(f"Failed to settle tasks after reconnect: {e}", flush=True)
+
+    def inject_failure(self, prompt_id, error):
+        """Deliver a failure for a prompt that never reached ComfyUI as if ComfyUI had reported it."""
+        self._dispatch({'type': 'execution_error', 'data': {'prompt_id': prompt_id, 'exception_type': 'PromptNotQueued',
+                                                            'exception_message': str(error)}})
+        self._dispatch({'type': 'executing', 'data': {'node': None, 'prompt_id': prompt_id}})
+
+    def inject_interrupted(self, prompt_id):
+        """Report a prompt removed from a queue before it ran the way ComfyUI reports interrupted ones."""
+        self._dispatch({'type': 'execution_interrupted', 'data': {'prompt_id': prompt_id}})
+        self._dispatch({'type': 'executing', 'data': {'node': None, 'prompt_id': prompt_id}})
+
+    def close(self):
+        self._closed = True
+        if self._ws is not None:
+            try:
+                self._ws.close()
+            except Exception:
+                pass
+
+    def _dispatch(self, message):
+        data = message.get('data') or {}
+        if message.get('type') == 'status':
+            self.queue_remaining = data.get('status', {}).get('exec_info', {}).get('queue_remaining', 0)
+            self.backend.queue_remaining = self.queue_remaining
+            self._broadcast(message)  # Lets progress streams refresh queue positions
+            return
+
+        prompt_id = data.get('prompt_id')
+        if prompt_id is None:
+            return
+
+        prompt_timer.on_event(message)
+        try:
+            # Recorded before waiters hear of it, so a finished prompt is always in the store
+            job_store.on_event(message)
+        except Exception as e:
+            print(f"Job store update for {prompt_id} failed: {e}", flush=True)
+        if message.get('type') == 'executing':
+            self._executing = (prompt_id, data.get('node'))
+        if is_prompt_finished(message):
+            websocket_outputs.pop(prompt_id, None)
+            admission_controller.release(prompt_id)
+            callback_executor.submit(job_scheduler.finish, prompt_id)
+
+        with self._lock:
+            if is_prompt_finished(message):
+                for callback in self._watchers.pop(prompt_id, []):
+                    callback_executor.submit(callback)
+
+            subscribers = self._subscribers.get(prompt_id)
+            if subscribers:
+                for events in subscribers:
+                    events.put(message)
+                return
+
+            # Nobody is waiting yet (the prompt may still be on its way back from
+            # /prompt), so keep a bounded backlog that subscribe() replays.
+            self._backlog.setdefault(prompt_id, []).append(message)
+            self._backlog.move_to_end(prompt_id)
+            while len(self._backlog) > WS_EVENT_BACKLOG:
+                self._backlog.popitem(last=False)
+
+    def _dispatch_image(self, frame):
+        """Turn a SaveImageWebsocket frame into an 'output_image' event; sampler previews are dropped."""
+        prompt_id, node = self._executing
+        if len(frame) < 8 or prompt_id is None or websocket_outputs.get(prompt_id) != node:
+            return
+        event_type, image_format = struct.unpack('>II', frame[:8])
+        if event_type == PREVIEW_IMAGE_EVENT:
+            self._dispatch({'type': 'output_image', 'data': {'prompt_id': prompt_id, 'node': node, 'image': frame[8:]}})
+
+    def _broadcast(self, message):
+        with self._lock:
+            for subscribers in self._subscribers.values():
+                for events in subscribers:
+                    events.put(message)
+
+    def _run(self):
+        delay = WS_RECONNECT_DELAY
+        reconnecting = False
+
+        while not self._closed:
+            ws = websocket.WebSocket()
+            try:
+                ws.connect(f"{self.backend.ws_address}?clientId={self.client_id}&token={self.token}",
+                           header={"Authorization": f"Bearer {self.token}"},
+                           timeout=WS_CONNECT_TIMEOUT)
+                # Wake up between frames to ping, so a silently dropped connection is noticed
+                ws.settimeout(WS_PING_INTERVAL or None)
+            except Exception as e:
+                print(f"WebSocket connection failed: {e}", flush=True)
+                count_upstream_error('ws_connect', e)
+                time.sleep(delay)
+                delay = min(delay * 2, WS_RECONNECT_MAX_DELAY)
+                continue
+
+            self._ws = ws
+            self._connected.set()
+            job_store.heartbeat(self.client_id)
+            delay = WS_RECONNECT_DELAY
+
+            # Events sent while we were disconnected are lost, so tell waiters to
+            # double-check the history of their prompt.
+            if reconnecting:
+                self._broadcast({'type': 'reconnected', 'data': {}})
+                callback_executor.submit(self._check_watchers)
+                callback_executor.submit(self._settle_tasks)
+
+            try:
+                last_frame = time.time()
+                while not self._closed:
+                    try:
+                        opcode, data = ws.recv_data(control_frame=True)
+                    except websocket.WebSocketTimeoutException:
+                        if time.time() - last_frame > WS_PING_TIMEOUT:
+                            raise websocket.WebSocketTimeoutException(f"No frames from ComfyUI for {WS_PING_TIMEOUT}s")
+                        ws.ping()
+                        job_store.heartbeat(self.client_id)
+                        continue
+                    last_frame = time.time()  # Pongs count too
+                    job_store.heartbeat(self.client_id)
+                    if opcode == websocket.ABNF.OPCODE_TEXT:
+                        self._dispatch(json.loads(data.decode('utf-8')))
+                    elif opcode == websocket.ABNF.OPCODE_BINARY:
+                        self._dispatch_image(data)
+                    elif opcode == websocket.ABNF.OPCODE_CLOSE:
+                        raise websocket.WebSocketConnectionClosedException("ComfyUI closed the WebSocket")
+            except Exception as e:
+                if not self._closed:
+                    print(f"WebSocket connection lost: {e}", flush=True)
+                    count_upstream_error('ws', e)
+            finally:
+                self._connected.clear()
+                self._ws = None
+                try:
+                    ws.close()
+                except Exception:
+                    pass
+
+            reconnecting = True
+
+
+_listeners = {}
+_listeners_lock = threading.Lock()
+
+def get_listener(token, backend=None):
+    """Return the connected shared listener for a backend and token, starting it on first use."""
+    backend = backend or backend_pool.choose()
+    key = (backend.address, token)
+    with _listeners_lock:
+        for idle_key in [k for k, l in _listeners.items() if k != key and l.is_idle()]:
+            _listeners.pop(idle_key).close()
+
+        listener = _listeners.get(key)
+        if listener is None:
+            listener = _listeners[key] = PromptEventListener(token, backend)
+
+    if listener._connected.is_set():
+        return listener
+    with timed('ws_connect'):
+        listener.wait_connected()
+    return listener
+
+def find_listener(client_id):
+    """Return this process's listener registered under client_id, if any."""
+    with _listeners_lock:
+        return next((l for l in _listeners.values() if l.client_id == client_id), None)
+
+def get_prompt_listener(prompt_id, token):
+    """Return the shared listener of the backend prompt_id runs on."""
+    return get_listener(token, backend_for_prompt(prompt_id, token))
+
+def submit_prompt(workflow, token, backend=None, prompt_id=None):
+    """Queue a workflow and subscribe to its events. Returns (listener, prompt_id, events)."""
+    # Newer ComfyUI builds accept a client-chosen prompt_id. Events that arrive
+    # before we subscribe are kept in the listener's backlog and replayed.
+    prompt_id = queue_prompt(workflow, token, prompt_id=prompt_id or str(uuid.uuid4()), backend=backend)
+    listener = get_prompt_listener(prompt_id, token)
+    return listener, prompt_id, listener.subscribe(prompt_id)
+
+class PromptFailed(Exception):
+    """A prompt ended without outputs: ComfyUI reported an error, it was interrupted, or it never got queued."""
+    status_code = 502
+
+    def __init__(self, prompt_id, message):
+        super().__init__(message)
+        self.prompt_id = prompt_id
+
+class PromptTimeout(PromptFailed):
+    status_code = 504
+
+class ClientDisconnected(PromptFailed):
+    status_code = 499
+
+@app.errorhandler(PromptFailed)
+def prompt_failed_response(e):
+    return jsonify({'error': str(e), 'prompt_id': e.prompt_id}), e.status_code
+
+def prompt_timeout(workflow):
+    return VIDEO_PROMPT_TIMEOUT if workflow_kind(workflow) == 'video' else IMAGE_PROMPT_TIMEOUT
+
+def client_disconnect_probe():
+    """Return a callable telling whether the current request's client has hung up, or None if that cannot be known.
+
+    Only gunicorn exposes the client socket. A socket that is readable but has
+    nothing to read has been closed by the peer.
+    """
+    sock = request.environ.get('gunicorn.socket') if has_request_context() else None
+    if not CANCEL_ON_DISCONNECT or sock is None or isinstance(sock, ssl.SSLSocket):
+        return None
+
+    def disconnected():
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+        except (OSError, ValueError):
+            return True
+    return disconnected
+
+def cancel_prompt(prompt_id, token, reason):
+    """Stop a prompt nobody is waiting for: drop it from the local or ComfyUI queue, or interrupt it if it is running."""
+    outcome = 'finished'
+    try:
+        if job_scheduler.cancel(prompt_id):
+            outcome = 'dequeued'
+        else:
+            backend = backend_for_prompt(prompt_id, token)
+            headers = {'Authorization': f'Bearer {token}'}
+            queue_state = make_request(f"{backend.address}/queue", headers=headers) or {}
+            if any(item[1] == prompt_id for item in queue_state.get('queue_running', [])):
+                # ComfyUI reports execution_interrupted and the end of the prompt itself
+                http_session.post(f"{backend.address}/interrupt", json={'prompt_id': prompt_id},
+                                  headers=headers, timeout=http_timeout).raise_for_status()
+                outcome = 'interrupted'
+            elif any(item[1] == prompt_id for item in queue_state.get('queue_pending', [])):
+                http_session.post(f"{backend.address}/queue", json={'delete': [prompt_id]},
+                                  headers=headers, timeout=http_timeout).raise_for_status()
+                # Deleted prompts produce no events, so settle waiters, admission and the scheduler here
+                get_listener(token, backend).inject_interrupted(prompt_id)
+                outcome = 'deleted'
+    except Exception as e:
+        count_upstream_error('cancel', e)
+        print(f"Failed to cancel prompt {prompt_id}: {e}", flush=True)
+        outcome = 'error'
+    print(f"Cancelled prompt {prompt_id} ({reason}): {outcome}", flush=True)
+    CANCELLED_PROMPTS.labels(reason, outcome).inc()
+    return outcome
+
+def wait_for_prompt(listener, prompt_id, events, token, timeout=None, disconnected=None, images=None):
+    """Block until ComfyUI reports that prompt_id has finished executing.
+
+    Raises PromptFailed if it errors or is interrupted. If the timeout passes or
+    disconnected() turns true first, the prompt is cancelled and PromptTimeout
+    or ClientDisconnected is raised. Images received over the WebSocket are
+    appended to the images list.
+    """
+    deadline = time.time() + timeout if timeout else None
+    try:
+        while True:
+            wait = DISCONNECT_CHECK_INTERVAL if disconnected else None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    cancel_prompt(prompt_id, token, 'timeout')
+                    raise PromptTimeout(prompt_id, f"Prompt did not finish within {timeout:g}s")
+                wait = min(wait or remaining, remaining)
+            try:
+                message = events.get(timeout=wait)
+            except queue.Empty:
+                if disconnected is not None and disconnected():
+                    cancel_prompt(prompt_id, token, 'disconnect')
+                    raise ClientDisconnected(prompt_id, 'Client disconnected')
+                continue
+
+            if is_prompt_finished(message):
+                return
+            if message['type'] == 'output_image' and images is not None:
+                images.append(message['data']['image'])
+            if message['type'] == 'execution_error':
+                raise PromptFailed(prompt_id, execution_error_message(message['data']))
+            if message['type'] == 'execution_interrupted':
+                raise PromptFailed(prompt_id, 'Prompt was interrupted')
+            if message['type'] == 'reconnected' and prompt_id in (get_history(prompt_id, token) or {}):
+                return
+    finally:
+        listener.unsubscribe(prompt_id, events)
+
+def run_workflow(workflow, token, backend=None):
+    """Queue a workflow and block until it has finished. Returns the prompt_id."""
+    listener, prompt_id, events = submit_prompt(workflow, token, backend)
+    wait_for_prompt(listener, prompt_id, events, token, prompt_timeout(workflow), client_disconnect_probe())
+    return prompt_id
+
+def run_websocket_workflow(workflow, token, backend=None):
+    """Run a workflow prepared with websocket_output=True and collect its images from binary frames.
+
+    Returns (prompt_id, images). The images never touch ComfyUI's output folder,
+    so neither /history nor /view is called, and they cannot be fetched later.
+    """
+    prompt_id = str(uuid.uuid4())
+    websocket_outputs[prompt_id] = next(node_id for node_id, node in workflow.items()
+                                        if node['class_type'] == 'SaveImageWebsocket')
+    images = []
+    try:
+        listener, prompt_id, events = submit_prompt(workflow, token, backend, prompt_id)
+        wait_for_prompt(listener, prompt_id, events, token, prompt_timeout(workflow), client_disconnect_probe(), images)
+    finally:
+        websocket_outputs.pop(prompt_id, None)
+    if not images:
+        # A WebSocket reconnect mid-run loses the frames along with the other events
+        raise PromptFailed(prompt_id, 'No images were received over the WebSocket')
+    return prompt_id, images
+
+def get_output_images(prompt_id, token):
+    """List (node_id, image) references of a finished prompt, from the result cache or its history."""
+    cached = result_cache.list(prompt_id)
+    if cached is not None:
+        return [(entry['node_id'], {'filename': entry['filename'], 'subfolder': entry['subfolder'], 'type': entry['type']})
+                for entry in cached if 'node_id' in entry]
+
+    task = job_store.get(prompt_id)
+    if task and task['status'] == 'completed' and task['outputs_complete'] and task['outputs']:
+        history = {'outputs': task['outputs']}
+    else:
+        history = get_history(prompt_id, token)[prompt_id]
+    return [(node_id, image)
+            for node_id, node_output in history['outputs'].items()
+            for image in node_output.get('images', [])]
+
+def get_images(workflow, token):
+    prompt_id = run_workflow(workflow, token)
     output_images = {}
 
-    while True:
-        out = ws.recv()
-        if isinstance(out, str):
-            message = json.loads(out)
-            if message['type'] == 'executing':
-                data = message['data']
-                if data['node'] is None and data['prompt_id'] == prompt_id:
-                    break  # Execution is done
-
-    history = get_history(prompt_id, token)[prompt_id]
-    for node_id in history['outputs']:
-        node_output = history['outputs'][node_id]
-        images_output = []
-        if 'images' in node_output:
-            for image in node_output['images']:
-                image_data = get_image(image['filename'], image['subfolder'], image['type'], token)
-                images_output.append(image_data)
-        output_images[node_id] = images_output
+    for node_id, image in get_output_images(prompt_id, token):
+        image_data = get_image(image['filename'], image['subfolder'], image['type'], token, prompt_id)
+        output_images.setdefault(node_id, []).append(image_data)
 
     return output_images
 
+                ################################################
+                # Local job scheduler                          #
+                ################################################
+
+# Lower runs first. Interactive jobs have a client waiting on the response;
+# batch jobs are async, webhook or batch-endpoint work.
+JOB_CLASS_PRIORITIES = {
+    'interactive_image': 0,
+    'batch_image': 1,
+    'interactive_video': 2,
+    'batch_video': 3,
+}
+
+def estimate_cost(workflow):
+    """Rough GPU cost of a workflow: sampler steps x megapixels x frames (or batch size)."""
+    steps, pixels, frames = 1, 0, 1
+    for node in workflow.values():
+        inputs = node.get('inputs', {})
+        numbers = {key: value for key, value in inputs.items() if isinstance(value, (int, float)) and not isinstance(value, bool)}
+        steps = max(steps, numbers.get('steps', 0), numbers.get('num_inference_steps', 0))
+        pixels = max(pixels, numbers.get('width', 0) * numbers.get('height', 0))
+        frames = max(frames, numbers.get('num_frames', 0), numbers.get('batch_size', 0))
+    return steps * (pixels or 1024 * 1024) / 1e6 * frames
+
+# Loader nodes and the inputs that decide which weights end up in VRAM
+MODEL_LOADER_INPUTS = {
+    'CheckpointLoaderSimple': ('ckpt_name',),
+    'UNETLoader': ('unet_name', 'weight_dtype'),
+    'VAELoader': ('vae_name',),
+    'CLIPLoader': ('clip_name', 'type'),
+    'DualCLIPLoader': ('clip_name1', 'clip_name2', 'type'),
+    'LoraLoader': ('lora_name',),
+    'DownloadAndLoadCogVideoModel': ('model', 'precision', 'fp8_transformer'),
+    'ailab_OmniGen': ('model_precision',),
+}
+
+def model_signature(workflow):
+    """Identify the weights a workflow loads, e.g. 'CheckpointLoaderSimple:flux1-dev-fp8.safetensors'.
+
+    Prompts with equal signatures can run back to back without a model swap.
+    Returns '' for workflows without known loader nodes.
+    """
+    parts = set()
+    for node in workflow.values():
+        names = MODEL_LOADER_INPUTS.get(node.get('class_type'))
+        if names:
+            inputs = node.get('inputs', {})
+            values = [str(inputs[name]) for name in names if isinstance(inputs.get(name), (str, int, float))]
+            parts.add(f"{node['class_type']}:{','.join(values)}")
+    return '|'.join(sorted(parts))
+
+class JobScheduler:
+    """Durable SQLite queue that feeds each backend a bounded number of prompts by priority.
+
+    Jobs keep the prompt_id they were given at enqueue time and the client_id
+    of the enqueuing process's listener, so events reach the right waiter
+    whichever process dispatches them. Each process dispatches its own jobs
+    and adopts those of processes whose heartbeat has gone stale. Waiting
+    jobs age into higher priority every `aging` seconds so videos still run
+    under a steady stream of images.
+
+    Within a backend, a job that loads the same model as the backend's last
+    dispatched job may overtake the head of the queue, as long as the head
+    has waited less than `affinity_wait` seconds.
+    """
+
+    def __init__(self, path, enabled, max_dispatched, poll_interval, aging, reconcile_interval, owner_timeout, retention,
+                 affinity_wait, affinity_lookahead):
+        self.path = path
+        self.enabled = enabled
+        self.max_dispatched = max_dispatched
+        self.poll_interval = poll_interval
+        self.aging = aging
+        self.reconcile_interval = reconcile_interval
+        self.owner_timeout = owner_timeout
+        self.retention = retention
+        self.affinity_wait = affinity_wait
+        self.affinity_lookahead = max(1, affinity_lookahead)
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._wake = threading.Event()
+        self._thread = None
+        self._reconciled_at = 0
+        if enabled:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with self._connect() as db:
+                db.execute("PRAGMA journal_mode=WAL")
+                db.executescript("""
+                    CREATE TABLE IF NOT EXISTS jobs (
+                        prompt_id TEXT PRIMARY KEY,
+                        owner TEXT NOT NULL,
+                        client_id TEXT NOT NULL,
+                        token TEXT NOT NULL,
+                        token_hash TEXT NOT NULL DEFAULT '',
+                        backend TEXT NOT NULL,
+                        job_class TEXT NOT NULL,
+                        priority INTEGER NOT NULL,
+                        cost REAL NOT NULL,
+                        workflow TEXT,
+                        model TEXT NOT NULL DEFAULT '',
+                        status TEXT NOT NULL,
+                        error TEXT,
+                        created_at REAL NOT NULL,
+                        dispatched_at REAL,
+                        finished_at REAL
+                    );
+                    CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, backend, priority, created_at);
+                    CREATE TABLE IF NOT EXISTS workers (owner TEXT PRIMARY KEY, heartbeat_at REAL NOT NULL);
+                """)
+                try:
+                    # Queues created before model affinity existed
+                    db.execute("ALTER TABLE jobs ADD COLUMN model TEXT NOT NULL DEFAULT ''")
+                except sqlite3.OperationalError:
+                    pass
+                try:
+                    # Queues that grouped fair share by the raw token
+                    db.execute("ALTER TABLE jobs ADD COLUMN token_hash TEXT NOT NULL DEFAULT ''")
+                    for row in db.execute("SELECT prompt_id, token FROM jobs WHERE token != ''").fetchall():
+                        db.execute("UPDATE jobs SET token_hash = ? WHERE prompt_id = ?", (token_hash(row['token']), row['prompt_id']))
+                    db.execute("UPDATE jobs SET token = '' WHERE status != 'queued'")
+                except sqlite3.OperationalError:
+                    pass
+                db.execute("DROP INDEX IF EXISTS jobs_by_token")
+                db.execute("CREATE INDEX IF NOT EXISTS jobs_by_dispatch ON jobs (backend, dispatched_at)")
+                db.execute("CREATE INDEX IF NOT EXISTS jobs_by_token_hash ON jobs (token_hash, backend, dispatched_at)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # Autocommit connection per call; sqlite3 objects must not cross threads
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def start(self):
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='job-scheduler', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                self.dispatch()
+                if time.time() - self._reconciled_at > self.reconcile_interval:
+                    self._reconciled_at = time.time()
+                    self.reconcile()
+            except Exception as e:
+                print(f"Job scheduler error: {e}", flush=True)
+
+    def enqueue(self, workflow, token, prompt_id=None, backend=None, interactive=True):
+        """Hold a workflow for dispatch and return its prompt_id."""
+        prompt_id = prompt_id or str(uuid.uuid4())
+        job_class = f"{'interactive' if interactive else 'batch'}_{workflow_kind(workflow)}"
+        model = model_signature(workflow)
+
+        # Bind to a backend now: waiters subscribe to that backend's listener
+        last_error = None
+        for candidate in ([backend] if backend else backend_pool.candidates(model)):
+            try:
+                listener = get_listener(token, candidate)
+            except websocket.WebSocketException as e:
+                backend_pool.mark_failed(candidate, e)
+                last_error = e
+                continue
+
+            with self._connect() as db:
+                db.execute(
+                    "INSERT INTO jobs (prompt_id, owner, client_id, token, token_hash, backend, job_class, priority, cost,"
+                    " workflow, model, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'queued', ?)",
+                    (prompt_id, self.owner, listener.client_id, token, token_hash(token), candidate.address, job_class,
+                     JOB_CLASS_PRIORITIES[job_class], estimate_cost(workflow), json.dumps(workflow), model, time.time()))
+            candidate.held += 1
+            backend_pool.pin(prompt_id, candidate)
+            self._wake.set()
+            return prompt_id
+
+        raise last_error
+
+    def dispatch(self):
+        """Send the best waiting jobs to every backend with free dispatch slots."""
+        now = time.time()
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO workers (owner, heartbeat_at) VALUES (?, ?)", (self.owner, now))
+            held = dict(db.execute("SELECT backend, COUNT(*) FROM jobs WHERE status = 'queued' GROUP BY backend").fetchall())
+        for backend in backend_pool.backends:
+            backend.held = held.get(backend.address, 0)
+
+        for backend in backend_pool.backends:
+            while True:
+                job = self._claim(backend)
+                if job is None or not self._send(job, backend):
+                    break
+
+    def _claim(self, backend):
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                (dispatched,) = db.execute("SELECT COUNT(*) FROM jobs WHERE backend = ? AND status = 'dispatched'",
+                                           (backend.address,)).fetchone()
+                if dispatched >= self.max_dispatched:
+                    return None
+                # Within a class, tokens take turns: each token's next job competes,
+                # and the token served longest ago goes first
+                jobs = db.execute(
+                    "WITH waiting AS ("
+                    "  SELECT *, MAX(0, priority - CAST((? - created_at) / ? AS INTEGER)) AS effective FROM jobs"
+                    "  WHERE backend = ? AND status = 'queued'"
+                    "  AND (owner = ? OR owner NOT IN (SELECT owner FROM workers WHERE heartbeat_at > ?)))"
+                    " SELECT *, ROW_NUMBER() OVER (PARTITION BY token_hash, effective ORDER BY cost, created_at) AS turn,"
+                    "  (SELECT MAX(dispatched_at) FROM jobs AS served WHERE served.backend = waiting.backend"
+                    "   AND served.token_hash = waiting.token_hash) AS last_served"
+                    " FROM waiting ORDER BY effective, turn, COALESCE(last_served, 0), cost, created_at LIMIT ?",
+                    (now, self.aging, backend.address, self.owner, now - self.owner_timeout,
+                     self.affinity_lookahead if self.affinity_wait > 0 else 1)).fetchall()
+                if not jobs:
+                    return None
+
+                # Whichever process dispatched last, the newest dispatched job tells what the backend has loaded
+                last = db.execute("SELECT model FROM jobs WHERE backend = ? AND dispatched_at IS NOT NULL"
+                                  " ORDER BY dispatched_at DESC LIMIT 1", (backend.address,)).fetchone()
+                loaded = last['model'] if last and last['model'] else backend.loaded_model
+                job = jobs[0]
+                if loaded and job['model'] and job['model'] != loaded and now - job['created_at'] < self.affinity_wait:
+                    # Only within the head's class: affinity must not let a video overtake waiting images
+                    same_model = next((other for other in jobs[1:]
+                                       if other['model'] == loaded and other['effective'] == job['effective']), None)
+                    if same_model is not None:
+                        job = same_model
+                        backend.switches_avoided += 1
+                        MODEL_SWITCHES_AVOIDED.labels(backend.address).inc()
+                backend_pool.note_model(backend, job['model'], loaded)
+                db.execute("UPDATE jobs SET status = 'dispatched', owner = ?, dispatched_at = ? WHERE prompt_id = ?",
+                           (self.owner, now, job['prompt_id']))
+                return job
+            finally:
+                db.execute("COMMIT")
+
+    def _send(self, job, backend):
+        """POST a claimed job; returns False when the backend is unreachable and dispatch should pause."""
+        payload = {'prompt': json.loads(job['workflow']), 'client_id': job['client_id'], 'prompt_id': job['prompt_id']}
+        try:
+            queued_id = post_prompt(backend, payload, job['token'])
+        except requests.ConnectionError as e:
+            # Put the job back; it is retried once the backend answers again
+            backend_pool.mark_failed(backend, e)
+            with self._connect() as db:
+                db.execute("UPDATE jobs SET status = 'queued', dispatched_at = NULL WHERE prompt_id = ?", (job['prompt_id'],))
+            return False
+        except Exception as e:
+            self._fail(job, e)
+            return True
+
+        if queued_id != job['prompt_id']:
+            # Waiters, the job store and the listener only know our id, so the
+            # prompt could never be tracked; drop it rather than run it blind
+            try:
+                http_session.post(f"{backend.address}/queue", json={'delete': [queued_id]},
+                                  headers={'Authorization': f"Bearer {job['token']}"}, timeout=http_timeout)
+            except requests.RequestException as e:
+                print(f"Failed to delete untracked prompt {queued_id}: {e}", flush=True)
+            self._fail(job, f"ComfyUI ignored prompt_id {job['prompt_id']} and queued it as {queued_id}; "
+                            "the scheduler needs a ComfyUI build that accepts client prompt ids")
+            return True
+        backend_pool.mark_queued(backend, job['prompt_id'])
+        prompt_timer.dispatched(job['prompt_id'])
+        # The bearer token was only kept to submit the prompt
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET token = '' WHERE prompt_id = ?", (job['prompt_id'],))
+        return True
+
+    def _fail(self, job, error):
+        print(f"Job {job['prompt_id']} failed: {error}", flush=True)
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET status = 'failed', error = ?, token = '', workflow = NULL, finished_at = ?"
+                       " WHERE prompt_id = ?",
+                       (str(error), time.time(), job['prompt_id']))
+        listener = find_listener(job['client_id'])
+        if listener is not None:
+            listener.inject_failure(job['prompt_id'], error)
+
+    def cancel(self, prompt_id):
+        """Drop a job still held locally. Returns False once it has been dispatched (or was never held)."""
+        if not self.enabled:
+            return False
+        with self._connect() as db:
+            cursor = db.execute("UPDATE jobs SET status = 'failed', error = 'Cancelled', token = '', workflow = NULL, finished_at = ?"
+                                " WHERE prompt_id = ? AND status = 'queued'", (time.time(), prompt_id))
+            job = db.execute("SELECT client_id FROM jobs WHERE prompt_id = ?", (prompt_id,)).fetchone()
+        if not cursor.rowcount:
+            return False
+        listener = find_listener(job['client_id'])
+        if listener is not None:
+            listener.inject_interrupted(prompt_id)
+        return True
+
+    def finish(self, prompt_id):
+        """Free the dispatch slot of a prompt ComfyUI has finished."""
+        if not self.enabled:
+            return
+        with self._connect() as db:
+            cursor = db.execute("UPDATE jobs SET status = 'done', token = '', workflow = NULL, finished_at = ?"
+                                " WHERE prompt_id = ? AND status = 'dispatched'", (time.time(), prompt_id))
+        if cursor.rowcount:
+            self._wake.set()
+
+    def reconcile(self):
+        """Settle dispatched jobs whose completion event was missed, and purge old finished jobs."""
+        now = time.time()
+        with self._connect() as db:
+            jobs = db.execute(
+                "SELECT * FROM jobs WHERE status = 'dispatched' AND dispatched_at < ?"
+                " AND (owner = ? OR owner NOT IN (SELECT owner FROM workers WHERE heartbeat_at > ?))",
+                (now - self.reconcile_interval, self.owner, now - self.owner_timeout)).fetchall()
+            db.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (now - self.retention,))
+            db.execute("DELETE FROM workers WHERE heartbeat_at < ?", (now - self.retention,))
+
+        for job in jobs:
+            backend = backend_pool.by_address(job['backend'])
+            if backend is None:
+                self._fail(job, 'Backend was removed from COMFYUI_BACKENDS')
+                continue
+            # Dispatched jobs no longer hold the client's token; use the service token if there is one
+            headers = {'Authorization': f"Bearer {COMFYUI_HEALTH_TOKEN}"} if COMFYUI_HEALTH_TOKEN else {}
+            try:
+                response = http_session.get(f"{backend.address}/history/{job['prompt_id']}", headers=headers, timeout=http_timeout)
+                response.raise_for_status()
+                if job['prompt_id'] in response.json():
+                    self.finish(job['prompt_id'])
+                    continue
+                response = http_session.get(f"{backend.address}/queue", headers=headers, timeout=http_timeout)
+                response.raise_for_status()
+                queue_state = response.json()
+            except (requests.RequestException, ValueError):
+                continue
+            items = queue_state.get('queue_running', []) + queue_state.get('queue_pending', [])
+            if not any(item[1] == job['prompt_id'] for item in items):
+                self._fail(job, 'Prompt disappeared from the ComfyUI queue')
+
+    def backend_of(self, prompt_id):
+        """Return the backend a job was bound to, for prompts enqueued by another process."""
+        if not self.enabled:
+            return None
+        with self._connect() as db:
+            row = db.execute("SELECT backend FROM jobs WHERE prompt_id = ?", (prompt_id,)).fetchone()
+        backend = backend_pool.by_address(row['backend']) if row else None
+        if backend is not None:
+            backend_pool.pin(prompt_id, backend)
+        return backend
+
+    def failure(self, prompt_id):
+        """Return the error of a job that failed before ComfyUI ran it, else None."""
+        if not self.enabled:
+            return None
+        with self._connect() as db:
+            row = db.execute("SELECT error FROM jobs WHERE prompt_id = ? AND status = 'failed'", (prompt_id,)).fetchone()
+        return row['error'] if row else None
+
+    def position(self, prompt_id):
+        """Return how many held jobs run before prompt_id, or None if it is not held locally."""
+        if not self.enabled:
+            return None
+        with self._connect() as db:
+            job = db.execute("SELECT backend, priority, cost, created_at FROM jobs WHERE prompt_id = ? AND status = 'queued'",
+                             (prompt_id,)).fetchone()
+            if job is None:
+                return None
+            (ahead,) = db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE backend = ? AND status = 'queued'"
+                " AND (priority < ? OR (priority = ? AND created_at < ?))",
+                (job['backend'], job['priority'], job['priority'], job['created_at'])).fetchone()
+        return ahead
+
+    def stats(self):
+        if not self.enabled:
+            return {'enabled': False}
+        with self._connect() as db:
+            rows = db.execute("SELECT status, job_class, COUNT(*) AS jobs FROM jobs GROUP BY status, job_class").fetchall()
+        counts = {}
+        for row in rows:
+            counts.setdefault(row['status'], {})[row['job_class']] = row['jobs']
+        return {'enabled': True, 'max_dispatched': self.max_dispatched, 'jobs': counts}
+
+job_scheduler = JobScheduler(SCHEDULER_DB, SCHEDULER_ENABLED, SCHEDULER_MAX_DISPATCHED, SCHEDULER_POLL_INTERVAL, SCHEDULER_AGING,
+                             SCHEDULER_RECONCILE_INTERVAL, SCHEDULER_OWNER_TIMEOUT, SCHEDULER_RETENTION,
+                             MODEL_AFFINITY_MAX_WAIT, MODEL_AFFINITY_LOOKAHEAD)
+job_scheduler.start()
+
+                ################################################
+                # Durable task state store                     #
+                ################################################
+
+TERMINAL_TASK_STATUSES = ('completed', 'failed', 'interrupted')
+
+def execution_error_message(data):
+    """Format an execution_error event the way it is reported to clients."""
+    error = data.get('exception_message', 'Prompt failed')
+    return f"{data['node_type']}: {error}" if data.get('node_type') else error
+
+def token_hash(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def task_belongs_to(task, token):
+    """True when a stored task was submitted with, or shared with, this bearer token; tasks of unknown origin belong to nobody."""
+    if not task or not task.get('token_hash'):
+        return False
+    caller = token_hash(token)
+    return any(hmac.compare_digest(owner, caller) for owner in [task['token_hash']] + task.get('shared_with', []))
+
+def workflow_params(name, workflow):
+    """Read a template's parameters back out of a prepared workflow, defaults and seeds included."""
+    template = workflow_registry.get(name)
+    if template is None:
+        return None
+    return {param: workflow[spec['node']]['inputs'][spec['input']] for param, spec in template.params.items()
+            if spec['input'] in workflow.get(spec['node'], {}).get('inputs', {})}
+
+class JobStore:
+    """Where submitted prompts, their status transitions and output locations are kept.
+
+    This base class keeps nothing, so every status query falls through to
+    ComfyUI; subclass it to back the store with something else. The listener
+    that receives a prompt's events is its only writer, apart from settle(),
+    which saves an outcome a reader had to fetch from /history itself.
+    """
+
+    def record(self, prompt_id, client_id, backend, token, workflow=None, params=None):
+        """Save a prompt that has just been queued."""
+
+    def on_event(self, message):
+        """Apply a ComfyUI WebSocket event to the prompt it belongs to."""
+
+    def heartbeat(self, client_id):
+        """Note that the listener with this client_id is connected and recording events."""
+
+    def unfinished(self, client_id):
+        """Return the prompt_ids of this listener's tasks that are still queued or running."""
+        return []
+
+    def settle(self, prompt_id, history):
+        """Save the outcome of a prompt from its /history entry."""
+
+    def share(self, prompt_id, token):
+        """Let another token read a task whose outputs answered its identical request."""
+
+    def get(self, prompt_id):
+        """Return the stored task as a dict, or None if it is unknown."""
+        return None
+
+    def stats(self):
+        return {'store': 'none'}
+
+class SQLiteJobStore(JobStore):
+    """Task state in a SQLite database in WAL mode, shared by all workers and kept across restarts.
+
+    A task that is still queued or running is reported as live while the
+    listener that owns its events has sent a heartbeat within
+    `listener_timeout` seconds; otherwise readers double-check with ComfyUI.
+    """
+
+    def __init__(self, path, retention, heartbeat_interval, listener_timeout):
+        self.path = path
+        self.retention = retention
+        self.heartbeat_interval = heartbeat_interval
+        self.listener_timeout = listener_timeout
+        self._heartbeats = {}
+        self._purged_at = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    prompt_id TEXT PRIMARY KEY,
+                    client_id TEXT,
+                    backend TEXT,
+                    token_hash TEXT,
+                    workflow TEXT,
+                    params TEXT,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    outputs TEXT,
+                    outputs_complete INTEGER NOT NULL DEFAULT 1,
+                    created_at REAL NOT NULL,
+                    submitted_at REAL,
+                    started_at REAL,
+                    finished_at REAL
+                );
+                CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks (status, created_at);
+                CREATE INDEX IF NOT EXISTS tasks_by_client ON tasks (client_id, status);
+                CREATE TABLE IF NOT EXISTS listeners (client_id TEXT PRIMARY KEY, heartbeat_at REAL NOT NULL);
+                CREATE TABLE IF NOT EXISTS task_shares (
+                    prompt_id TEXT NOT NULL,
+                    token_hash TEXT NOT NULL,
+                    PRIMARY KEY (prompt_id, token_hash)
+                );
+            """)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # Autocommit connection per call; sqlite3 objects must not cross threads
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA synchronous=NORMAL")  # WAL stays consistent; only the last commits may be lost on power loss
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def record(self, prompt_id, client_id, backend, token, workflow=None, params=None):
+        now = time.time()
+        with self._connect() as db:
+            # Fast prompts may have reported events already; keep the status they set
+            db.execute(
+                "INSERT INTO tasks (prompt_id, client_id, backend, token_hash, workflow, params, status, created_at, submitted_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?) ON CONFLICT (prompt_id) DO UPDATE SET"
+                " client_id = excluded.client_id, backend = excluded.backend, token_hash = excluded.token_hash,"
+                " workflow = excluded.workflow, params = excluded.params, submitted_at = excluded.submitted_at",
+                (prompt_id, client_id, backend, token_hash(token), workflow,
+                 json.dumps(params) if params is not None else None, now, now))
+            if now - self._purged_at > 3600:
+                self._purged_at = now
+                db.execute("DELETE FROM tasks WHERE COALESCE(finished_at, created_at) < ?", (now - self.retention,))
+                db.execute("DELETE FROM listeners WHERE heartbeat_at < ?", (now - self.retention,))
+                db.execute("DELETE FROM task_shares WHERE prompt_id NOT IN (SELECT prompt_id FROM tasks)")
+
+    def on_event(self, message):
+        kind = message.get('type')
+        data = message.get('data') or {}
+        prompt_id = data.get('prompt_id')
+        if prompt_id is None or kind not in ('execution_start', 'execution_cached', 'executed', 'execution_error',
+                                             'execution_interrupted', 'executing'):
+            return
+        if kind == 'executing' and not is_prompt_finished(message):
+            return
+        if kind == 'execution_cached' and not data.get('nodes'):
+            return
+
+        now = time.time()
+        with self._connect() as db:
+            db.execute("INSERT OR IGNORE INTO tasks (prompt_id, status, created_at) VALUES (?, 'queued', ?)", (prompt_id, now))
+            if kind == 'execution_start':
+                db.execute("UPDATE tasks SET status = 'running', started_at = ? WHERE prompt_id = ? AND status = 'queued'",
+                           (now, prompt_id))
+            elif kind == 'execution_cached':
+                # Cached nodes send no 'executed' event, so their outputs are only in /history
+                db.execute("UPDATE tasks SET outputs_complete = 0 WHERE prompt_id = ?", (prompt_id,))
+            elif kind == 'executed':
+                if data.get('output'):
+                    row = db.execute("SELECT outputs FROM tasks WHERE prompt_id = ?", (prompt_id,)).fetchone()
+                    outputs = json.loads(row['outputs'] or '{}')
+                    outputs[data['node']] = data['output']
+                    db.execute("UPDATE tasks SET outputs = ? WHERE prompt_id = ?", (json.dumps(outputs), prompt_id))
+            elif kind in ('execution_error', 'execution_interrupted'):
+                status, error = ('failed', execution_error_message(data)) if kind == 'execution_error' \
+                    else ('interrupted', 'Prompt was interrupted')
+                db.execute("UPDATE tasks SET status = ?, error = ?, finished_at = ? WHERE prompt_id = ?"
+                           " AND status IN ('queued', 'running')", (status, error, now, prompt_id))
+            else:
+                db.execute("UPDATE tasks SET status = 'completed', finished_at = ? WHERE prompt_id = ?"
+                           " AND status IN ('queued', 'running')", (now, prompt_id))
+
+    def heartbeat(self, client_id):
+        now = time.time()
+        if now - self._heartbeats.get(client_id, 0) < self.heartbeat_interval:
+            return
+        self._heartbeats[client_id] = now
+        try:
+            with self._connect() as db:
+                db.execute("INSERT OR REPLACE INTO listeners (client_id, heartbeat_at) VALUES (?, ?)", (client_id, now))
+        except sqlite3.Error as e:
+            print(f"Job store heartbeat failed: {e}", flush=True)
+
+    def unfinished(self, client_id):
+        with self._connect() as db:
+            rows = db.execute("SELECT prompt_id FROM tasks WHERE client_id = ? AND status IN ('queued', 'running')",
+                              (client_id,)).fetchall()
+        return [row['prompt_id'] for row in rows]
+
+    def settle(self, prompt_id, history):
+        status = history.get('status', {})
+        failed = status.get('status_str') == 'error'
+        error = next((execution_error_message(data) for name, data in status.get('messages', [])
+                      if name == 'execution_error'), 'Prompt failed') if failed else None
+        now = time.time()
+        with self._connect() as db:
+            # Only tasks recorded at submission are settled; others have no owner to answer to
+            db.execute(
+                "UPDATE tasks SET outputs = ?, outputs_complete = 1, finished_at = COALESCE(finished_at, ?),"
+                " status = CASE WHEN status IN ('queued', 'running') THEN ? ELSE status END, error = COALESCE(error, ?)"
+                " WHERE prompt_id = ?",
+                (json.dumps(history.get('outputs', {})), now, 'failed' if failed else 'completed', error, prompt_id))
+
+    def share(self, prompt_id, token):
+        with self._connect() as db:
+            db.execute("INSERT OR IGNORE INTO task_shares (prompt_id, token_hash) VALUES (?, ?)", (prompt_id, token_hash(token)))
+
+    def get(self, prompt_id):
+        with self._connect() as db:
+            row = db.execute("SELECT tasks.*, listeners.heartbeat_at FROM tasks LEFT JOIN listeners"
+                             " ON listeners.client_id = tasks.client_id WHERE prompt_id = ?", (prompt_id,)).fetchone()
+            shared_with = [share['token_hash'] for share in
+                           db.execute("SELECT token_hash FROM task_shares WHERE prompt_id = ?", (prompt_id,))]
+        if row is None:
+            return None
+        task = dict(row)
+        task['shared_with'] = shared_with
+        heartbeat_at = task.pop('heartbeat_at')
+        task['params'] = json.loads(task['params']) if task['params'] else None
+        task['outputs'] = json.loads(task['outputs']) if task['outputs'] else {}
+        task['outputs_complete'] = bool(task['outputs_complete'])
+        task['live'] = heartbeat_at is not None and time.time() - heartbeat_at < self.listener_timeout
+        return task
+
+    def stats(self):
+        with self._connect() as db:
+            rows = db.execute("SELECT status, COUNT(*) AS tasks FROM tasks GROUP BY status").fetchall()
+        return {'store': 'sqlite', 'tasks': {row['status']: row['tasks'] for row in rows}}
+
+if JOB_STORE == 'sqlite':
+    job_store = SQLiteJobStore(JOB_STORE_DB, JOB_STORE_RETENTION, JOB_STORE_HEARTBEAT_INTERVAL, JOB_STORE_LISTENER_TIMEOUT)
+elif JOB_STORE == 'none':
+    job_store = JobStore()
+else:
+    raise ValueError(f"Unknown JOB_STORE '{JOB_STORE}'; expected 'sqlite' or 'none'")
+
+def record_task(prompt_id, workflow, token):
+    """Save a newly queued prompt in the job store; a failure here never fails the request."""
+    name = g.get('workflow') if has_request_context() else None
+    try:
+        backend = backend_pool.pinned(prompt_id)
+        listener = get_listener(token, backend) if backend else None
+        job_store.record(prompt_id, listener.client_id if listener else None, backend.address if backend else None,
+                         token, name, workflow_params(name, workflow) if name else None)
+    except Exception as e:
+        print(f"Failed to record task {prompt_id}: {e}", flush=True)
+
+def share_task(prompt_id, token):
+    """Give token access to a prompt queued for someone else; a failure here never fails the request."""
+    try:
+        job_store.share(prompt_id, token)
+    except Exception as e:
+        print(f"Failed to share task {prompt_id}: {e}", flush=True)
+
+def lookup_task(prompt_id, token, task):
+    """Return ('pending', prompts_in_queue), ('failed', error) or ('done', history) for a status poll.
+
+    task is the prompt's job store record, already checked to belong to the
+    caller, or None. The store answers without any upstream call once the
+    outcome is recorded, or while the listener that owns the prompt is alive.
+    Otherwise the history is fetched from ComfyUI and the outcome saved for
+    next time.
+    """
+    if task_belongs_to(task, token):
+        if task['status'] in ('failed', 'interrupted'):
+            return 'failed', task['error'] or 'Prompt failed'
+        if task['status'] == 'completed' and task['outputs_complete']:
+            return 'done', {'outputs': task['outputs'], 'status': {'status_str': 'success', 'completed': True}}
+        if task['status'] != 'completed' and task['live']:
+            backend = backend_pool.by_address(task['backend'])
+            return 'pending', backend.queue_remaining if backend else 0
+
+    # Queue length as last reported by the shared listener's status events
+    queue_remaining = get_prompt_listener(prompt_id, token).queue_remaining
+    history = (get_history(prompt_id, token) or {}).get(prompt_id, {})
+
+    failure = job_scheduler.failure(prompt_id)
+    if not history and failure:
+        return 'failed', failure
+    if not history:
+        return 'pending', queue_remaining
+
+    job_store.settle(prompt_id, history)
+    return 'done', history
+
+                ################################################
+                # Output image passthrough and transcoding     #
+                ################################################
+
+OUTPUT_FORMATS = {'png': 'PNG', 'jpeg': 'JPEG', 'webp': 'WEBP'}
+OUTPUT_MIMETYPES = {'png': 'image/png', 'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+
+transcode_executor = ThreadPoolExecutor(max_workers=IMAGE_TRANSCODE_WORKERS, thread_name_prefix='transcode')
+
+def sniff_image_format(image_data):
+    """Identify PNG, JPEG or WebP bytes from their magic number without decoding them."""
+    if image_data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    if image_data[:3] == b'\xff\xd8\xff':
+        return 'jpeg'
+    if image_data[:4] == b'RIFF' and image_data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+def get_output_options(data):
+    """Read the optional format/quality/max_side output settings from the body or query string."""
+    data = data or {}
+
+    def option(name):
+        value = data.get(name)
+        return request.args.get(name) if value in (None, '') else value
+
+    output_format = option('format')
+    if output_format:
+        output_format = str(output_format).lower().replace('jpg', 'jpeg')
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"format must be one of {sorted(OUTPUT_FORMATS)}")
+
+    quality = option('quality')
+    max_side = option('max_side')
+    try:
+        quality = int(quality) if quality not in (None, '') else None
+        max_side = int(max_side) if max_side not in (None, '') else None
+    except (TypeError, ValueError):
+        raise ValueError("quality and max_side must be integers")
+    if quality is not None and not 1 <= quality <= 100:
+        raise ValueError("quality must be between 1 and 100")
+    if max_side is not None and max_side < 16:
+        raise ValueError("max_side must be at least 16")
+
+    return {'format': output_format or 'png', 'quality': quality, 'max_side': max_side}
+
+def needs_transcode(image_data, options):
+    if sniff_image_format(image_data) != options['format']:
+        return True
+    if options['max_side']:
+        # Image.open only parses the header, so this does not decode pixels
+        with Image.open(io.BytesIO(image_data)) as image:
+            return max(image.size) > options['max_side']
+    return False
+
+def transcode_image(image_data, options):
+    """Re-encode image bytes into the requested format, downscaling to max_side if needed."""
+    output_format = options['format']
+    with Image.open(io.BytesIO(image_data)) as image:
+        if options['max_side'] and max(image.size) > options['max_side']:
+            image.thumbnail((options['max_side'], options['max_side']), Image.LANCZOS)
+        if output_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        buffered = io.BytesIO()
+        save_kwargs = {}
+        if output_format in ('jpeg', 'webp'):
+            save_kwargs['quality'] = options['quality'] or DEFAULT_OUTPUT_QUALITY
+        image.save(buffered, format=OUTPUT_FORMATS[output_format], **save_kwargs)
+        return buffered.getvalue()
+
+@timed_stage('encode')
+def encode_output_images(images, options):
+    """Return generated images in the requested format, passing matching bytes through untouched."""
+    image_list = [image_data for node_id in images for image_data in images[node_id]]
+    if not any(needs_transcode(image_data, options) for image_data in image_list):
+        return image_list
+    return list(transcode_executor.map(
+        lambda image_data: transcode_image(image_data, options) if needs_transcode(image_data, options) else image_data,
+        image_list))
+
+def transcode_output_images(images, options):
+    """Transcode images one at a time where the requested output settings need it."""
+    for image_data in images:
+        if needs_transcode(image_data, options):
+            with timed('encode'):
+                image_data = transcode_image(image_data, options)
+        yield image_data
+
+def iter_output_images(prompt_id, image_refs, token, options):
+    """Fetch and, if needed, transcode output images one at a time."""
+    return transcode_output_images((image_data for node_id, image_data in iter_prompt_images(prompt_id, image_refs, token)),
+                                   options)
+
+                ################################################
+                # Local result cache                           #
+                ################################################
+
+class ResultCacheWriter:
+    """Incrementally hashes an output into a temp file and commits it to the cache on success."""
+
+    def __init__(self, cache, prompt_id, filename, mimetype, meta):
+        self.cache = cache
+        self.prompt_id = prompt_id
+        self.filename = filename
+        self.mimetype = mimetype
+        self.meta = meta
+        self.size = 0
+        self._hasher = hashlib.sha256()
+        self._file = tempfile.NamedTemporaryFile(dir=cache.tmp_dir, delete=False)
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self._hasher.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        self._file.close()
+        return self.cache._commit(self._file.name, self._hasher.hexdigest(), self.size,
+                                  self.prompt_id, self.filename, self.mimetype, self.meta)
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._file.name):
+            os.remove(self._file.name)
+
+class ResultCache:
+    """Content-addressed on-disk store of finished outputs, keyed by prompt_id/filename.
+
+    Blobs live under blobs/<sha256>; each key is a small JSON entry under
+    keys/<prompt>/<filename>.json whose mtime doubles as the LRU clock. Entries
+    expire after ttl seconds and the least recently used are evicted once the
+    blobs exceed max_bytes. Full scans run every sweep_interval seconds in the
+    background; between them each process adds the blobs it writes to the
+    total of the last scan and only scans early once that passes max_bytes.
+    Eviction frees space down to low_water of max_bytes, so a full cache is
+    rescanned once per that much new data rather than on every write.
+    """
+
+    low_water = 0.9
+
+    def __init__(self, root, max_bytes, ttl, sweep_interval=0):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.blob_dir = os.path.join(root, 'blobs')
+        self.key_dir = os.path.join(root, 'keys')
+        self.tmp_dir = os.path.join(root, 'tmp')
+        self.alias_dir = os.path.join(root, 'aliases')
+        for directory in (self.blob_dir, self.key_dir, self.tmp_dir, self.alias_dir):
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.bytes_estimate = None  # Blob bytes as of the last scan plus this process's writes
+
+    def start(self):
+        """Start the background sweeper thread once per process; it scans once right away."""
+        with self._lock:
+            if self._thread is None and self.sweep_interval > 0:
+                self._thread = threading.Thread(target=self._run, name='result-cache-sweeper', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.evict()
+            except Exception as e:
+                print(f"Result cache sweep failed: {e}", flush=True)
+            time.sleep(self.sweep_interval)
+
+    def _prompt_dir(self, prompt_id):
+        return os.path.join(self.key_dir, hashlib.sha1(prompt_id.encode('utf-8')).hexdigest())
+
+    def _entry_path(self, prompt_id, filename):
+        name = hashlib.sha1(filename.encode('utf-8')).hexdigest()
+        return os.path.join(self._prompt_dir(prompt_id), f"{name}.json")
+
+    def _read_entry(self, path, touch=True):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - entry['stored_at'] > self.ttl:
+            self._remove_entry(path)
+            return None
+
+        entry['path'] = os.path.join(self.blob_dir, entry['digest'])
+        if not os.path.exists(entry['path']):
+            return None
+        if touch:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return entry
+
+    def _remove_entry(self, path):
+        # The prompt's remaining outputs are no longer a complete set
+        for stale in (os.path.join(os.path.dirname(path), 'complete'), path):
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+    def get(self, prompt_id, filename):
+        """Return the cached entry (with its blob 'path') for one output, or None."""
+        return self._read_entry(self._entry_path(prompt_id, filename))
+
+    def list(self, prompt_id):
+        """Return all entries of a prompt once every output was stored, else None."""
+        prompt_dir = self._prompt_dir(prompt_id)
+        if not os.path.exists(os.path.join(prompt_dir, 'complete')):
+            return None
+
+        entries = []
+        for name in os.listdir(prompt_dir):
+            if name.endswith('.json'):
+                entry = self._read_entry(os.path.join(prompt_dir, name))
+                if entry is None:
+                    return None
+                entries.append(entry)
+        return sorted(entries, key=lambda entry: entry.get('index', 0))
+
+    def mark_complete(self, prompt_id):
+        prompt_dir = self._prompt_dir(prompt_id)
+        os.makedirs(prompt_dir, exist_ok=True)
+        open(os.path.join(prompt_dir, 'complete'), 'w').close()
+
+    def link(self, fingerprint, prompt_id):
+        """Record that prompt_id produced the outputs of the workflow with this fingerprint."""
+        alias_path = os.path.join(self.alias_dir, fingerprint)
+        tmp_alias = f"{alias_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_alias, 'w', encoding='utf-8') as f:
+            f.write(prompt_id)
+        os.replace(tmp_alias, alias_path)
+
+    def lookup(self, fingerprint):
+        """Return the prompt_id whose cached outputs answer this fingerprint, or None."""
+        try:
+            with open(os.path.join(self.alias_dir, fingerprint), 'r', encoding='utf-8') as f:
+                prompt_id = f.read().strip()
+        except OSError:
+            return None
+        return prompt_id if self.list(prompt_id) else None
+
+    def open_writer(self, prompt_id, filename, mimetype, **meta):
+        return ResultCacheWriter(self, prompt_id, filename, mimetype, meta)
+
+    def put(self, prompt_id, filename, data, mimetype, **meta):
+        writer = self.open_writer(prompt_id, filename, mimetype, **meta)
+        try:
+            writer.write(data)
+        except Exception:
+            writer.abort()
+            raise
+        return writer.commit()
+
+    def _commit(self, tmp_path, digest, size, prompt_id, filename, mimetype, meta):
+        blob_path = os.path.join(self.blob_dir, digest)
+        added = 0
+        if os.path.exists(blob_path):
+            os.remove(tmp_path)  # Identical content is already stored
+            os.utime(blob_path)
+        else:
+            os.replace(tmp_path, blob_path)
+            added = size
+
+        entry = dict(meta, prompt_id=prompt_id, filename=filename, digest=digest, size=size,
+                     mimetype=mimetype, stored_at=time.time())
+        entry_path = self._entry_path(prompt_id, filename)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        tmp_entry = f"{entry_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_entry, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(tmp_entry, entry_path)
+
+        # Only scan when this write may have pushed the cache over its limit
+        with self._lock:
+            if self.bytes_estimate is not None:
+                self.bytes_estimate += added
+            over = self.bytes_estimate is None or self.bytes_estimate > self.max_bytes
+        if over:
+            self.evict()
+        entry['path'] = blob_path
+        return entry
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones until blobs fit in low_water of max_bytes."""
+        with self._lock:
+            now = time.time()
+            entries = []
+            for prompt_name in os.listdir(self.key_dir):
+                prompt_dir = os.path.join(self.key_dir, prompt_name)
+                names = [name for name in os.listdir(prompt_dir) if name.endswith('.json')]
+                for name in names:
+                    path = os.path.join(prompt_dir, name)
+                    try:
+                        mtime = os.path.getmtime(path)
+                        with open(path, 'r', encoding='utf-8') as f:
+                            entry = json.load(f)
+                    except (OSError, ValueError):
+                        continue
+                    if now - entry['stored_at'] > self.ttl:
+                        self._remove_entry(path)
+                    else:
+                        entries.append((mtime, path, entry))
+                if not any(name.endswith('.json') for name in os.listdir(prompt_dir)) and \
+                        now - os.path.getmtime(prompt_dir) > 60:
+                    shutil.rmtree(prompt_dir, ignore_errors=True)
+
+            references = collections.Counter(entry['digest'] for _, _, entry in entries)
+            sizes = {entry['digest']: entry['size'] for _, _, entry in entries}
+            total = sum(sizes.values())
+
+            for mtime, path, entry in sorted(entries, key=lambda item: item[0]):
+                if total <= self.max_bytes * self.low_water:
+                    break
+                self._remove_entry(path)
+                references[entry['digest']] -= 1
+                if references[entry['digest']] == 0:
+                    total -= sizes[entry['digest']]
+
+            for name in os.listdir(self.alias_dir):
+                alias_path = os.path.join(self.alias_dir, name)
+                try:
+                    if now - os.path.getmtime(alias_path) > self.ttl:
+                        os.remove(alias_path)
+                except OSError:
+                    pass
+
+            # Remove blobs no entry points to any more (skipping very recent ones
+            # that another worker may be about to reference)
+            for digest in os.listdir(self.blob_dir):
+                blob_path = os.path.join(self.blob_dir, digest)
+                if references.get(digest, 0) <= 0:
+                    try:
+                        if now - os.path.getmtime(blob_path) > 60 or digest in sizes:
+                            os.remove(blob_path)
+                    except OSError:
+                        pass
+
+            self.bytes_estimate = total
+
+result_cache = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL, RESULT_CACHE_SWEEP_INTERVAL)
+result_cache.start()
+
+def send_cached_output(entry, download_name=None, etag=None):
+    """Serve a cached output from disk; Range, conditional requests and X-Sendfile are handled by send_file."""
+    return send_file(
+        entry['path'],
+        mimetype=entry['mimetype'],
+        as_attachment=download_name is not None,
+        download_name=download_name,
+        conditional=True,
+        etag=etag or entry['digest'],
+        max_age=86400
+    )
+
+def fetch_output_image(prompt_id, index, node_id, image, token):
+    """Return the bytes of one output image, downloading it into the result cache on first use."""
+    cached = result_cache.get(prompt_id, image['filename'])
+    if cached is not None:
+        with open(cached['path'], 'rb') as f:
+            return f.read()
+
+    image_data = get_image(image['filename'], image['subfolder'], image['type'], token, prompt_id)
+    try:
+        result_cache.put(prompt_id, image['filename'], image_data,
+                         OUTPUT_MIMETYPES.get(sniff_image_format(image_data), 'application/octet-stream'),
+                         index=index, node_id=node_id, subfolder=image['subfolder'], type=image['type'])
+    except OSError as e:
+        print(f"Failed to cache {image['filename']}: {e}", flush=True)
+    return image_data
+
+def iter_prompt_images(prompt_id, image_refs, token):
+    """Yield the raw bytes of every output image, marking the prompt complete in the cache at the end."""
+    for index, (node_id, image) in enumerate(image_refs):
+        yield node_id, fetch_output_image(prompt_id, index, node_id, image, token)
+    result_cache.mark_complete(prompt_id)
+
+                ################################################
+                # Static file storage                          #
+                ################################################
+
+class StaticStorage:
+    """Owns the files written to static/: input images and downloaded videos.
+
+    Files referenced by an in-flight prompt are pinned until release() is called
+    for that prompt, which deletes its inputs. A background sweeper removes
+    unpinned files older than ttl seconds, then the least recently used ones
+    (mtime is the LRU clock) until the folder fits in max_bytes. Pins are per
+    process, so files younger than grace seconds are never evicted for space to
+    protect prompts in flight in other workers.
+    """
+
+    def __init__(self, root, max_bytes, ttl, grace, sweep_interval):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.grace = grace
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        self._pins = {}  # path -> set of prompt_ids still using it
+        self._inputs = {}  # prompt_id -> input paths to delete on release
+        self._thread = None
+        self.bytes_held = 0
+        self.files_held = 0
+        self.files_reclaimed = 0
+        self.bytes_reclaimed = 0
+        self.last_sweep = None
+
+    def start(self):
+        """Start the background sweeper thread once per process."""
+        with self._lock:
+            if self._thread is None and self.sweep_interval > 0:
+                self._thread = threading.Thread(target=self._run, name='static-sweeper', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Static storage sweep failed: {e}", flush=True)
+
+    def track(self, path, prompt_id, delete_on_release=True):
+        """Pin path while prompt_id runs; inputs are deleted once it is released."""
+        if not path:
+            return
+        path = os.path.normpath(path)
+        with self._lock:
+            self._pins.setdefault(path, set()).add(prompt_id)
+            if delete_on_release:
+                self._inputs.setdefault(prompt_id, []).append(path)
+
+    def release(self, prompt_id):
+        """Unpin everything prompt_id held and delete its input files."""
+        with self._lock:
+            paths = self._inputs.pop(prompt_id, [])
+            for path, prompt_ids in list(self._pins.items()):
+                prompt_ids.discard(prompt_id)
+                if not prompt_ids:
+                    del self._pins[path]
+            paths = [path for path in paths if path not in self._pins]
+
+        for path in paths:
+            self._reclaim(path)
+
+    def touch(self, path):
+        """Mark a file as recently used so LRU eviction keeps it longer."""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _reclaim(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self.files_reclaimed += 1
+            self.bytes_reclaimed += size
+        print(f"Deleted temporary file: {path}", flush=True)
+
+    def sweep(self):
+        """Drop expired files, then least recently used ones until static/ fits in max_bytes."""
+        if not os.path.isdir(self.root):
+            return
+
+        now = time.time()
+        with self._lock:
+            pinned = set(self._pins)
+
+        files = []
+        for item in os.scandir(self.root):
+            try:
+                if not item.is_file(follow_symlinks=False):
+                    continue
+                stat = item.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            path = os.path.normpath(item.path)
+            if path in pinned:
+                files.append((stat.st_mtime, path, stat.st_size, False))
+            elif now - stat.st_mtime > self.ttl:
+                self._reclaim(path)
+            else:
+                files.append((stat.st_mtime, path, stat.st_size, now - stat.st_mtime > self.grace))
+
+        total = sum(size for _, _, size, _ in files)
+        held = len(files)
+        for mtime, path, size, evictable in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if evictable:
+                self._reclaim(path)
+                total -= size
+                held -= 1
+
+        with self._lock:
+            self.bytes_held = total
+            self.files_held = held
+            self.last_sweep = now
+
+    def stats(self):
+        with self._lock:
+            return {
+                'bytes_held': self.bytes_held,
+                'files_held': self.files_held,
+                'files_pinned': len(self._pins),
+                'prompts_in_flight': len(self._inputs),
+                'files_reclaimed': self.files_reclaimed,
+                'bytes_reclaimed': self.bytes_reclaimed,
+                'max_bytes': self.max_bytes,
+                'last_sweep': self.last_sweep
+            }
+
+static_storage = StaticStorage(STATIC_DIR, STATIC_MAX_BYTES, STATIC_FILE_TTL, STATIC_EVICT_GRACE, STATIC_SWEEP_INTERVAL)
+static_storage.start()
+
+def release_when_complete(listener, prompt_id):
+    """Release prompt_id's static files once the shared listener sees it finish."""
+    listener.on_complete(prompt_id, lambda: static_storage.release(prompt_id))
+
+                ################################################
+                # Image response modes                         #
+                ################################################
+
+RESPONSE_MODES = ('json', 'binary', 'multipart', 'stream')
+
+def get_response_mode():
+    """Pick the response mode from ?response= or, failing that, the Accept header."""
+    mode = request.args.get('response')
+    if mode:
+        if mode not in RESPONSE_MODES:
+            raise ValueError(f"response must be one of {list(RESPONSE_MODES)}")
+        return mode
+
+    best = request.accept_mimetypes.best_match(['application/json', 'image/*', 'multipart/mixed'])
+    if best == 'image/*':
+        return 'binary'
+    if best == 'multipart/mixed':
+        return 'multipart'
+    return 'json'
+
+IMAGE_DELIVERIES = ('history', 'websocket')
+
+def get_image_delivery(data):
+    """Pick how a synchronous request receives its output images, from 'delivery' in the body or query string."""
+    delivery = str((data or {}).get('delivery') or request.args.get('delivery') or IMAGE_DELIVERY).lower()
+    if delivery not in IMAGE_DELIVERIES:
+        raise ValueError(f"delivery must be one of {list(IMAGE_DELIVERIES)}")
+    return delivery
+
+def build_image_response(prompt_id, token, options, mode, status=200, images=None):
+    """Return the outputs of a finished prompt as JSON, raw bytes, multipart/mixed or a streamed JSON array.
+
+    images, if given, are the outputs already received over the WebSocket;
+    otherwise they are read from the result cache or the prompt's history.
+    """
+    mimetype = OUTPUT_MIMETYPES[options['format']]
+    if images is None:
+        image_refs = get_output_images(prompt_id, token)
+        image_count = len(image_refs)
+
+        def output_images():
+            return iter_output_images(prompt_id, image_refs, token, options)
+    else:
+        image_count = len(images)
+
+        def output_images():
+            return transcode_output_images(images, options)
+
+    if mode == 'json':
+        if images is None:
+            grouped = {}
+            for node_id, image_data in iter_prompt_images(prompt_id, image_refs, token):
+                grouped.setdefault(node_id, []).append(image_data)
+        else:
+            grouped = {'websocket': images}
+        output_images_base64 = [base64.b64encode(image_data).decode("utf-8")
+                                for image_data in encode_output_images(grouped, options)]
+        return jsonify({'images': output_images_base64}), status
+
+    if mode == 'binary' and image_count == 1:
+        image_data = next(output_images())
+        return Response(image_data, status=status, mimetype=mimetype)
+
+    if mode == 'stream':
+        # Build the same {"images": [...]} document piece by piece so only one
+        # image is held in memory and the first one leaves as soon as it is ready.
+        def generate_json():
+            yield '{"images": ['
+            for index, image_data in enumerate(output_images()):
+                yield (',' if index else '') + '"' + base64.b64encode(image_data).decode("utf-8") + '"'
+            yield ']}'
+
+        return Response(generate_json(), status=status, mimetype='application/json')
+
+    boundary = uuid.uuid4().hex
+
+    def generate_multipart():
+        for image_data in output_images():
+            yield (f"--{boundary}\r\nContent-Type: {mimetype}\r\n"
+                   f"Content-Length: {len(image_data)}\r\n\r\n").encode() + image_data + b"\r\n"
+        yield f"--{boundary}--\r\n".encode()
+
+    return Response(generate_multipart(), status=status, content_type=f'multipart/mixed; boundary={boundary}')
+
+                ################################################
+                # Asynchronous image jobs                      #
+                ################################################
+
+def is_async_request(data):
+    value = request.args.get('async', (data or {}).get('async'))
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def check_callback_url(callback_url):
+    """Raise ValueError unless callback_url is http(s) and its host resolves only to public addresses.
+
+    Hosts listed in CALLBACK_ALLOWED_HOSTS skip the address check.
+    """
+    parsed = urllib.parse.urlparse(callback_url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise ValueError('callback_url must be an http(s) URL')
+    host = parsed.hostname.lower()
+    if host in CALLBACK_ALLOWED_HOSTS:
+        return
+    try:
+        addresses = socket.getaddrinfo(host, parsed.port or (443 if parsed.scheme == 'https' else 80),
+                                       type=socket.SOCK_STREAM)
+    except socket.gaierror:
+        raise ValueError(f'callback_url host {host} does not resolve')
+    for *_, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0].split('%')[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        # Loopback, private, link-local, reserved and multicast ranges are all non-global
+        if not address.is_global or address.is_multicast:
+            raise ValueError('callback_url must point to a public address')
+
+def get_callback_url(data):
+    callback_url = (data or {}).get('callback_url')
+    if callback_url:
+        check_callback_url(callback_url)
+    return callback_url
+
+def send_webhook(callback_url, payload):
+    try:
+        # Resolve again: the host may point somewhere else by the time the job finishes
+        check_callback_url(callback_url)
+        response = http_session.post(callback_url, json=payload, timeout=WEBHOOK_TIMEOUT, allow_redirects=False)
+        response.raise_for_status()
+    except (requests.RequestException, ValueError) as e:
+        print(f"Webhook to {callback_url} failed: {e}", flush=True)
+
+def cache_prompt_outputs(prompt_id, token):
+    """Pull every output image of a finished prompt into the result cache. Returns the image count."""
+    image_refs = get_output_images(prompt_id, token)
+    for _ in iter_prompt_images(prompt_id, image_refs, token):
+        pass
+    return len(image_refs)
+
+def complete_image_job(prompt_id, token, callback_url=None):
+    """Pull a finished job's images into the result cache, drop its input image and notify the webhook."""
+    static_storage.release(prompt_id)
+
+    payload = {'prompt_id': prompt_id, 'get_image_url': f'{PUBLIC_BASE_URL}/v1/image_tasks/{prompt_id}'}
+    try:
+        image_count = cache_prompt_outputs(prompt_id, token)
+        payload.update(status='completed' if image_count else 'failed', image_count=image_count)
+    except Exception as e:
+        print(f"Failed to complete image job {prompt_id}: {e}", flush=True)
+        payload.update(status='failed', error=str(e))
+
+    if callback_url:
+        send_webhook(callback_url, payload)
+    return payload
+
+def submit_image_job(workflow, token, callback_url=None, input_path=None, backend=None, on_done=None):
+    """Queue a workflow without waiting for it; outputs are cached when it finishes.
+
+    on_done, if given, is called with the job's webhook payload afterwards.
+    """
+    prompt_id = queue_prompt(workflow, token, backend=backend, interactive=False)
+    static_storage.track(input_path, prompt_id)
+
+    def complete():
+        payload = complete_image_job(prompt_id, token, callback_url)
+        if on_done:
+            on_done(payload)
+
+    get_prompt_listener(prompt_id, token).on_complete(prompt_id, complete)
+    return prompt_id
+
+def image_job_accepted(prompt_id):
+    return jsonify({
+        'prompt_id': prompt_id,
+        'message': 'Prompt queued successfully',
+        'get_image_url': f'{PUBLIC_BASE_URL}/v1/image_tasks/{prompt_id}'
+    }), 202
+
+                ################################################
+                # Deterministic generations                    #
+                ################################################
+
+def workflow_fingerprint(workflow):
+    """Hash a fully resolved workflow; identical fingerprints produce identical outputs."""
+    encoded = json.dumps(workflow, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+class PromptCoalescer:
+    """Shares one upstream prompt between concurrent requests for the same deterministic workflow.
+
+    The first request for a fingerprint leads and queues the prompt. Everyone
+    gets a 'queued' future resolving to its prompt_id and a 'done' future that
+    resolves once the outputs are in the result cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def join(self, fingerprint):
+        """Return ((queued, done), leader) for fingerprint."""
+        with self._lock:
+            futures = self._inflight.get(fingerprint)
+            if futures is not None:
+                return futures, False
+            futures = self._inflight[fingerprint] = (Future(), Future())
+            return futures, True
+
+    def queued(self, fingerprint, prompt_id):
+        with self._lock:
+            futures = self._inflight.get(fingerprint)
+            # The prompt may already have finished and resolved both futures
+            if futures is None or futures[0].done():
+                return
+            futures[0].set_result(prompt_id)
+
+    def finish(self, fingerprint, prompt_id=None, error=None):
+        with self._lock:
+            queued, done = self._inflight.pop(fingerprint)
+            if not queued.done():
+                if error is not None:
+                    queued.set_exception(error)
+                else:
+                    queued.set_result(prompt_id)
+        if error is not None:
+            done.set_exception(error)
+        else:
+            done.set_result(queued.result())
+
+prompt_coalescer = PromptCoalescer()
+
+def run_deterministic(workflow, token, wait=True, callback_url=None):
+    """Answer a seeded workflow from the result cache, an identical in-flight prompt, or one new prompt.
+
+    Returns the prompt_id. With wait=True it returns once the outputs are
+    cached; otherwise as soon as the prompt is queued, like submit_image_job.
+    """
+    fingerprint = workflow_fingerprint(workflow)
+    prompt_id = result_cache.lookup(fingerprint)
+    if prompt_id:
+        print(f"Serving cached result {prompt_id} for workflow {fingerprint[:12]}", flush=True)
+        share_task(prompt_id, token)
+        if callback_url:
+            callback_executor.submit(complete_image_job, prompt_id, token, callback_url)
+        return prompt_id
+
+    (queued, done), leader = prompt_coalescer.join(fingerprint)
+    if not leader:
+        print(f"Joining in-flight prompt for workflow {fingerprint[:12]}", flush=True)
+        timeout = prompt_timeout(workflow) or None
+        try:
+            prompt_id = queued.result(timeout)
+            # The caller polls and downloads the shared prompt with its own token
+            share_task(prompt_id, token)
+            if wait:
+                return done.result(timeout)
+        except FutureTimeout:
+            prompt_id = queued.result() if queued.done() and not queued.exception() else None
+            raise PromptTimeout(prompt_id, f'Shared prompt did not finish within {timeout:g}s')
+        if callback_url:
+            done.add_done_callback(lambda _: callback_executor.submit(complete_image_job, prompt_id, token, callback_url))
+        return prompt_id
+
+    def finish(payload):
+        if payload['status'] == 'completed':
+            result_cache.link(fingerprint, payload['prompt_id'])
+            prompt_coalescer.finish(fingerprint, payload['prompt_id'])
+        else:
+            # Followers re-raise this, so it has to map to the same response the leader gets
+            prompt_coalescer.finish(fingerprint, payload['prompt_id'],
+                                    PromptFailed(payload['prompt_id'], payload.get('error', 'Prompt produced no images')))
+
+    try:
+        if not wait:
+            prompt_id = submit_image_job(workflow, token, callback_url, on_done=finish)
+            prompt_coalescer.queued(fingerprint, prompt_id)
+            return prompt_id
+
+        listener, prompt_id, events = submit_prompt(workflow, token)
+        prompt_coalescer.queued(fingerprint, prompt_id)
+        # Other requests may share this prompt, so it outlives the leader's client
+        wait_for_prompt(listener, prompt_id, events, token, prompt_timeout(workflow))
+        image_count = cache_prompt_outputs(prompt_id, token)
+    except Exception as e:
+        prompt_coalescer.finish(fingerprint, error=e)
+        raise
+
+    finish({'prompt_id': prompt_id, 'status': 'completed' if image_count else 'failed'})
+    return prompt_id
+
 # Default route for home welcome
 @app.route('/')
 def home():
@@ -120,8 +3069,6 @@ def home():
 # Generate image route
 @app.route('/generate_image', methods=['POST'])
 def generate_image():
-    data = request.json
-
     # Extract the token from the request headers
     token = request.headers.get('Authorization')
 
@@ -130,6 +3077,8 @@ def generate_image():
     if token.startswith("Bearer "):
         token = token.split(" ")[1]
 
+    data = get_request_data()
+
     # Base64 decode the encoded token
     # token = base64.b64decode(token).decode("utf-8")
 
@@ -138,42 +3087,188 @@ def generate_image():
 
     text_prompt = data['text_prompt']
 
-    # Get the path to the current file's directory
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    file_path = os.path.join(current_dir, 'workflows/flux1_dev_checkpoint_workflow_api.json')
+    try:
+        params = validate_workflow_params('flux1_dev', seed=data.get('seed'))
+        output_options = get_output_options(data)
+        response_mode = get_response_mode()
+        callback_url = get_callback_url(data)
+        # Images sent over the WebSocket are never stored, so only plain synchronous requests can use them
+        websocket_output = get_image_delivery(data) == 'websocket' and 'seed' not in params and not is_async_request(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Copy the cached workflow template with the prompt injected (seed is randomised unless given)
+    workflow = prepare_workflow('flux1_dev', text_prompt=text_prompt, websocket_output=websocket_output, **params)
 
-    with open(file_path, 'r', encoding='utf-8') as file:
-        workflow_jsondata = file.read()
+    try:
+        # With an explicit seed the output is reproducible, so identical requests
+        # share one prompt and finished ones are answered from the result cache
+        if 'seed' in params:
+            prompt_id = run_deterministic(workflow, token, not is_async_request(data), callback_url)
+            if is_async_request(data):
+                return image_job_accepted(prompt_id)
+
+        # Return a job id straight away and let /v1/image_tasks serve the result
+        elif is_async_request(data):
+            return image_job_accepted(submit_image_job(workflow, token, callback_url))
+
+        # Take the images straight from the WebSocket, skipping /history and /view
+        elif websocket_output:
+            prompt_id, images = run_websocket_workflow(workflow, token)
+            return build_image_response(prompt_id, token, output_options, response_mode, images=images)
 
-    workflow = json.loads(workflow_jsondata)
-    workflow["6"]["inputs"]["text"] = text_prompt
+        else:
+            prompt_id = run_workflow(workflow, token)
+    except websocket.WebSocketException as e:
+        return jsonify({'error': f'WebSocket connection failed: {str(e)}'}), 500
 
-    # Generate a random 15-digit seed as an integer
-    seednum = random.randint(100000000000000, 999999999999999)
-    workflow["31"]["inputs"]["seed"] = seednum
+    return build_image_response(prompt_id, token, output_options, response_mode)
 
-    ws = websocket.WebSocket()
 
-    try:
-        ws.connect(f"{ws_address}?clientId={client_id}&token={token}", header=
-        {"Authorization": f"Bearer {token}"})
-    except websocket.WebSocketException as e:
-        return jsonify({'error': f'WebSocket connection failed: {str(e)}'}), 500
+                ################################################
+                # Batch image generation                       #
+                ################################################
 
-    images = get_images(ws, workflow, token)
-    ws.close()
+BATCH_PARAMS = ('text_prompt', 'seed', 'steps', 'width', 'height', 'batch_size')
 
-    output_images_base64 = []
+def parse_batch_items(data):
+    """Validate a batch request into one flux1_dev parameter dict per prompt.
 
-    for node_id in images:
-        for image_data in images[node_id]:
-            image = Image.open(io.BytesIO(image_data))
-            buffered = io.BytesIO()
-            image.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-            output_images_base64.append(img_str)
+    Accepts either 'prompts' (strings or objects with BATCH_PARAMS) or a single
+    'text_prompt' with an optional 'batch_size'.
+    """
+    items = data.get('prompts')
+    if items is None:
+        items = [{name: data.get(name) for name in BATCH_PARAMS}]
+    if not isinstance(items, list) or not items:
+        raise WorkflowParameterError('prompts must be a non-empty list')
+    if len(items) > MAX_BATCH_PROMPTS:
+        raise WorkflowParameterError(f'A batch can hold at most {MAX_BATCH_PROMPTS} prompts')
+
+    batch = []
+    for index, item in enumerate(items):
+        if isinstance(item, str):
+            item = {'text_prompt': item}
+        if not isinstance(item, dict):
+            raise WorkflowParameterError(f'prompts[{index}] must be a string or an object')
+        if not item.get('text_prompt') or not str(item['text_prompt']).strip():
+            raise WorkflowParameterError(f'prompts[{index}]: text_prompt is required')
+        try:
+            batch.append(validate_workflow_params('flux1_dev', **{name: item.get(name) for name in BATCH_PARAMS}))
+        except WorkflowParameterError as e:
+            raise WorkflowParameterError(f'prompts[{index}]: {e}')
+    return batch
+
+def batch_line(**fields):
+    return json.dumps(fields) + '\n'
+
+def batch_result(index, prompt_id, token, options):
+    """Encode the outputs of one finished batch prompt as an NDJSON result line."""
+    try:
+        image_refs = get_output_images(prompt_id, token)
+        images = [base64.b64encode(image_data).decode('utf-8')
+                  for image_data in iter_output_images(prompt_id, image_refs, token, options)]
+    except Exception as e:
+        return batch_line(type='result', index=index, prompt_id=prompt_id, status='failed', error=str(e))
+    return batch_line(type='result', index=index, prompt_id=prompt_id,
+                      status='completed' if images else 'failed', images=images)
+
+# Batch generate image route
+@app.route('/v1/batch/generate_image', methods=['POST'])
+def batch_generate_image():
+    token = request.headers.get('Authorization')
+    if not token or not token.startswith("Bearer "):
+        return jsonify({'error': 'Valid Bearer token required'}), 400
+    token = token.split(" ")[1]
 
-    return jsonify({'images': output_images_base64})
+    data = get_request_data()
+
+    try:
+        batch = parse_batch_items(data)
+        output_options = get_output_options(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Admit the whole batch at once, then queue every prompt up front and
+    # follow them all on one event queue
+    workflows = [prepare_workflow('flux1_dev', **params) for params in batch]
+    admission_controller.admit(token, len(workflows))
+    events = queue.Queue()
+    pending = {}
+    prompt_ids = []
+    failures = []
+    for index, workflow in enumerate(workflows):
+        try:
+            prompt_id = queue_prompt(workflow, token, prompt_id=str(uuid.uuid4()), admitted=True, interactive=False)
+            listener = get_prompt_listener(prompt_id, token)
+            listener.subscribe(prompt_id, events)
+            pending[prompt_id] = (index, listener)
+            prompt_ids.append(prompt_id)
+        except Exception as e:
+            prompt_ids.append(None)
+            failures.append(batch_line(type='result', index=index, prompt_id=None, status='failed', error=str(e)))
+            last_error = e
+
+    if not pending:
+        return jsonify({'message': 'Unable to connect to the server. Make sure the server is running', 'error': str(last_error)}), 500
+
+    # Nothing else notices a client that leaves while we wait between results
+    disconnected = client_disconnect_probe()
+
+    def generate():
+        reason = 'disconnect'
+        try:
+            yield batch_line(type='queued', prompt_ids=prompt_ids)
+            yield from failures
+
+            # Results are sent in completion order, each as soon as it is ready.
+            # The batch times out when no prompt finishes for IMAGE_PROMPT_TIMEOUT.
+            checked_at = 0
+            deadline = time.time() + IMAGE_PROMPT_TIMEOUT if IMAGE_PROMPT_TIMEOUT else None
+            while pending:
+                wait = DISCONNECT_CHECK_INTERVAL if disconnected else None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        reason = 'timeout'
+                        for prompt_id, (index, listener) in pending.items():
+                            yield batch_line(type='result', index=index, prompt_id=prompt_id, status='failed',
+                                             error=f'No prompt finished within {IMAGE_PROMPT_TIMEOUT:g}s')
+                        return
+                    wait = min(wait or remaining, remaining)
+                try:
+                    message = events.get(timeout=wait)
+                except queue.Empty:
+                    if disconnected is not None and disconnected():
+                        return
+                    continue
+
+                if message['type'] == 'reconnected':
+                    # Every subscription receives the broadcast, so check the history only once per burst
+                    if time.time() - checked_at < 1:
+                        continue
+                    checked_at = time.time()
+                    finished = [prompt_id for prompt_id in pending if prompt_id in (get_history(prompt_id, token) or {})]
+                elif is_prompt_finished(message):
+                    finished = [message['data']['prompt_id']]
+                else:
+                    continue
+
+                for prompt_id in finished:
+                    if prompt_id not in pending:
+                        continue
+                    index, listener = pending.pop(prompt_id)
+                    listener.unsubscribe(prompt_id, events)
+                    deadline = time.time() + IMAGE_PROMPT_TIMEOUT if IMAGE_PROMPT_TIMEOUT else None
+                    yield batch_result(index, prompt_id, token, output_options)
+        finally:
+            # Prompts still pending here have no one left to receive them
+            for prompt_id, (index, listener) in pending.items():
+                listener.unsubscribe(prompt_id, events)
+                callback_executor.submit(cancel_prompt, prompt_id, token, reason)
+
+    return Response(generate(), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
                 ###################################################
@@ -183,107 +3278,285 @@ def generate_image():
 # Route: OmniGen image to image
 @app.route('/omnigen/image_to_image', methods=['POST'])
 def omnigen_image_to_image():
-    data = request.json
-
     # Extract and validate token
     token = request.headers.get('Authorization')
     if not token or not token.startswith("Bearer "):
         return jsonify({'error': 'Valid Bearer token required'}), 400
     token = token.split(" ")[1]
 
+    data = get_request_data()
+
     # Validate text prompt
     text_prompt = data.get('text_prompt')
     if not text_prompt or not text_prompt.strip():
         return jsonify({'error': 'Text prompt is required'}), 400
 
-    steps = data.get('steps')
-    if not steps:
-        steps = 50
+    try:
+        params = validate_workflow_params('omnigen_image_to_image', steps=data.get('steps') or None)
+        output_options = get_output_options(data)
+        response_mode = get_response_mode()
+        callback_url = get_callback_url(data)
+        websocket_output = get_image_delivery(data) == 'websocket' and not is_async_request(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    image_url = data.get('image_url')
-    if not image_url:
-        return jsonify({'error': 'image_url is required'}), 400
+    image_path = None  # Initialize image path
 
-    # Handle uploaded image or base64 image
-    image_file = request.files.get('image')
-    base64_image = data.get('base64_image')
+    try:
+        # An uploaded or base64 image takes precedence over image_url
+        image_path, image_url = save_request_image(data)
+        if not image_path:
+            image_url = data.get('image_url')
+            if not image_url:
+                return jsonify({'error': 'Image is required (file, base64 or image_url)'}), 400
+
+        # Check the saved image from its header and shrink it to the model's resolution
+        if image_path:
+            prepare_input_image(image_path, 'omnigen_image_to_image')
+
+        # Copy the cached workflow template with the inputs injected; an uploaded
+        # input only exists on the backend it was pushed to
+        backend = backend_pool.choose()
+        image_input = resolve_input_image(image_path, image_url, token, backend)
+        backend = backend if 'input_image' in image_input else None
+        workflow = prepare_workflow('omnigen_image_to_image', text_prompt=text_prompt,
+                                    websocket_output=websocket_output, **image_input, **params)
+
+        # ComfyUI fetches the input image when the prompt runs, so async jobs
+        # hand it over to be deleted on completion instead of in finally
+        if is_async_request(data):
+            input_path = None if 'input_image' in image_input else image_path
+            prompt_id = submit_image_job(workflow, token, callback_url, input_path=input_path, backend=backend)
+            if input_path:
+                image_path = None
+            return image_job_accepted(prompt_id)
+
+        # Queue the prompt and wait on the shared WebSocket listener
+        if websocket_output:
+            prompt_id, images = run_websocket_workflow(workflow, token, backend)
+            return build_image_response(prompt_id, token, output_options, response_mode, images=images)
+        prompt_id = run_workflow(workflow, token, backend)
+
+        return build_image_response(prompt_id, token, output_options, response_mode)
+
+    except ImageValidationError as e:
+        return jsonify({'error': str(e)}), 400
+
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
+
+    except PromptFailed as e:
+        return prompt_failed_response(e)
 
-    image_path = None  # Initialize image path
+    except Exception as e:
+        return jsonify({'message': 'Unable to connect to the server. Make sure the server is running', 'error': str(e)}), 500
+
+    finally:
+        # Always delete the image if it was saved
+        if image_path and os.path.exists(image_path):
+            os.remove(image_path)
+            print(f"Deleted temporary image: {image_path}", flush=True)
+
+
+# Get image_tasks route
+@app.route('/v1/image_tasks/<prompt_id>', methods=['GET'])
+def image_tasks(prompt_id):
+    token = request.headers.get('Authorization')
+    if not token or not token.startswith("Bearer "):
+        return jsonify({'error': 'Valid Bearer token required'}), 400
+    token = token.split(" ")[1]
 
     try:
-        if image_file:
-            # Check if the file has an allowed extension
-            if not allowed_file(image_file.filename):
-                return jsonify({'error': 'Unsupported image format'}), 400
+        output_options = get_output_options(request.args)
+        response_mode = get_response_mode()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-            # Secure the filename
-            filename = secure_filename(image_file.filename)
+    # Tasks stored under another token are not revealed, not even from the result cache
+    task = job_store.get(prompt_id)
+    if task is not None and task['token_hash'] and not task_belongs_to(task, token):
+        return jsonify({'error': 'Unknown task', 'prompt_id': prompt_id}), 404
 
-            # Generate a unique path for the image
-            unique_filename = f"{uuid.uuid4()}_{filename}"
-            image_path = os.path.join('static', unique_filename)
+    try:
+        # Finished jobs are normally in the result cache already; otherwise ask ComfyUI
+        if result_cache.list(prompt_id) is None:
+            state, detail = lookup_task(prompt_id, token, task)
 
-            # Ensure the 'static' directory exists
-            os.makedirs('static', exist_ok=True)
+            if state == 'failed':
+                return jsonify({'error': detail, 'status': 'failed'}), 500
 
-            # Save the image to the static directory
-            image_file.save(image_path)
+            if state == 'pending':
+                return jsonify({
+                    'message': 'Image is being generated.',
+                    'status': 'pending',
+                    'prompts_in_queue': detail
+                }), 202
 
-            # Construct the public URL to access the image
-            image_url = f"https://gosign-de-comfyui-api.hf.space/{image_path}"
+            if not any('images' in node_output for node_output in detail.get('outputs', {}).values()):
+                return jsonify({
+                    'error': 'Prompt finished without producing images.',
+                    'status': 'failed',
+                    'details': detail.get('status', {})
+                }), 500
 
-        elif base64_image:
-            # Save base64 image
-            try:
-                pass
-                # image_path, image_url = save_base64_image(base64_image)
-                # image_url = "https://drive.google.com/uc?id=1JEHEy0zCVWOob4421hLQIPMbO_ebeCPS&export=download"
-            except Exception as e:
-                raise ValueError(f'Invalid base64 image data: {str(e)}')
+        return build_image_response(prompt_id, token, output_options, response_mode)
 
-        else:
-            return jsonify({'error': 'Image is required (file or base64)'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        # Load workflow configuration
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        workflow_path = os.path.join(current_dir, 'workflows/omnigen_image_to_image_workflow_api.json')
-        with open(workflow_path, 'r', encoding='utf-8') as f:
-            workflow = json.load(f)
 
-        # Modify workflow with inputs
-        workflow["6"]["inputs"]["prompt"] = "in image_1 " + text_prompt
-        workflow["6"]["inputs"]["num_inference_steps"] = steps
-        workflow["12"]["inputs"]["url"] = image_url
+# Get task state route
+@app.route('/v1/tasks/<prompt_id>', methods=['GET'])
+def task_state(prompt_id):
+    token = request.headers.get('Authorization')
+    if not token or not token.startswith("Bearer "):
+        return jsonify({'error': 'Valid Bearer token required'}), 400
 
-        # WebSocket connection to queue the prompt
-        ws = websocket.WebSocket()
-        ws.connect(f"{ws_address}?clientId={client_id}&token={token}",
-                   header={"Authorization": f"Bearer {token}"})
+    token = token.split(" ")[1]
 
-        images = get_images(ws, workflow, token)
-        ws.close()
+    # Someone else's task is reported exactly like one that does not exist
+    task = job_store.get(prompt_id)
+    if not task_belongs_to(task, token):
+        return jsonify({'error': 'Unknown task', 'prompt_id': prompt_id}), 404
 
-        output_images_base64 = []
+    return jsonify({key: task[key] for key in ('prompt_id', 'workflow', 'backend', 'params', 'status', 'error', 'outputs',
+                                               'created_at', 'submitted_at', 'started_at', 'finished_at')}), 200
 
-        for node_id in images:
-            for image_data in images[node_id]:
-                image = Image.open(io.BytesIO(image_data))
-                buffered = io.BytesIO()
-                image.save(buffered, format="PNG")
-                img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-                output_images_base64.append(img_str)
+                ################################################
+                # Server-Sent Events progress stream           #
+                ################################################
 
-        return jsonify({'images': output_images_base64}), 200
+SSE_FORWARDED_EVENTS = {'execution_start', 'execution_cached', 'executing', 'progress', 'executed',
+                        'execution_error', 'execution_interrupted', 'execution_success'}
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def get_queue_position(prompt_id, token):
+    """Return 0 while prompt_id is running, its 1-based place among pending prompts, or None."""
+    # Prompts still held by the local scheduler wait behind ComfyUI's whole queue
+    held_ahead = job_scheduler.position(prompt_id)
+    if held_ahead is not None:
+        return max(1, backend_for_prompt(prompt_id, token).queue_remaining + held_ahead)
+
+    queue_state = make_request(f"{backend_for_prompt(prompt_id, token).address}/queue", headers={'Authorization': f'Bearer {token}'}) or {}
+    if any(item[1] == prompt_id for item in queue_state.get('queue_running', [])):
+        return 0
+    pending = sorted(queue_state.get('queue_pending', []), key=lambda item: item[0])
+    for index, item in enumerate(pending):
+        if item[1] == prompt_id:
+            return index + 1
+    return None
+
+def completion_event(prompt_id, history):
+    """Summarise a finished prompt's history for the final 'complete' event."""
+    outputs = history.get('outputs', {})
+    data = {
+        'prompt_id': prompt_id,
+        'status': history.get('status', {}).get('status_str', 'success'),
+    }
+    if any('gifs' in node_output for node_output in outputs.values()):
+        data['get_video_url'] = f'{PUBLIC_BASE_URL}/v1/video_tasks/{prompt_id}'
+    if any('images' in node_output for node_output in outputs.values()):
+        data['get_image_url'] = f'{PUBLIC_BASE_URL}/v1/image_tasks/{prompt_id}'
+    return data
+
+# Get task events route
+@app.route('/v1/tasks/<prompt_id>/events', methods=['GET'])
+def task_events(prompt_id):
+    token = request.headers.get('Authorization')
+    if not token or not token.startswith("Bearer "):
+        return jsonify({'error': 'Valid Bearer token required'}), 400
+    token = token.split(" ")[1]
 
-    except Exception as e:
-        return jsonify({'message': 'Unable to connect to the server. Make sure the server is running', 'error': str(e)}), 500
+    task = job_store.get(prompt_id)
+    if task is not None and task['token_hash'] and not task_belongs_to(task, token):
+        return jsonify({'error': 'Unknown task', 'prompt_id': prompt_id}), 404
 
-    finally:
-        pass
-        # Always delete the image if it was saved
-        if image_path and os.path.exists(image_path):
-            os.remove(image_path)
-            print(f"Deleted temporary image: {image_path}", flush=True)
+    def finished_history():
+        return (get_history(prompt_id, token) or {}).get(prompt_id)
+
+    # An id nobody knows about would otherwise hold a worker until the deadline
+    history = None
+    if task is None and job_scheduler.backend_of(prompt_id) is None:
+        history = finished_history()
+        if not history and get_queue_position(prompt_id, token) is None:
+            return jsonify({'error': 'Unknown task', 'prompt_id': prompt_id}), 404
+
+    try:
+        listener = get_prompt_listener(prompt_id, token)
+    except websocket.WebSocketException as e:
+        return jsonify({'error': f'WebSocket connection failed: {str(e)}'}), 500
+
+    events = listener.subscribe(prompt_id)
+    deadline = time.time() + VIDEO_PROMPT_TIMEOUT if VIDEO_PROMPT_TIMEOUT else None
+
+    def generate():
+        try:
+            finished = history or finished_history()
+            if finished:
+                yield format_sse('complete', completion_event(prompt_id, finished))
+                return
+
+            started = False
+            last_position = time.time()
+            yield format_sse('queue', {'prompt_id': prompt_id,
+                                       'position': get_queue_position(prompt_id, token),
+                                       'queue_remaining': listener.queue_remaining})
+
+            while True:
+                wait = SSE_KEEPALIVE_INTERVAL
+                if deadline is not None:
+                    wait = min(wait, deadline - time.time())
+                    if wait <= 0:
+                        yield format_sse('timeout', {'prompt_id': prompt_id, 'status': 'timeout',
+                                                     'error': f'No result within {VIDEO_PROMPT_TIMEOUT:g}s'})
+                        return
+                try:
+                    message = events.get(timeout=wait)
+                except queue.Empty:
+                    # Prompts queued through another worker never reach this
+                    # listener, so fall back to checking the history
+                    finished = finished_history()
+                    if finished:
+                        yield format_sse('complete', completion_event(prompt_id, finished))
+                        return
+                    error = job_scheduler.failure(prompt_id)
+                    if error:
+                        yield format_sse('complete', {'prompt_id': prompt_id, 'status': 'error', 'error': error})
+                        return
+                    yield ': keepalive\n\n'
+                    continue
+
+                message_type = message.get('type')
+                if message_type == 'status':
+                    if not started and time.time() - last_position >= SSE_QUEUE_REFRESH_INTERVAL:
+                        last_position = time.time()
+                        yield format_sse('queue', {'prompt_id': prompt_id,
+                                                   'position': get_queue_position(prompt_id, token),
+                                                   'queue_remaining': listener.queue_remaining})
+                    continue
+
+                if message_type == 'reconnected':
+                    finished = finished_history()
+                    if finished:
+                        yield format_sse('complete', completion_event(prompt_id, finished))
+                        return
+                    continue
+
+                if message_type == 'execution_start':
+                    started = True
+                if message_type in SSE_FORWARDED_EVENTS:
+                    yield format_sse(message_type, message['data'])
+
+                if is_prompt_finished(message):
+                    yield format_sse('complete', completion_event(prompt_id, finished_history() or {}))
+                    return
+        finally:
+            listener.unsubscribe(prompt_id, events)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 # Get image route
@@ -296,43 +3569,137 @@ def get_image_file(filename):
 @app.route('/static/<path:filename>', methods=['GET'])
 def serve_static(filename):
     print(f"Request for static file: {filename}", flush=True)
-    return send_from_directory('static', filename)
+    static_storage.touch(os.path.join(STATIC_DIR, secure_filename(filename)))
+    return send_from_directory(STATIC_DIR, filename)
+
+
+def is_admin_token(token):
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+# Static storage usage and reclaim counters
+@app.route('/v1/storage_stats', methods=['GET'])
+def storage_stats():
+    token = request.headers.get('Authorization')
+    if not token or not token.startswith("Bearer "):
+        return jsonify({'error': 'Valid Bearer token required'}), 400
+    if not is_admin_token(token.split(" ")[1]):
+        return jsonify({'error': 'Admin token required'}), 403
+
+    return jsonify(static_storage.stats()), 200
+
+
+# ComfyUI backend pool status
+@app.route('/v1/backends', methods=['GET'])
+def backends_status():
+    token = request.headers.get('Authorization')
+    if not token or not token.startswith("Bearer "):
+        return jsonify({'error': 'Valid Bearer token required'}), 400
+    if not is_admin_token(token.split(" ")[1]):
+        return jsonify({'error': 'Admin token required'}), 403
+
+    return jsonify({'backends': [backend.to_dict() for backend in backend_pool.backends],
+                    'admission': admission_controller.stats(),
+                    'scheduler': job_scheduler.stats(),
+                    'job_store': job_store.stats()}), 200
 
 # Make a request route
 def make_request(url, data=None, headers=None):
-    req = urllib.request.Request(url, data=data, headers=headers)
-    try:
-        with urllib.request.urlopen(req) as response:
-            response_body = response.read().decode()  # Decode the response
-            # print(response_body)
-            return json.loads(response_body)  # Convert to JSON if valid
-    except urllib.error.HTTPError as e:
-        print(f"HTTPError: {e.code}, {e.reason}")
-        print(e.read().decode())  # Print detailed error response
-    except urllib.error.URLError as e:
-        print(f"URLError: {e.reason}")
+    method = 'POST' if data is not None else 'GET'
+    operation = urllib.parse.urlparse(url).path.strip('/').split('/')[0]
+    try:
+        response = http_session.request(method, url, data=data, headers=headers, timeout=http_timeout)
+        response.raise_for_status()
+        # print(response.text)
+        return response.json()  # Convert to JSON if valid
+    except requests.HTTPError as e:
+        count_upstream_error(operation, e)
+        print(f"HTTPError: {e.response.status_code}, {e.response.reason}")
+        print(e.response.text)  # Print detailed error response
+    except requests.ConnectionError as e:
+        count_upstream_error(operation, e)
+        print(f"URLError: {e}")
 
 # Helper: Queue the prompt
-def queue_prompt(workflow, token):
-    payload = {"prompt": workflow, "client_id": client_id}
+@timed_stage('queue_prompt')
+def queue_prompt(workflow, token, prompt_id=None, backend=None, admitted=False, interactive=True):
+    """Queue on the given backend, or on the least loaded one with failover on connection errors.
+
+    The token must pass admission control first unless the caller already
+    reserved a slot (admitted=True). With the scheduler enabled the prompt is
+    held locally and dispatched by priority; interactive requests someone is
+    waiting on go first. The returned prompt_id is pinned to its backend.
+    """
+    if not admitted:
+        admission_controller.admit(token)
+    try:
+        if job_scheduler.enabled:
+            prompt_id = job_scheduler.enqueue(workflow, token, prompt_id, backend, interactive)
+        else:
+            prompt_id = send_prompt(workflow, token, prompt_id, backend)
+    except Exception:
+        admission_controller.cancel(token)
+        raise
+    admission_controller.bind(token, prompt_id)
+    prompt_timer.queued(prompt_id)
+    record_task(prompt_id, workflow, token)
+    return prompt_id
+
+def post_prompt(backend, payload, token):
+    """POST a prompt payload to one backend and return the prompt_id ComfyUI queued it under."""
     headers = {
         'Authorization': f'Bearer {token}',
         'Content-Type': 'application/json'
     }
-    response = make_request(f"{server_address}/prompt", data=json.dumps(payload).encode('utf-8'), headers=headers)
-    if not response or 'prompt_id' not in response:
+    try:
+        response = http_session.post(f"{backend.address}/prompt", data=json.dumps(payload).encode('utf-8'),
+                                     headers=headers, timeout=http_timeout)
+    except requests.RequestException as e:
+        count_upstream_error('prompt', e)
+        raise
+    if not response.ok:
+        UPSTREAM_ERRORS.labels('prompt', 'http').inc()
+        print(f"HTTPError: {response.status_code}, {response.reason}")
+        print(response.text)  # Print detailed error response
+        raise ValueError("Failed to queue the prompt. Check the request or API response.")
+    result = response.json()
+    if 'prompt_id' not in result:
         raise ValueError("Failed to queue the prompt. Check the request or API response.")
-    return response['prompt_id']
+    return result['prompt_id']
+
+def send_prompt(workflow, token, prompt_id=None, backend=None):
+    """Send a workflow straight to ComfyUI, bypassing the local scheduler."""
+    last_error = None
+    model = model_signature(workflow)
+    for candidate in ([backend] if backend else backend_pool.candidates(model)):
+        try:
+            listener = get_listener(token, candidate)
+            payload = {"prompt": workflow, "client_id": listener.client_id}
+            if prompt_id:
+                payload["prompt_id"] = prompt_id
+            queued_id = post_prompt(candidate, payload, token)
+        except (websocket.WebSocketException, requests.ConnectionError) as e:
+            # The prompt never reached this backend, so it is safe to try the next one
+            backend_pool.mark_failed(candidate, e)
+            last_error = e
+            continue
+
+        backend_pool.mark_queued(candidate, queued_id)
+        backend_pool.note_model(candidate, model)
+        return queued_id
+
+    raise last_error
 
 # Get ComfyUI prompt history
+@timed_stage('history')
 def get_history(prompt_id, token):
     headers = {
         'Authorization': f'Bearer {token}',
         'Content-Type': 'application/json'
     }
-    return make_request(f"{server_address}/history/{prompt_id}", headers=headers)
+    return make_request(f"{backend_for_prompt(prompt_id, token).address}/history/{prompt_id}", headers=headers)
 
-def get_video_data(filename, subfolder, token):
+@timed_stage('view')
+def get_video_data(filename, subfolder, token, prompt_id=None):
     """
     Retrieve a video from the server using filename, subfolder, and token.
     """
@@ -345,27 +3712,141 @@ def get_video_data(filename, subfolder, token):
     }
 
     # Build the URL with encoded query parameters
-    url = f"{server_address}/view?{urllib.parse.urlencode(url_values)}"
+    url = f"{backend_for_prompt(prompt_id, token).address}/view?{urllib.parse.urlencode(url_values)}"
 
     print(f"Requesting URL: {url}", flush=True)
 
-    # Prepare the request with authorization token
-    req = urllib.request.Request(url)
-    req.add_header("Authorization", f"Bearer {token}")
-
     try:
-        # Fetch and return the video data
-        response = urllib.request.urlopen(req)
-        return response.read()
+        # Fetch and return the video data with the authorization token
+        response = http_session.get(url, headers={"Authorization": f"Bearer {token}"}, timeout=http_timeout)
+        response.raise_for_status()
+        return response.content
+
+    except requests.HTTPError as e:
+        count_upstream_error('view', e)
+        print(f"HTTP Error: {e.response.status_code} - {e.response.reason}")
+        print(e.response.text)  # Decode error message for readability
+        raise
 
-    except urllib.error.HTTPError as e:
-        print(f"HTTP Error: {e.code} - {e.reason}")
-        print(e.read().decode())  # Decode error message for readability
+    except requests.ConnectionError as e:
+        count_upstream_error('view', e)
+        print(f"URL Error: {e}")
         raise
 
-    except urllib.error.URLError as e:
-        print(f"URL Error: {e.reason}")
+@timed_stage('upload_to_comfyui')
+def upload_image_to_comfyui(image_path, token, backend):
+    """Push a local image into a backend's input folder and return the name LoadImage should use."""
+    with open(image_path, 'rb') as f:
+        response = http_session.post(
+            f"{backend.address}/upload/image",
+            files={'image': (os.path.basename(image_path), f)},
+            data={'type': 'input', 'overwrite': 'true'},
+            headers={'Authorization': f'Bearer {token}'},
+            timeout=http_timeout
+        )
+    response.raise_for_status()
+    result = response.json()
+    return f"{result['subfolder']}/{result['name']}" if result.get('subfolder') else result['name']
+
+def resolve_input_image(image_path, image_url, token, backend):
+    """Return the prepare_workflow() arguments that point a workflow at its input image.
+
+    In 'upload' mode the saved file is pushed straight to the backend that will
+    run the prompt; the public URL is only used when that is disabled, fails,
+    or there is no local file.
+    """
+    if IMAGE_INPUT_MODE == 'upload' and image_path:
+        try:
+            return {'input_image': upload_image_to_comfyui(image_path, token, backend)}
+        except Exception as e:
+            count_upstream_error('upload', e)
+            print(f"Uploading {image_path} to ComfyUI failed, falling back to URL: {e}", flush=True)
+    return {'image_url': image_url}
+
+@timed_stage('view')
+def open_video_stream(filename, token, range_header=None, method='GET', prompt_id=None):
+    """Open a streaming /view request for a video, forwarding the client's Range header."""
+    url = f"{backend_for_prompt(prompt_id, token).address}/view?{urllib.parse.urlencode({'filename': filename})}"
+    # Ask for identity encoding so upstream Content-Length/Content-Range stay valid for the client
+    headers = {"Authorization": f"Bearer {token}", "Accept-Encoding": "identity"}
+    if range_header:
+        headers['Range'] = range_header
+
+    try:
+        response = http_session.request(method, url, headers=headers, stream=True, timeout=http_timeout)
+        if response.status_code != 416:  # Unsatisfiable ranges are relayed to the client as-is
+            response.raise_for_status()
+    except requests.RequestException as e:
+        count_upstream_error('view', e)
         raise
+    return response
+
+def find_output_videos(history):
+    """Yield the first video/GIF of each output node in a prompt's history."""
+    for node_id, node_output in history.get('outputs', {}).items():
+        if 'gifs' in node_output:
+            yield node_output['gifs'][0]
+
+def video_etag(prompt_id, filename):
+    return hashlib.sha1(f"{prompt_id}/{filename}".encode('utf-8')).hexdigest()
+
+def stream_video_response(prompt_id, video, token):
+    """Proxy a finished video to the client in chunks, honouring Range, If-None-Match and HEAD."""
+    etag = video_etag(prompt_id, video['filename'])
+    headers = {
+        'ETag': f'"{etag}"',
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, max-age=86400',
+        'Content-Disposition': 'attachment; filename=generated_video.mp4',
+    }
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    upstream = open_video_stream(video['filename'], token, request.headers.get('Range'), request.method, prompt_id)
+    for header in ('Content-Length', 'Content-Range'):
+        if header in upstream.headers:
+            headers[header] = upstream.headers[header]
+
+    if request.method == 'HEAD':
+        upstream.close()
+        return Response(status=upstream.status_code, headers=headers, mimetype='video/mp4')
+
+    # A full download is copied into the result cache as it streams past, so
+    # later downloads and seeks are served from disk without touching ComfyUI.
+    writer = None
+    if upstream.status_code == 200:
+        writer = result_cache.open_writer(prompt_id, video['filename'], 'video/mp4', kind='video')
+
+    def generate():
+        completed = False
+        try:
+            for chunk in upstream.raw.stream(VIDEO_CHUNK_SIZE, decode_content=False):
+                if writer is not None:
+                    writer.write(chunk)
+                yield chunk
+            completed = True
+        finally:
+            upstream.close()
+            if writer is not None:
+                if completed:
+                    writer.commit()
+                    result_cache.mark_complete(prompt_id)
+                else:
+                    writer.abort()
+
+    return Response(generate(), status=upstream.status_code, headers=headers,
+                    mimetype='video/mp4', direct_passthrough=True)
+
+def download_video(filename, token, path, prompt_id=None):
+    """Stream a video from ComfyUI straight to a local file without buffering it in memory."""
+    upstream = open_video_stream(filename, token, prompt_id=prompt_id)
+    try:
+        with open(path, 'wb') as f:
+            for chunk in upstream.raw.stream(VIDEO_CHUNK_SIZE, decode_content=False):
+                f.write(chunk)
+    finally:
+        upstream.close()
+    return path
 
                 ########################################################
                 # Generate image to video using CogVideoX-5B-12V Model #
@@ -374,14 +3855,14 @@ def get_video_data(filename, subfolder, token):
 # Route: Image to Video
 @app.route('/v1/image_to_video', methods=['POST'])
 def v1_image_to_video():
-    data = request.json
-
     # Extract and validate token
     token = request.headers.get('Authorization')
     if not token or not token.startswith("Bearer "):
         return jsonify({'error': 'Valid Bearer token required'}), 400
     token = token.split(" ")[1]
 
+    data = get_request_data()
+
     # Validate text prompt
     text_prompt = data.get('text_prompt')
     frame_rate = data.get('frame_rate')
@@ -389,89 +3870,63 @@ def v1_image_to_video():
     if not text_prompt or not text_prompt.strip():
         return jsonify({'error': 'Text prompt is required'}), 400
 
-    # Check if frame_rate is missing or invalid
-    if not frame_rate:  # If frame_rate is None, empty, or 0
-        frame_rate = 24  # Default to 24 fps
-    else:
-        try:
-            frame_rate = int(frame_rate)
-            if frame_rate not in [8, 12, 24]:  # Ensure it's one of the allowed values
-                return jsonify({'error': 'Frame rate must be a valid number (8, 12, or 24).'}), 400
-        except ValueError:
-            return jsonify({'error': 'Frame rate must be a valid number (8, 12, or 24).'}), 400
-
-    if not steps:
-        steps = 50
-    # Handle uploaded image or base64 image
-    image_file = request.files.get('image')
-    base64_image = data.get('base64_image')
+    # Validate frame_rate and steps; missing, empty or 0 fall back to 24 fps and 50 steps
+    try:
+        params = validate_workflow_params('cogvideox_image_to_video', frame_rate=frame_rate or None, steps=steps or None)
+    except WorkflowParameterError as e:
+        return jsonify({'error': str(e)}), 400
 
     image_path = None  # Initialize image path
+    image_input = None
 
     try:
-        if image_file:
-            # Check if the file has an allowed extension
-            if not allowed_file(image_file.filename):
-                return jsonify({'error': 'Unsupported image format'}), 400
-
-            # Secure the filename
-            filename = secure_filename(image_file.filename)
-
-            # Generate a unique path for the image
-            unique_filename = f"{uuid.uuid4()}_{filename}"
-            image_path = os.path.join('static', unique_filename)
-
-            # Ensure the 'static' directory exists
-            os.makedirs('static', exist_ok=True)
-
-            # Save the image to the static directory
-            image_file.save(image_path)
-
-            # Construct the public URL to access the image
-            image_url = f"https://gosign-de-comfyui-api.hf.space/{image_path}"
+        # Handle uploaded image or base64 image
+        image_path, image_url = save_request_image(data)
+        if not image_path:
+            return jsonify({'error': 'Image is required (file or base64)'}), 400
 
-        elif base64_image:
-            # Save base64 image
-            try:
-                image_path, image_url = save_base64_image(base64_image)
-            except Exception as e:
-                raise ValueError(f'Invalid base64 image data: {str(e)}')
+        # Check the saved image from its header and shrink it to the model's resolution
+        if image_path:
+            prepare_input_image(image_path, 'cogvideox_image_to_video')
 
-        else:
-            return jsonify({'error': 'Image is required (file or base64)'}), 400
+        # Copy the cached workflow template with the inputs injected; an uploaded
+        # input only exists on the backend it was pushed to
+        backend = backend_pool.choose()
+        image_input = resolve_input_image(image_path, image_url, token, backend)
+        backend = backend if 'input_image' in image_input else None
+        workflow = prepare_workflow('cogvideox_image_to_video', text_prompt=text_prompt,
+                                    **image_input, **params)
 
-        # Load workflow configuration
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        workflow_path = os.path.join(current_dir, 'workflows/cogvideox_image_to_video_workflow_api.json')
-        with open(workflow_path, 'r', encoding='utf-8') as f:
-            workflow = json.load(f)
+        # Queue the prompt under the shared WebSocket listener's client id
+        prompt_id = queue_prompt(workflow, token, backend=backend, interactive=False)
 
-        # Modify workflow with inputs
-        workflow["30"]["inputs"]["prompt"] = text_prompt
-        workflow["31"]["inputs"]["prompt"] = "Low quality, watermark, strange motion, blur"
-        workflow["44"]["inputs"]["frame_rate"] = frame_rate
-        workflow["57"]["inputs"]["steps"] = steps
-        workflow["73"]["inputs"]["url"] = image_url
+        # A URL input must stay in static/ until ComfyUI has run the prompt
+        if 'input_image' not in image_input:
+            static_storage.track(image_path, prompt_id)
+            release_when_complete(get_prompt_listener(prompt_id, token), prompt_id)
 
-        # WebSocket connection to queue the prompt
-        ws = websocket.WebSocket()
-        ws.connect(f"{ws_address}?clientId={client_id}&token={token}",
-                   header={"Authorization": f"Bearer {token}"})
+        return jsonify({'prompt_id': prompt_id, 'message': 'Prompt queued successfully', 'get_video_url': f'{PUBLIC_BASE_URL}/v1/video_tasks/{prompt_id}'}), 202
 
-        # Queue the prompt
-        prompt_id = queue_prompt(workflow, token)
+    except ImageValidationError as e:
+        # A rejected image will never be read by ComfyUI, so drop it right away
+        if image_path and os.path.exists(image_path):
+            os.remove(image_path)
+        return jsonify({'error': str(e)}), 400
 
-        return jsonify({'prompt_id': prompt_id, 'message': 'Prompt queued successfully', 'get_video_url': f'https://gosign-de-comfyui-api.hf.space/v1/video_tasks/{prompt_id}'}), 202
+    except AdmissionRejected as e:
+        if image_path and os.path.exists(image_path):
+            os.remove(image_path)
+        return admission_rejected_response(e)
 
     except Exception as e:
         return jsonify({'message': 'Unbale to connect to the server. Make sure the server is running', 'error': str(e)}), 500
 
     finally:
-        pass
-        # Always delete the image if it was saved
-        # if image_path and os.path.exists(image_path):
-        #     os.remove(image_path)
-        #     print(f"Deleted temporary image: {image_path}", flush=True)
+        # ComfyUI downloads URL inputs when the prompt runs, so the image can only
+        # be deleted right away once it has been uploaded to ComfyUI directly
+        if image_input and 'input_image' in image_input and image_path and os.path.exists(image_path):
+            os.remove(image_path)
+            print(f"Deleted temporary image: {image_path}", flush=True)
 
 
                 ###################################################
@@ -481,14 +3936,14 @@ def v1_image_to_video():
 # Route: Text to Video
 @app.route('/v1/text_to_video', methods=['POST'])
 def v1_text_to_video():
-    data = request.json
-
     # Extract and validate token
     token = request.headers.get('Authorization')
     if not token or not token.startswith("Bearer "):
         return jsonify({'error': 'Valid Bearer token required'}), 400
     token = token.split(" ")[1]
 
+    data = get_request_data()
+
     # Validate text prompt
     text_prompt = data.get('text_prompt')
     frame_rate = data.get('frame_rate')
@@ -496,107 +3951,70 @@ def v1_text_to_video():
     if not text_prompt or not text_prompt.strip():
         return jsonify({'error': 'Text prompt is required'}), 400
 
-    # Check if frame_rate is missing or invalid
-    if not frame_rate:  # If frame_rate is None, empty, or 0
-        frame_rate = 24  # Default to 24 fps
-    else:
-        try:
-            frame_rate = int(frame_rate)
-            if frame_rate not in [8, 12, 24]:  # Ensure it's one of the allowed values
-                return jsonify({'error': 'Frame rate must be a valid number (8, 12, or 24).'}), 400
-        except ValueError:
-            return jsonify({'error': 'Frame rate must be a valid number (8, 12, or 24).'}), 400
+    # Validate frame_rate and steps; missing, empty or 0 fall back to 24 fps and 50 steps
+    try:
+        params = validate_workflow_params('cogvideox_text_to_video', frame_rate=frame_rate or None, steps=steps or None)
+    except WorkflowParameterError as e:
+        return jsonify({'error': str(e)}), 400
 
-    if not steps:
-        steps = 50
 
     try:
-        # Load workflow configuration
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        workflow_path = os.path.join(current_dir, 'workflows/cogvideox_text_to_video_workflow_api.json')
-        with open(workflow_path, 'r', encoding='utf-8') as f:
-            workflow = json.load(f)
+        # Copy the cached workflow template with the inputs injected
+        workflow = prepare_workflow('cogvideox_text_to_video', text_prompt=text_prompt, **params)
 
-        # Modify workflow with inputs
-        workflow["30"]["inputs"]["prompt"] = text_prompt
-        workflow["31"]["inputs"]["prompt"] = "Low quality, watermark, strange motion, blur"
-        workflow["33"]["inputs"]["frame_rate"] = frame_rate
-        workflow["34"]["inputs"]["steps"] = steps
+        # Queue the prompt under the shared WebSocket listener's client id
+        prompt_id = queue_prompt(workflow, token, interactive=False)
 
-        # WebSocket connection to queue the prompt
-        ws = websocket.WebSocket()
-        ws.connect(f"{ws_address}?clientId={client_id}&token={token}",
-                   header={"Authorization": f"Bearer {token}"})
+        return jsonify({'prompt_id': prompt_id, 'message': 'Prompt queued successfully', 'get_video_url': f'{PUBLIC_BASE_URL}/v1/video_tasks/{prompt_id}'}), 202
 
-        # Queue the prompt
-        prompt_id = queue_prompt(workflow, token)
-
-        return jsonify({'prompt_id': prompt_id, 'message': 'Prompt queued successfully', 'get_video_url': f'https://gosign-de-comfyui-api.hf.space/v1/video_tasks/{prompt_id}'}), 202
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
 
     except Exception as e:
         return jsonify({'message': 'Unbale to connect to the server. Make sure the server is running', 'error': str(e)}), 500
 
 
 # Get video_tasks route
-@app.route('/v1/video_tasks/<prompt_id>', methods=['GET'])
+@app.route('/v1/video_tasks/<prompt_id>', methods=['GET', 'HEAD'])
 def video_tasks(prompt_id):
     token = request.headers.get('Authorization')
     if not token or not token.startswith("Bearer "):
         return jsonify({'error': 'Valid Bearer token required'}), 400
     token = token.split(" ")[1]
 
-    try:
-
-        # Establish WebSocket connection to fetch real-time status
-        ws = websocket.WebSocket()
-        ws.connect(f"{ws_address}?clientId={client_id}&token={token}",
-                   header={"Authorization": f"Bearer {token}"})
+    # Tasks stored under another token are not revealed, not even from the result cache
+    task = job_store.get(prompt_id)
+    if task is not None and task['token_hash'] and not task_belongs_to(task, token):
+        return jsonify({'error': 'Unknown task', 'prompt_id': prompt_id}), 404
 
-        # Request current status of the specific prompt
-        ws.send(json.dumps({"type": "get_status", "prompt_id": prompt_id}))
-        response = json.loads(ws.recv())
+    try:
+        # Serve finished videos from the local result cache without any upstream calls
+        cached = result_cache.list(prompt_id)
+        for entry in cached or []:
+            if entry.get('kind') == 'video':
+                return send_cached_output(entry, 'generated_video.mp4', video_etag(prompt_id, entry['filename']))
 
-        # Extract the necessary fields for the specific prompt
-        queue_remaining = response.get('data', {}).get('status', {}).get('exec_info', {}).get('queue_remaining', 0)
+        # Answered from the job store when it can be, else from ComfyUI's history
+        state, detail = lookup_task(prompt_id, token, task)
 
-        # Now proceed to check if the prompt has completed successfully
-        history = get_history(prompt_id, token).get(prompt_id, {})
+        if state == 'failed':
+            return jsonify({'error': detail, 'status': 'failed'}), 500
 
-        if not history:
+        if state == 'pending':
             return jsonify({
                 'message': 'Video is being generated.',
                 'status': 'pending',
-                'prompts_in_queue': queue_remaining
+                'prompts_in_queue': detail
             }), 202
 
-        video_data = None
-
-        # Extract video or GIF details
-        for node_id, node_output in history.get('outputs', {}).items():
-            if 'gifs' in node_output:
-                video = node_output['gifs'][0]  # Take the first available GIF/video
+        # Stream the first video/GIF that ComfyUI can serve
+        for video in find_output_videos(detail):
+            try:
+                return stream_video_response(prompt_id, video, token)
+            except Exception as e:
+                print(f"Failed to retrieve video: {str(e)}")
 
-                try:
-                    video_data = get_video_data(video['filename'], video['subfolder'], token)
-                    break  # Stop after fetching the first valid video
-                except Exception as e:
-                    print(f"Failed to retrieve video: {str(e)}")
-
-        if not video_data:
-            return jsonify({'error': 'Failed to retrieve video data.'}), 500
-
-        # Save the video locally
-        # local_video_path = f"static/generated_image_to_video_{prompt_id}.mp4"
-        # with open(local_video_path, 'wb') as f:
-        #     f.write(video_data)
-
-        # Send the video as an HTTP response
-        return send_file(
-            io.BytesIO(video_data),
-            mimetype='video/mp4',
-            as_attachment=True,
-            download_name='generated_video.mp4'
-        )
+        return jsonify({'error': 'Failed to retrieve video data.'}), 500
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -604,14 +4022,14 @@ def video_tasks(prompt_id):
 # Route: Image to Video old
 @app.route('/image_to_video', methods=['POST'])
 def image_to_video():
-    data = request.json
-
     # Extract and validate token
     token = request.headers.get('Authorization')
     if not token or not token.startswith("Bearer "):
         return jsonify({'error': 'Valid Bearer token required'}), 400
     token = token.split(" ")[1]
 
+    data = get_request_data()
+
     # Validate text prompt
     text_prompt = data.get('text_prompt')
     frame_rate = data.get('frame_rate')
@@ -619,119 +4037,55 @@ def image_to_video():
     if not text_prompt or not text_prompt.strip():
         return jsonify({'error': 'Text prompt is required'}), 400
 
-    # Check if frame_rate is missing or invalid
-    if not frame_rate:  # If frame_rate is None, empty, or 0
-        frame_rate = 24  # Default to 24 fps
-    else:
-        try:
-            frame_rate = int(frame_rate)
-            if frame_rate not in [8, 12, 24]:
-                return jsonify({'error': 'Frame rate must be a valid number (8, 12, or 24).'}), 400
-        except ValueError:
-            return jsonify({'error': 'Frame rate must be a valid number (8, 12, or 24).'}), 400
-
-    if not steps:
-        steps = 50
+    # Validate frame_rate and steps; missing, empty or 0 fall back to 24 fps and 50 steps
+    try:
+        params = validate_workflow_params('cogvideox_image_to_video', frame_rate=frame_rate or None, steps=steps or None)
+    except WorkflowParameterError as e:
+        return jsonify({'error': str(e)}), 400
 
-    # Handle uploaded image or base64 image
-    image_file = request.files.get('image')
-    base64_image = data.get('base64_image')
 
     image_path = None  # Initialize image path
 
     try:
-        if image_file:
-            # Check if the file has an allowed extension
-            if not allowed_file(image_file.filename):
-                return jsonify({'error': 'Unsupported image format'}), 400
-
-            # Secure the filename
-            filename = secure_filename(image_file.filename)
-
-            # Generate a unique path for the image
-            unique_filename = f"{uuid.uuid4()}_{filename}"
-            image_path = os.path.join('static', unique_filename)
-
-            # Ensure the 'static' directory exists
-            os.makedirs('static', exist_ok=True)
-
-            # Save the image to the static directory
-            image_file.save(image_path)
-
-            # Construct the public URL to access the image
-            image_url = f"https://gosign-de-comfyui-api.hf.space/{image_path}"
-
-        elif base64_image:
-            # Save base64 image
-            try:
-                image_path, image_url = save_base64_image(base64_image)
-            except Exception as e:
-                raise ValueError(f'Invalid base64 image data: {str(e)}')
-
-        else:
+        # Handle uploaded image or base64 image
+        image_path, image_url = save_request_image(data)
+        if not image_path:
             return jsonify({'error': 'Image is required (file or base64)'}), 400
 
-        # Load workflow configuration
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        workflow_path = os.path.join(current_dir, 'workflows/cogvideox_image_to_video_workflow_api.json')
-        with open(workflow_path, 'r', encoding='utf-8') as f:
-            workflow = json.load(f)
+        # Check the saved image from its header and shrink it to the model's resolution
+        if image_path:
+            prepare_input_image(image_path, 'cogvideox_image_to_video')
 
-        # Modify workflow with inputs
-        workflow["30"]["inputs"]["prompt"] = text_prompt
-        workflow["31"]["inputs"]["prompt"] = "Low quality, watermark, strange motion, blur"
-        workflow["44"]["inputs"]["frame_rate"] = frame_rate
-        workflow["57"]["inputs"]["steps"] = steps
-        workflow["73"]["inputs"]["url"] = image_url
+        # Copy the cached workflow template with the inputs injected; an uploaded
+        # input only exists on the backend it was pushed to
+        backend = backend_pool.choose()
+        image_input = resolve_input_image(image_path, image_url, token, backend)
+        backend = backend if 'input_image' in image_input else None
+        workflow = prepare_workflow('cogvideox_image_to_video', text_prompt=text_prompt,
+                                    **image_input, **params)
 
-        # WebSocket connection to queue and monitor workflow
-        ws = websocket.WebSocket()
-        ws.connect(f"{ws_address}?clientId={client_id}&token={token}",
-                   header={"Authorization": f"Bearer {token}"})
-
-        # Queue the prompt and wait for completion
-        prompt_id = queue_prompt(workflow, token)
-
-
-        # Wait for workflow execution to complete
-        last_ping = time.time()
-        PING_INTERVAL = 30
-
-        # Wait for workflow execution to complete
-        while True:
-            message = json.loads(ws.recv())
-            if message.get('type') == 'executing' and message['data']['node'] is None \
-                    and message['data']['prompt_id'] == prompt_id:
-                break
-
-            # Send a ping if PING_INTERVAL has passed
-            if time.time() - last_ping > PING_INTERVAL:
-                ws.send('ping')
-                last_ping = time.time()
+        # Queue the prompt and wait for completion on the shared listener
+        listener, prompt_id, events = submit_prompt(workflow, token, backend)
+        wait_for_prompt(listener, prompt_id, events, token, prompt_timeout(workflow), client_disconnect_probe())
 
         # Fetch the history of the workflow
         history = get_history(prompt_id, token).get(prompt_id, {})
-        video_data = None
+        local_video_path = os.path.join(STATIC_DIR, f"generated_image_to_video_{prompt_id}.mp4")
+        video_saved = False
 
-        # Find the video or GIF data from the outputs
-        for node_id, node_output in history.get('outputs', {}).items():
-            if 'gifs' in node_output:
-                video = node_output['gifs'][0]  # Take the first video/GIF
-                try:
-                    video_data = get_video_data(video['filename'], video['subfolder'], token)
-                    break  # Stop after fetching the first valid video
-                except Exception as e:
-                    print(f"Failed to retrieve video: {str(e)}")
+        # Stream the first available video/GIF to disk
+        for video in find_output_videos(history):
+            try:
+                download_video(video['filename'], token, local_video_path, prompt_id)
+                video_saved = True
+                break  # Stop after fetching the first valid video
+            except Exception as e:
+                print(f"Failed to retrieve video: {str(e)}")
 
         # Ensure video data was retrieved
-        if not video_data:
+        if not video_saved:
             raise ValueError('Failed to generate video')
 
-        # Save the video locally
-        local_video_path = f"static/generated_image_to_video_{prompt_id}.mp4"
-        with open(local_video_path, 'wb') as f:
-            f.write(video_data)
-
         # Construct the public URL for the video
 
         # video_url = f"https://gosign-de-comfyui-api.hf.space/{local_video_path}"
@@ -744,16 +4098,26 @@ def image_to_video():
 
         # return jsonify(response_data), 200
 
-        # Send the video as an HTTP response
+        # Send the saved video from disk (supports Range requests)
         response = send_file(
-            io.BytesIO(video_data),
+            local_video_path,
             mimetype='video/mp4',
             as_attachment=True,
-            download_name='generated_video.mp4'
+            download_name='generated_video.mp4',
+            conditional=True
         )
 
         return response
 
+    except ImageValidationError as e:
+        return jsonify({'error': str(e)}), 400
+
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
+
+    except PromptFailed as e:
+        return prompt_failed_response(e)
+
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -764,5 +4128,118 @@ def image_to_video():
             print(f"Deleted temporary image: {image_path}", flush=True)
 
 
+                ################################################
+                # Schema-driven workflow endpoint              #
+                ################################################
+
+# Available workflows and their parameters
+@app.route('/v1/workflows', methods=['GET'])
+def list_workflows():
+    token = request.headers.get('Authorization')
+    if not token or not token.startswith("Bearer "):
+        return jsonify({'error': 'Valid Bearer token required'}), 400
+
+    return jsonify({'workflows': {name: template.describe() for name, template in sorted(workflow_registry.items())}}), 200
+
+# Route: run any workflow declared in workflows/schemas
+@app.route('/v1/workflows/<name>/run', methods=['POST'])
+def run_named_workflow(name):
+    """Fill in a workflow from its schema and run it.
+
+    Image workflows answer like /generate_image (synchronously, or with a job
+    id when async is set); video workflows are queued and answered with a
+    video_tasks URL. Workflows with an input image take it as an `image`
+    upload, `base64_image` or the schema's URL parameter.
+    """
+    token = request.headers.get('Authorization')
+    if not token or not token.startswith("Bearer "):
+        return jsonify({'error': 'Valid Bearer token required'}), 400
+    token = token.split(" ")[1]
+
+    template = get_workflow_template(name)
+    if template is None:
+        return jsonify({'error': f"Unknown workflow '{name}'"}), 404
+
+    data = get_request_data()
+    # Empty form fields count as missing so schema defaults apply
+    values = {param: data[param] for param in template.params if data.get(param) not in (None, '')}
+
+    websocket_output = False
+    try:
+        params = template.validate(**values)
+        if template.kind == 'image':
+            output_options = get_output_options(data)
+            response_mode = get_response_mode()
+            callback_url = get_callback_url(data)
+            websocket_output = get_image_delivery(data) == 'websocket' and not is_async_request(data) \
+                and template.output_node is not None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    image_path = None
+    try:
+        backend = None
+        image_input = {}
+        if template.image_node is not None:
+            image_path, image_url = save_request_image(data)
+
+        if image_path:
+            # Check the saved image from its header and shrink it to the model's resolution
+            prepare_input_image(image_path, name)
+
+            # An uploaded input only exists on the backend it was pushed to
+            backend = backend_pool.choose()
+            image_input = resolve_input_image(image_path, image_url, token, backend)
+            if 'input_image' not in image_input:
+                params[template.image_param] = image_input.pop('image_url')
+                backend = None
+
+        # ComfyUI downloads a URL input when the prompt runs, so queued prompts take the file over
+        url_input_path = image_path if image_path and not image_input else None
+        workflow = prepare_workflow(name, websocket_output=websocket_output, **image_input, **params)
+
+        if template.kind == 'video':
+            prompt_id = queue_prompt(workflow, token, backend=backend, interactive=False)
+            if url_input_path:
+                static_storage.track(url_input_path, prompt_id)
+                release_when_complete(get_prompt_listener(prompt_id, token), prompt_id)
+                image_path = None
+            return jsonify({'prompt_id': prompt_id, 'message': 'Prompt queued successfully',
+                            'get_video_url': f'{PUBLIC_BASE_URL}/v1/video_tasks/{prompt_id}'}), 202
+
+        if is_async_request(data):
+            prompt_id = submit_image_job(workflow, token, callback_url, input_path=url_input_path, backend=backend)
+            if url_input_path:
+                image_path = None
+            return image_job_accepted(prompt_id)
+
+        if websocket_output:
+            prompt_id, images = run_websocket_workflow(workflow, token, backend)
+            return build_image_response(prompt_id, token, output_options, response_mode, images=images)
+        prompt_id = run_workflow(workflow, token, backend)
+        return build_image_response(prompt_id, token, output_options, response_mode)
+
+    except (ImageValidationError, WorkflowParameterError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
+
+    except PromptFailed as e:
+        return prompt_failed_response(e)
+
+    except websocket.WebSocketException as e:
+        return jsonify({'error': f'WebSocket connection failed: {str(e)}'}), 500
+
+    except Exception as e:
+        return jsonify({'message': 'Unable to connect to the server. Make sure the server is running', 'error': str(e)}), 500
+
+    finally:
+        # Uploaded inputs are already on the backend; URL inputs of synchronous runs have been read
+        if image_path and os.path.exists(image_path):
+            os.remove(image_path)
+            print(f"Deleted temporary image: {image_path}", flush=True)
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=7860, debug=True)
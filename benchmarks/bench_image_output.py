@@ -0,0 +1,103 @@
+"""
+Compare latency and peak RSS of the image response paths for 1-8 image batches.
+
+    python benchmarks/bench_image_output.py [--size 1024] [--repeat 5]
+
+Each (mode, batch) case runs in a fresh process so ru_maxrss reflects that case only.
+Modes:
+  reencode     - the previous path: PIL decode, re-save as PNG, base64
+  passthrough  - the current default: base64 of the original PNG bytes
+  webp         - opt-in transcode to WebP (quality 90) in the transcode thread pool
+"""
+import argparse
+import base64
+import io
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BATCHES = [1, 2, 4, 8]
+MODES = ['reencode', 'passthrough', 'webp']
+
+
+def make_png(size, seed):
+    """Build a PNG that compresses like a real render (smooth gradients plus noise)."""
+    from PIL import Image, ImageFilter
+    noise = Image.effect_noise((size, size), 40 + seed).convert('RGB')
+    gradient = Image.linear_gradient('L').resize((size, size)).convert('RGB')
+    image = Image.blend(gradient, noise, 0.35).filter(ImageFilter.SMOOTH)
+    buffered = io.BytesIO()
+    image.save(buffered, format='PNG')
+    return buffered.getvalue()
+
+
+def run_case(mode, batch, size, repeat, results):
+    from PIL import Image
+    import app
+
+    images = {'9': [make_png(size, seed) for seed in range(batch)]}
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        if mode == 'reencode':
+            encoded = []
+            for image_data in images['9']:
+                image = Image.open(io.BytesIO(image_data))
+                buffered = io.BytesIO()
+                image.save(buffered, format='PNG')
+                encoded.append(base64.b64encode(buffered.getvalue()).decode('utf-8'))
+        else:
+            options = {'format': 'png' if mode == 'passthrough' else mode, 'quality': None, 'max_side': None}
+            encoded = [base64.b64encode(image_data).decode('utf-8')
+                       for image_data in app.encode_output_images(images, options)]
+        timings.append(time.perf_counter() - start)
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put({
+        'mode': mode,
+        'batch': batch,
+        'mean_ms': sum(timings) / len(timings) * 1000,
+        'min_ms': min(timings) * 1000,
+        'peak_rss_mb': peak_rss / 1024,
+        'rss_growth_mb': (peak_rss - baseline_rss) / 1024,
+        'payload_kb': sum(len(item) for item in encoded) / 1024,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1024, help='edge length of the generated test images')
+    parser.add_argument('--repeat', type=int, default=5, help='iterations per case')
+    args = parser.parse_args()
+
+    # Importing app creates its cache, static folder, job queue and task store; keep them out of the checkout.
+    # Spawned case processes inherit the environment.
+    state_dir = tempfile.mkdtemp(prefix='bench-image-output-')
+    os.environ.update(RESULT_CACHE_DIR=os.path.join(state_dir, 'results'), SCHEDULER_DB=os.path.join(state_dir, 'jobs.db'),
+                      JOB_STORE_DB=os.path.join(state_dir, 'tasks.db'), STATIC_DIR=os.path.join(state_dir, 'static'))
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+
+    print(f"{'mode':<12}{'batch':>6}{'mean ms':>10}{'min ms':>10}{'peak RSS MB':>13}{'RSS +MB':>10}{'payload KB':>12}")
+    for batch in BATCHES:
+        for mode in MODES:
+            process = context.Process(target=run_case, args=(mode, batch, args.size, args.repeat, results))
+            process.start()
+            row = results.get()
+            process.join()
+            print(f"{row['mode']:<12}{row['batch']:>6}{row['mean_ms']:>10.1f}{row['min_ms']:>10.1f}"
+                  f"{row['peak_rss_mb']:>13.1f}{row['rss_growth_mb']:>10.1f}{row['payload_kb']:>12.0f}")
+    shutil.rmtree(state_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
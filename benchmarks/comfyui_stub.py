@@ -0,0 +1,376 @@
+"""
+A stand-in ComfyUI server for running and benchmarking the app without a GPU.
+
+    python benchmarks/comfyui_stub.py --port 8188 --execution-time 2 --image-size 1024
+
+then start the app with SERVER_ADDRESS=http://127.0.0.1:8188 and WS_ADDRESS=ws://127.0.0.1:8188/ws.
+
+Only the standard library is used. The stub implements the parts of the ComfyUI API
+the app calls: POST /prompt, GET /history/<id>, GET /view (with Range), POST
+/upload/image, GET and POST /queue, POST /interrupt, GET /system_stats and the /ws
+WebSocket. Prompts run --parallel at a time (1, like one GPU). Each one waits --delay
+seconds, then reports progress from its sampler node over --execution-time seconds.
+It emits the same execution_start/executing/progress/executed/status messages as
+ComfyUI, and SaveImageWebsocket nodes send their images as binary frames. When the
+model loader nodes differ from the previous prompt's, --model-switch-time is added.
+
+GET /stub/stats reports prompts, /view downloads, model switches and HTTP and
+WebSocket connection counts (current and peak). POST /stub/reset zeroes them.
+"""
+import argparse
+import base64
+import email.parser
+import hashlib
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import urllib.parse
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+SAMPLER_INPUTS = ('steps', 'num_inference_steps')
+
+
+def make_png(size):
+    """Encode a size x size RGB PNG of noise, which compresses about as badly as a real render."""
+    rows = b''.join(b'\x00' + os.urandom(size * 3) for _ in range(size))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows, 1)) + chunk(b'IEND', b''))
+
+
+class WebSocketClient:
+    """Server side of one WebSocket: unmasked frames out, masked frames in."""
+
+    def __init__(self, handler, client_id):
+        self.handler = handler
+        self.client_id = client_id
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def send(self, opcode, payload):
+        header = bytes([0x80 | opcode])
+        if len(payload) < 126:
+            header += bytes([len(payload)])
+        elif len(payload) < 65536:
+            header += bytes([126]) + struct.pack('>H', len(payload))
+        else:
+            header += bytes([127]) + struct.pack('>Q', len(payload))
+        with self._lock:
+            if self.closed:
+                return
+            try:
+                self.handler.connection.sendall(header + payload)
+            except OSError:
+                self.closed = True
+
+    def send_json(self, message):
+        self.send(0x1, json.dumps(message).encode('utf-8'))
+
+    def receive(self):
+        """Return (opcode, payload) of the next client frame, or (None, b'') once the connection is gone."""
+        rfile = self.handler.rfile
+        head = rfile.read(2)
+        if len(head) < 2:
+            return None, b''
+        opcode, length = head[0] & 0x0f, head[1] & 0x7f
+        if length == 126:
+            length = struct.unpack('>H', rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack('>Q', rfile.read(8))[0]
+        mask = rfile.read(4) if head[1] & 0x80 else b'\x00\x00\x00\x00'
+        data = rfile.read(length)
+        return opcode, bytes(byte ^ mask[index % 4] for index, byte in enumerate(data))
+
+
+class ComfyStub:
+    """Prompt queue, executor threads and history of the stub server."""
+
+    def __init__(self, parallel, delay, execution_time, progress_steps, image_size, video_bytes, model_switch_time,
+                 ignore_prompt_id=False):
+        self.delay = delay
+        self.execution_time = execution_time
+        self.progress_steps = progress_steps
+        self.model_switch_time = model_switch_time
+        self.ignore_prompt_id = ignore_prompt_id
+        self.image = make_png(image_size)
+        self.video = os.urandom(video_bytes)
+        self.clients = {}
+        self.history = {}
+        self.pending = []
+        self.running = {}
+        self.interrupted = set()
+        self.loaded_model = None
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self.reset()
+        for index in range(parallel):
+            threading.Thread(target=self._worker, name=f'stub-executor-{index}', daemon=True).start()
+
+    def reset(self):
+        """Zero the counters; open connections stay counted and become the new peaks."""
+        with self._lock:
+            current = getattr(self, 'stats', {})
+            http_connections = current.get('http_connections', 0)
+            ws_connections = current.get('ws_connections', 0)
+            self.stats = {'prompts': 0, 'views': 0, 'uploads': 0, 'model_switches': 0,
+                          'http_connections': http_connections, 'http_connections_total': 0,
+                          'http_connections_peak': http_connections,
+                          'ws_connections': ws_connections, 'ws_connections_peak': ws_connections}
+
+    def count(self, name, delta=1):
+        with self._lock:
+            self.stats[name] += delta
+            peak = name + '_peak'
+            if peak in self.stats:
+                self.stats[peak] = max(self.stats[peak], self.stats[name])
+
+    def broadcast_status(self):
+        remaining = len(self.pending) + len(self.running)
+        for client in list(self.clients.values()):
+            client.send_json({'type': 'status', 'data': {'status': {'exec_info': {'queue_remaining': remaining}}}})
+
+    def send(self, client_id, message):
+        client = self.clients.get(client_id)
+        if client is not None:
+            if isinstance(message, bytes):
+                client.send(0x2, message)
+            else:
+                client.send_json(message)
+
+    def submit(self, body):
+        prompt_id = (not self.ignore_prompt_id and body.get('prompt_id')) or str(uuid.uuid4())
+        with self._lock:
+            self.stats['prompts'] += 1
+            number = self.stats['prompts']
+            self.pending.append((number, prompt_id))
+        self._jobs.put((number, prompt_id, body.get('client_id'), body['prompt']))
+        self.broadcast_status()
+        return {'prompt_id': prompt_id, 'number': number, 'node_errors': {}}
+
+    def delete(self, prompt_ids):
+        with self._lock:
+            self.pending = [item for item in self.pending if item[1] not in prompt_ids]
+
+    def interrupt(self, prompt_id=None):
+        """Stop the running prompt, or only prompt_id if that is the one running, like ComfyUI."""
+        with self._lock:
+            self.interrupted.update(running for running in self.running if prompt_id in (None, running))
+
+    def queue_state(self):
+        with self._lock:
+            return {'queue_running': [[number, prompt_id] for prompt_id, number in self.running.items()],
+                    'queue_pending': [[number, prompt_id] for number, prompt_id in self.pending]}
+
+    def _worker(self):
+        while True:
+            number, prompt_id, client_id, prompt = self._jobs.get()
+            with self._lock:
+                if (number, prompt_id) not in self.pending:
+                    continue  # Deleted from the queue before it ran
+                self.pending.remove((number, prompt_id))
+                self.running[prompt_id] = number
+            try:
+                self._execute(prompt_id, client_id, prompt)
+            finally:
+                with self._lock:
+                    self.running.pop(prompt_id, None)
+                    self.interrupted.discard(prompt_id)
+                self.send(client_id, {'type': 'executing', 'data': {'node': None, 'prompt_id': prompt_id}})
+                self.broadcast_status()
+
+    def _model_signature(self, prompt):
+        return sorted((node['class_type'], json.dumps(node.get('inputs', {}), sort_keys=True))
+                      for node in prompt.values()
+                      if 'Load' in node['class_type'] and node['class_type'] not in ('LoadImage', 'LoadImageFromUrl'))
+
+    def _execute(self, prompt_id, client_id, prompt):
+        time.sleep(self.delay)
+        self.send(client_id, {'type': 'execution_start', 'data': {'prompt_id': prompt_id}})
+
+        signature = self._model_signature(prompt)
+        with self._lock:
+            switch = bool(signature) and signature != self.loaded_model
+            self.loaded_model = signature or self.loaded_model
+        if switch:
+            self.count('model_switches')
+            time.sleep(self.model_switch_time)
+
+        batch_size = max([node['inputs']['batch_size'] for node in prompt.values()
+                          if isinstance(node.get('inputs', {}).get('batch_size'), int)] or [1])
+        outputs = {}
+        sampled = False
+        for node_id, node in prompt.items():
+            self.send(client_id, {'type': 'executing', 'data': {'node': node_id, 'prompt_id': prompt_id}})
+            inputs = node.get('inputs', {})
+            if not sampled and any(name in inputs for name in SAMPLER_INPUTS):
+                sampled = True
+                for step in range(self.progress_steps):
+                    time.sleep(self.execution_time / self.progress_steps)
+                    if prompt_id in self.interrupted:
+                        self.send(client_id, {'type': 'execution_interrupted', 'data': {'prompt_id': prompt_id, 'node_id': node_id}})
+                        self.history[prompt_id] = {'outputs': {}, 'status': {'status_str': 'error', 'completed': False}}
+                        return
+                    self.send(client_id, {'type': 'progress', 'data': {'value': step + 1, 'max': self.progress_steps,
+                                                                       'prompt_id': prompt_id, 'node': node_id}})
+
+            if node['class_type'] == 'SaveImage':
+                outputs[node_id] = {'images': [{'filename': f'ComfyUI_{prompt_id}_{index}.png', 'subfolder': '', 'type': 'output'}
+                                               for index in range(batch_size)]}
+                self.send(client_id, {'type': 'executed', 'data': {'node': node_id, 'output': outputs[node_id], 'prompt_id': prompt_id}})
+            elif node['class_type'] == 'SaveImageWebsocket':
+                for _ in range(batch_size):
+                    self.send(client_id, struct.pack('>II', 1, 2) + self.image)
+            elif node['class_type'] == 'VHS_VideoCombine':
+                outputs[node_id] = {'gifs': [{'filename': f'ComfyUI_{prompt_id}.mp4', 'subfolder': '', 'type': 'output',
+                                              'format': 'video/h264-mp4'}]}
+                self.send(client_id, {'type': 'executed', 'data': {'node': node_id, 'output': outputs[node_id], 'prompt_id': prompt_id}})
+
+        self.history[prompt_id] = {'outputs': outputs, 'status': {'status_str': 'success', 'completed': True}}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, so connection counts reflect the app's pooling
+    stub = None
+
+    def setup(self):
+        super().setup()
+        self.stub.count('http_connections')
+        self.stub.count('http_connections_total')
+
+    def finish(self):
+        super().finish()
+        self.stub.count('http_connections', -1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, content_type='application/json', status=200, headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path == '/ws':
+            return self.serve_websocket(urllib.parse.parse_qs(url.query).get('clientId', [str(uuid.uuid4())])[0])
+        if url.path.startswith('/history/'):
+            prompt_id = url.path[len('/history/'):]
+            return self.send_body({prompt_id: self.stub.history[prompt_id]} if prompt_id in self.stub.history else {})
+        if url.path == '/view':
+            return self.serve_view(urllib.parse.parse_qs(url.query).get('filename', [''])[0])
+        if url.path == '/queue':
+            return self.send_body(self.stub.queue_state())
+        if url.path == '/system_stats':
+            return self.send_body({'system': {'comfyui_version': 'stub'}, 'devices': []})
+        if url.path == '/stub/stats':
+            return self.send_body(self.stub.stats)
+        self.send_body({'error': 'not found'}, status=404)
+
+    do_HEAD = do_GET
+
+    def do_POST(self):
+        path = urllib.parse.urlparse(self.path).path
+        body = self.read_body()
+        if path == '/prompt':
+            return self.send_body(self.stub.submit(json.loads(body)))
+        if path == '/upload/image':
+            self.stub.count('uploads')
+            message = email.parser.BytesParser().parsebytes(
+                b'Content-Type: ' + self.headers['Content-Type'].encode() + b'\r\n\r\n' + body)
+            filename = next((part.get_filename() for part in message.get_payload() if part.get_filename()), 'upload.png')
+            return self.send_body({'name': filename, 'subfolder': '', 'type': 'input'})
+        if path == '/queue':
+            self.stub.delete(json.loads(body or b'{}').get('delete', []))
+            return self.send_body({})
+        if path == '/interrupt':
+            self.stub.interrupt(json.loads(body or b'{}').get('prompt_id'))
+            return self.send_body({})
+        if path == '/stub/reset':
+            self.stub.reset()
+            return self.send_body({})
+        self.send_body({'error': 'not found'}, status=404)
+
+    def serve_view(self, filename):
+        self.stub.count('views')
+        data, content_type = (self.stub.video, 'video/mp4') if filename.endswith('.mp4') else (self.stub.image, 'image/png')
+        byte_range = self.headers.get('Range')
+        if byte_range and byte_range.startswith('bytes='):
+            start, _, end = byte_range[len('bytes='):].partition('-')
+            start, end = int(start or 0), min(int(end) if end else len(data) - 1, len(data) - 1)
+            return self.send_body(data[start:end + 1], content_type, 206,
+                                  {'Content-Range': f'bytes {start}-{end}/{len(data)}', 'Accept-Ranges': 'bytes'})
+        self.send_body(data, content_type, headers={'Accept-Ranges': 'bytes'})
+
+    def serve_websocket(self, client_id):
+        accept = base64.b64encode(hashlib.sha1((self.headers['Sec-WebSocket-Key'] + WS_GUID).encode()).digest()).decode()
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.wfile.flush()
+
+        client = WebSocketClient(self, client_id)
+        self.stub.clients[client_id] = client
+        self.stub.count('ws_connections')
+        try:
+            client.send_json({'type': 'status', 'data': {'status': {'exec_info': {'queue_remaining': len(self.stub.pending)}},
+                                                         'sid': client_id}})
+            while True:
+                opcode, payload = client.receive()
+                if opcode is None or opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    client.send(0xA, payload)
+        finally:
+            client.closed = True
+            if self.stub.clients.get(client_id) is client:
+                del self.stub.clients[client_id]
+            self.stub.count('ws_connections', -1)
+            self.close_connection = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8188)
+    parser.add_argument('--parallel', type=int, default=1, help='prompts executed at the same time')
+    parser.add_argument('--delay', type=float, default=0.05, help='seconds between dequeue and execution_start')
+    parser.add_argument('--execution-time', type=float, default=1.0, help='seconds spent in the sampler node')
+    parser.add_argument('--progress-steps', type=int, default=10, help='progress messages per prompt')
+    parser.add_argument('--image-size', type=int, default=512, help='edge length of output PNGs in pixels')
+    parser.add_argument('--video-bytes', type=int, default=2 * 1024 * 1024, help='size of output videos')
+    parser.add_argument('--model-switch-time', type=float, default=0.0, help='seconds added when the loaded model changes')
+    parser.add_argument('--ignore-prompt-id', action='store_true',
+                        help='assign new prompt ids like ComfyUI builds without client-chosen ids')
+    args = parser.parse_args()
+
+    StubHandler.stub = ComfyStub(args.parallel, args.delay, args.execution_time, max(1, args.progress_steps),
+                                 args.image_size, args.video_bytes, args.model_switch_time, args.ignore_prompt_id)
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    server.daemon_threads = True
+    print(f"ComfyUI stub listening on http://{args.host}:{args.port}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+"""
+Load-test the API route by route and compare how many concurrent requests one worker can hold.
+
+Run everything offline against the bundled ComfyUI stub, one single-worker gunicorn per
+worker class:
+
+    python benchmarks/loadtest.py --stub --compare sync,gevent --route all --concurrency 20 --requests 100
+
+Or drive a running instance (point --stub-url at a running comfyui_stub.py to get its
+upstream connection counts):
+
+    python benchmarks/loadtest.py --url http://127.0.0.1:7860 --route generate_image --concurrency 50
+
+Each route is timed end to end: asynchronous ones are polled until their result is
+served. "Held" estimates the concurrent requests one worker actually serves:
+throughput x the fastest observed latency (the upstream service time). Requests
+waiting in the listen backlog of a busy sync worker are not counted. "RSS MB" is the
+peak resident memory of the gunicorn workers started by --compare, and "upstream" the
+peak HTTP connections / WebSocket connections the stub saw during the run.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INPUT_IMAGE = os.path.join(ROOT, 'images', 'Webimage-1-720x480.jpg')
+POLL_INTERVAL = 0.2
+
+
+def poll(session, url, headers):
+    """Wait for an async task URL to stop answering 202; return whether it succeeded."""
+    while True:
+        response = session.get(url, headers=headers, timeout=600)
+        if response.status_code != 202:
+            return response.status_code < 400
+        time.sleep(POLL_INTERVAL)
+
+
+def generate_image(session, url, headers):
+    return session.post(url + '/generate_image', json={'text_prompt': 'load test'}, headers=headers, timeout=600).ok
+
+
+def generate_image_websocket(session, url, headers):
+    response = session.post(url + '/generate_image', json={'text_prompt': 'load test', 'delivery': 'websocket'},
+                            headers=headers, timeout=600)
+    return response.ok
+
+
+def generate_image_async(session, url, headers):
+    response = session.post(url + '/generate_image?async=1', json={'text_prompt': 'load test'}, headers=headers, timeout=600)
+    return response.status_code == 202 and poll(session, url + f"/v1/image_tasks/{response.json()['prompt_id']}", headers)
+
+
+def batch_generate_image(session, url, headers):
+    response = session.post(url + '/v1/batch/generate_image', json={'prompts': ['load test'] * 4},
+                            headers=headers, timeout=600, stream=True)
+    if not response.ok:
+        return False
+    lines = [line for line in response.iter_lines() if line]
+    return len(lines) == 5 and all(b'"completed"' in line for line in lines[1:])
+
+
+def omnigen_image_to_image(session, url, headers):
+    with open(INPUT_IMAGE, 'rb') as f:
+        response = session.post(url + '/omnigen/image_to_image', files={'image': ('input.jpg', f, 'image/jpeg')},
+                                data={'text_prompt': 'load test', 'image_url': 'http://unused'}, headers=headers, timeout=600)
+    return response.ok
+
+
+def image_to_video(session, url, headers):
+    with open(INPUT_IMAGE, 'rb') as f:
+        response = session.post(url + '/image_to_video', files={'image': ('input.jpg', f, 'image/jpeg')},
+                                data={'text_prompt': 'load test'}, headers=headers, timeout=600)
+    return response.ok
+
+
+def v1_image_to_video(session, url, headers):
+    with open(INPUT_IMAGE, 'rb') as f:
+        response = session.post(url + '/v1/image_to_video', files={'image': ('input.jpg', f, 'image/jpeg')},
+                                data={'text_prompt': 'load test'}, headers=headers, timeout=600)
+    return response.status_code == 202 and poll(session, url + f"/v1/video_tasks/{response.json()['prompt_id']}", headers)
+
+
+def text_to_video(session, url, headers):
+    response = session.post(url + '/v1/text_to_video', json={'text_prompt': 'load test'}, headers=headers, timeout=600)
+    return response.status_code == 202 and poll(session, url + f"/v1/video_tasks/{response.json()['prompt_id']}", headers)
+
+
+ROUTES = {
+    'generate_image': generate_image,
+    'generate_image_websocket': generate_image_websocket,
+    'generate_image_async': generate_image_async,
+    'batch_generate_image': batch_generate_image,
+    'omnigen_image_to_image': omnigen_image_to_image,
+    'image_to_video': image_to_video,
+    'v1_image_to_video': v1_image_to_video,
+    'text_to_video': text_to_video,
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def worker_rss(master_pid):
+    """Summed RSS in bytes of a gunicorn master's worker processes (Linux only)."""
+    try:
+        with open(f'/proc/{master_pid}/task/{master_pid}/children') as f:
+            children = f.read().split()
+    except OSError:
+        return 0
+    total = 0
+    for pid in children:
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                total += next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+        except (OSError, StopIteration):
+            pass
+    return total
+
+
+class RssSampler:
+    """Track the peak worker RSS of a gunicorn master while a load runs."""
+
+    def __init__(self, master_pid, interval=0.2):
+        self.master_pid = master_pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, worker_rss(self.master_pid))
+            self._stop.wait(self.interval)
+
+
+def run_load(url, route, concurrency, total, token):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def one_request(_):
+        start = time.perf_counter()
+        try:
+            ok = ROUTES[route](session, url, headers)
+        except requests.RequestException:
+            ok = False
+        return ok, time.perf_counter() - start
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one_request, range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for ok, latency in results if ok]
+    throughput = len(latencies) / elapsed if elapsed else 0.0
+    service_time = min(latencies) if latencies else 0.0
+    return {
+        'ok': len(latencies),
+        'errors': total - len(latencies),
+        'elapsed_s': elapsed,
+        'throughput_rps': throughput,
+        'p50_s': percentile(latencies, 0.50),
+        'p95_s': percentile(latencies, 0.95),
+        'p99_s': percentile(latencies, 0.99),
+        'held': throughput * service_time,
+    }
+
+
+def measure(url, route, args, stub_url=None, master_pid=None):
+    """Run one load and add worker RSS and upstream connection counts where they can be observed."""
+    if stub_url:
+        requests.post(stub_url + '/stub/reset', timeout=5)
+    if master_pid:
+        with RssSampler(master_pid) as sampler:
+            row = run_load(url, route, args.concurrency, args.requests, args.token)
+        row['rss_mb'] = sampler.peak / 1024 ** 2
+    else:
+        row = run_load(url, route, args.concurrency, args.requests, args.token)
+        row['rss_mb'] = None
+    if stub_url:
+        stats = requests.get(stub_url + '/stub/stats', timeout=5).json()
+        row['upstream'] = f"{stats['http_connections_peak']}/{stats['ws_connections_peak']}"
+    else:
+        row['upstream'] = None
+    return row
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url + '/', timeout=1).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def start_stub(port, args):
+    return subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'benchmarks', 'comfyui_stub.py'), '--port', str(port),
+         '--parallel', str(args.stub_parallel), '--execution-time', str(args.stub_execution_time),
+         '--image-size', str(args.stub_image_size)],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def start_gunicorn(worker_class, port, connections, stub_url=None):
+    env = dict(os.environ, GUNICORN_WORKER_CLASS=worker_class, GUNICORN_WORKERS='1',
+               GUNICORN_WORKER_CONNECTIONS=str(connections))
+    if stub_url:
+        # A private cache, static folder, job queue and task store per server, and no per-token limits on the
+        # single load-test token
+        state_dir = tempfile.mkdtemp(prefix='loadtest-')
+        env.update(SERVER_ADDRESS=stub_url, WS_ADDRESS=stub_url.replace('http://', 'ws://') + '/ws',
+                   RESULT_CACHE_DIR=os.path.join(state_dir, 'results'), SCHEDULER_DB=os.path.join(state_dir, 'jobs.db'),
+                   JOB_STORE_DB=os.path.join(state_dir, 'tasks.db'), STATIC_DIR=os.path.join(state_dir, 'static'))
+        for name in ('ADMISSION_RATE', 'ADMISSION_MAX_INFLIGHT', 'ADMISSION_MAX_QUEUE'):
+            env.setdefault(name, '0')
+    return subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}', 'app:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def print_row(label, row):
+    rss = f"{row['rss_mb']:.0f}" if row['rss_mb'] is not None else '-'
+    print(f"{label:<36}{row['ok']:>6}{row['errors']:>8}{row['throughput_rps']:>10.2f}"
+          f"{row['p50_s']:>9.2f}{row['p95_s']:>9.2f}{row['p99_s']:>9.2f}{row['held']:>8.1f}"
+          f"{rss:>8}{row['upstream'] or '-':>10}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:7860', help='base URL of a running instance')
+    parser.add_argument('--compare', help='comma-separated gunicorn worker classes to start and compare, e.g. sync,gevent')
+    parser.add_argument('--port', type=int, default=7861, help='port for --compare servers')
+    parser.add_argument('--route', choices=sorted(ROUTES) + ['all'], default='generate_image')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--token', default=os.getenv('LOADTEST_TOKEN', 'loadtest'))
+    parser.add_argument('--stub', action='store_true', help='start benchmarks/comfyui_stub.py and point started servers at it')
+    parser.add_argument('--stub-port', type=int, default=8288)
+    parser.add_argument('--stub-url', help='a running comfyui_stub.py to read upstream connection counts from')
+    parser.add_argument('--stub-parallel', type=int, default=8, help='prompts the stub runs at once')
+    parser.add_argument('--stub-execution-time', type=float, default=1.0, help='seconds each stub prompt takes')
+    parser.add_argument('--stub-image-size', type=int, default=512, help='edge length of the stub output images')
+    args = parser.parse_args()
+
+    routes = sorted(ROUTES) if args.route == 'all' else [args.route]
+    stub = None
+    stub_url = args.stub_url
+    if args.stub:
+        stub_url = f'http://127.0.0.1:{args.stub_port}'
+        stub = start_stub(args.stub_port, args)
+        args.compare = args.compare or os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+
+    print(f"{'server / route':<36}{'ok':>6}{'errors':>8}{'req/s':>10}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}{'held':>8}"
+          f"{'RSS MB':>8}{'upstream':>10}")
+    try:
+        if stub:
+            wait_until_up(stub_url)
+        if not args.compare:
+            for route in routes:
+                print_row(f'target {route}', measure(args.url, route, args, stub_url))
+            return
+
+        for worker_class in args.compare.split(','):
+            url = f'http://127.0.0.1:{args.port}'
+            server = start_gunicorn(worker_class, args.port, args.concurrency * 2, stub_url if stub else None)
+            try:
+                wait_until_up(url)
+                for route in routes:
+                    print_row(f'{worker_class} {route}', measure(url, route, args, stub_url, server.pid))
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        if stub:
+            stub.terminate()
+            stub.wait()
+
+
+if __name__ == '__main__':
+    main()
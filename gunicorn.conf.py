@@ -0,0 +1,30 @@
+# Gunicorn settings, overridable through environment variables.
+#
+# The default "sync" worker pins one worker process to each in-flight request for
+# the whole time it waits on ComfyUI. Setting GUNICORN_WORKER_CLASS=gevent runs
+# every request as a greenlet instead: the shared WebSocket listener, queue waits,
+# history fetches and /view downloads all yield while waiting on the network, so
+# one process can hold GUNICORN_WORKER_CONNECTIONS pending generations.
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '7860')}"
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync")
+workers = int(os.getenv("GUNICORN_WORKERS", "1"))
+threads = int(os.getenv("GUNICORN_THREADS", "1"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+
+# Generations can take minutes, so no worker timeout by default; waits on ComfyUI
+# are bounded by IMAGE_PROMPT_TIMEOUT/VIDEO_PROMPT_TIMEOUT instead
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "0"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+
+accesslog = "-"
+errorlog = "-"
+
+
+def child_exit(server, worker):
+    # With several workers, /metrics merges per-process files kept in
+    # PROMETHEUS_MULTIPROC_DIR; drop the live gauges of workers that exit.
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
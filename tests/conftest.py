@@ -0,0 +1,86 @@
+"""Shared fixtures: the app is imported once against an in-process ComfyUI stub.
+
+Every directory and database the app writes to is pointed at a temporary
+folder before the import, so test runs never touch the checkout.
+"""
+import os
+import sys
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from comfyui_stub import ComfyStub, StubHandler  # noqa: E402
+
+
+def start_stub(**options):
+    """Serve a ComfyStub on a free local port and return its base URL."""
+    settings = dict(parallel=1, delay=0.01, execution_time=0.2, progress_steps=2, image_size=64,
+                    video_bytes=4096, model_switch_time=0.0)
+    settings.update(options)
+    handler = type('TestStubHandler', (StubHandler,), {'stub': ComfyStub(**settings)})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='comfyui-stub', daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}", handler.stub
+
+
+STATE_DIR = tempfile.mkdtemp(prefix='comfyui-app-tests-')
+STUB_URL, STUB = start_stub()
+
+os.environ.update(
+    SERVER_ADDRESS=STUB_URL,
+    WS_ADDRESS=STUB_URL.replace('http://', 'ws://') + '/ws',
+    RESULT_CACHE_DIR=os.path.join(STATE_DIR, 'results'),
+    RESULT_CACHE_SWEEP_INTERVAL='0',
+    SCHEDULER_DB=os.path.join(STATE_DIR, 'jobs.db'),
+    JOB_STORE_DB=os.path.join(STATE_DIR, 'tasks.db'),
+    STATIC_DIR=os.path.join(STATE_DIR, 'static'),
+    ADMISSION_RATE='0',
+)
+
+import app as comfy_app  # noqa: E402
+
+
+@pytest.fixture
+def app_module():
+    return comfy_app
+
+
+@pytest.fixture
+def stub():
+    return STUB
+
+
+@pytest.fixture
+def extra_stub():
+    """Start another stub with the given ComfyStub options; returns (backend, stub)."""
+    def start(**options):
+        url, extra = start_stub(**options)
+        return comfy_app.ComfyBackend(url), extra
+    return start
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    """The stub's backend with its load counters and loaded model reset for the test."""
+    backend = comfy_app.backend_pool.backends[0]
+    monkeypatch.setattr(backend, 'queue_remaining', 0)
+    monkeypatch.setattr(backend, 'held', 0)
+    monkeypatch.setattr(backend, 'loaded_model', '')
+    return backend
+
+
+@pytest.fixture
+def client():
+    return comfy_app.app.test_client()
+
+
+@pytest.fixture
+def auth():
+    return {'Authorization': 'Bearer test-token'}
@@ -0,0 +1,62 @@
+import pytest
+
+
+def make_controller(app_module, rate=0, burst=0, max_inflight=0, max_queue=0, fair_share_at=0.5):
+    return app_module.AdmissionController(rate, burst, max_inflight, max_queue, fair_share_at,
+                                          retry_after=5, inflight_ttl=3600)
+
+
+def test_token_bucket_allows_a_burst_then_rate_limits(app_module, backend):
+    controller = make_controller(app_module, rate=1, burst=3)
+    controller.admit('a', 3)
+    with pytest.raises(app_module.AdmissionRejected) as rejected:
+        controller.admit('a')
+    assert rejected.value.reason == 'rate_limited'
+    assert rejected.value.retry_after >= 1
+
+    # Buckets are per token
+    controller.admit('b')
+
+
+def test_batches_are_admitted_as_a_whole(app_module, backend):
+    controller = make_controller(app_module, rate=1, burst=3)
+    with pytest.raises(app_module.AdmissionRejected):
+        controller.admit('a', 4)
+    controller.admit('a', 3)
+
+
+def test_queue_full_rejects_everyone(app_module, backend):
+    controller = make_controller(app_module, max_queue=10)
+    backend.queue_remaining = 10
+    with pytest.raises(app_module.AdmissionRejected) as rejected:
+        controller.admit('a')
+    assert rejected.value.reason == 'queue_full'
+
+
+def test_in_flight_limit_counts_bound_and_reserved_prompts(app_module, backend):
+    controller = make_controller(app_module, max_inflight=2)
+    controller.admit('a', 2)
+    controller.bind('a', 'prompt-1')
+    with pytest.raises(app_module.AdmissionRejected) as rejected:
+        controller.admit('a')
+    assert rejected.value.reason == 'too_many_in_flight'
+
+    controller.release('prompt-1')
+    controller.admit('a')
+
+
+def test_fair_share_applies_once_the_queue_is_busy(app_module, backend):
+    controller = make_controller(app_module, max_queue=8, fair_share_at=0.5)
+    controller.admit('heavy', 6)
+    controller.admit('light', 1)
+
+    # Below half full anyone may take more than an even split
+    backend.queue_remaining = 3
+    controller.admit('heavy', 1)
+
+    # Past half full each of the two active tokens gets 8 // 2 = 4
+    backend.queue_remaining = 4
+    with pytest.raises(app_module.AdmissionRejected) as rejected:
+        controller.admit('heavy')
+    assert rejected.value.reason == 'too_many_in_flight'
+    controller.admit('light', 2)
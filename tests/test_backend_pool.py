@@ -0,0 +1,58 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+@pytest.fixture
+def locked_backend(app_module):
+    """A backend whose /queue demands credentials; returns (backend, seen request headers)."""
+    seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            seen.append(dict(self.headers))
+            self.send_response(401)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield app_module.ComfyBackend(f"http://127.0.0.1:{server.server_address[1]}"), seen
+    server.shutdown()
+
+
+def test_health_check_never_sends_a_client_token(app_module, locked_backend, monkeypatch):
+    backend, seen = locked_backend
+    monkeypatch.setattr(app_module, 'COMFYUI_HEALTH_TOKEN', None)
+    pool = app_module.BackendPool([backend], 0, 100)
+    pool.mark_queued(backend, 'prompt-1')
+    backend.healthy = False
+
+    pool.check_health()
+
+    assert 'Authorization' not in seen[0]
+    # Refusing the probe's credentials still shows the server is up
+    assert backend.healthy
+
+
+def test_health_check_uses_the_service_token(app_module, locked_backend, monkeypatch):
+    backend, seen = locked_backend
+    monkeypatch.setattr(app_module, 'COMFYUI_HEALTH_TOKEN', 'service-token')
+
+    app_module.BackendPool([backend], 0, 100).check_health()
+
+    assert seen[0]['Authorization'] == 'Bearer service-token'
+
+
+@pytest.mark.parametrize('path', ['/v1/backends', '/v1/storage_stats'])
+def test_operator_routes_need_the_admin_token(app_module, client, auth, monkeypatch, path):
+    monkeypatch.setattr(app_module, 'ADMIN_TOKEN', None)
+    assert client.get(path, headers=auth).status_code == 403
+
+    monkeypatch.setattr(app_module, 'ADMIN_TOKEN', 'admin-token')
+    assert client.get(path, headers=auth).status_code == 403
+    assert client.get(path, headers={'Authorization': 'Bearer admin-token'}).status_code == 200
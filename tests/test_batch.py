@@ -0,0 +1,23 @@
+import json
+
+
+def test_batch_streams_one_result_per_prompt(client, auth):
+    response = client.post('/v1/batch/generate_image', headers=auth,
+                           json={'prompts': ['a red chair', {'text_prompt': 'a blue chair', 'seed': 42}, 'a green chair']})
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.data.splitlines()]
+
+    assert lines[0]['type'] == 'queued'
+    assert len(lines[0]['prompt_ids']) == 3
+    results = lines[1:]
+    assert sorted(result['index'] for result in results) == [0, 1, 2]
+    for result in results:
+        assert result['prompt_id'] == lines[0]['prompt_ids'][result['index']]
+        assert result['status'] == 'completed'
+        assert len(result['images']) == 1
+
+
+def test_batch_size_limits_are_enforced(app_module, client, auth, monkeypatch):
+    monkeypatch.setattr(app_module, 'MAX_BATCH_PROMPTS', 2)
+    response = client.post('/v1/batch/generate_image', headers=auth, json={'prompts': ['a', 'b', 'c']})
+    assert response.status_code == 400
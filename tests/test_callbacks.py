@@ -0,0 +1,44 @@
+import pytest
+
+
+@pytest.mark.parametrize('url', [
+    'http://127.0.0.1:8080/hook',
+    'http://localhost/hook',
+    'http://169.254.169.254/latest/meta-data',
+    'http://10.1.2.3/hook',
+    'http://192.168.0.10/hook',
+    'http://[::1]/hook',
+    'http://[::ffff:127.0.0.1]/hook',
+    'http://0.0.0.0/hook',
+    'ftp://example.com/hook',
+    'http:///hook',
+])
+def test_internal_and_malformed_callbacks_are_rejected(app_module, url):
+    with pytest.raises(ValueError):
+        app_module.check_callback_url(url)
+
+
+def test_public_addresses_are_accepted(app_module):
+    app_module.check_callback_url('https://93.184.215.14/hook')
+
+
+def test_allowlisted_hosts_skip_the_address_check(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'CALLBACK_ALLOWED_HOSTS', {'localhost'})
+    app_module.check_callback_url('http://localhost:9000/hook')
+
+
+def test_requests_with_internal_callbacks_get_400(client, auth, stub):
+    before = stub.stats['prompts']
+    response = client.post('/v1/workflows/deliberate_v6/run',
+                           json={'text_prompt': 'x', 'async': True, 'callback_url': 'http://127.0.0.1:9/hook'},
+                           headers=auth)
+    assert response.status_code == 400
+    assert 'callback_url' in response.get_json()['error']
+    assert stub.stats['prompts'] == before
+
+
+def test_webhook_is_not_sent_to_internal_addresses(app_module, monkeypatch):
+    posted = []
+    monkeypatch.setattr(app_module.http_session, 'post', lambda url, **kwargs: posted.append((url, kwargs)))
+    app_module.send_webhook('http://127.0.0.1:9/hook', {'prompt_id': 'p'})
+    assert posted == []
@@ -0,0 +1,19 @@
+import time
+
+
+def test_prompt_past_its_deadline_is_cancelled(app_module, client, auth, stub, monkeypatch):
+    monkeypatch.setattr(app_module, 'IMAGE_PROMPT_TIMEOUT', 0.3)
+    monkeypatch.setattr(stub, 'execution_time', 3)
+    monkeypatch.setattr(stub, 'progress_steps', 30)
+
+    started = time.time()
+    response = client.post('/generate_image', headers=auth, json={'text_prompt': 'a slow lighthouse'})
+    assert response.status_code == 504
+    assert time.time() - started < 2
+    prompt_id = response.get_json()['prompt_id']
+
+    # The prompt is interrupted on ComfyUI rather than left to run for nobody
+    deadline = time.time() + 2
+    while prompt_id not in stub.history and time.time() < deadline:
+        time.sleep(0.05)
+    assert stub.history[prompt_id]['status']['status_str'] == 'error'
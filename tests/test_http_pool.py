@@ -0,0 +1,10 @@
+def test_rest_calls_reuse_pooled_connections(client, auth, stub):
+    opened = stub.stats['http_connections_total']
+    views = stub.stats['views']
+    for index in range(5):
+        response = client.post('/generate_image', headers=auth, json={'text_prompt': f'pooled {index}'})
+        assert response.status_code == 200
+
+    # Each generation makes a /prompt, /history and /view call
+    assert stub.stats['views'] == views + 5
+    assert stub.stats['http_connections_total'] - opened < 5
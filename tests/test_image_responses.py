@@ -0,0 +1,47 @@
+import base64
+import json
+
+
+def generate(client, auth, query='', **body):
+    return client.post(f'/generate_image{query}', headers=auth, json=dict({'text_prompt': 'a lighthouse'}, **body))
+
+
+def test_websocket_delivery_skips_history_and_view(client, auth, stub):
+    views = stub.stats['views']
+    response = generate(client, auth, delivery='websocket')
+    assert response.status_code == 200, response.get_json()
+    images = response.get_json()['images']
+    assert [base64.b64decode(image) for image in images] == [stub.image]
+    assert stub.stats['views'] == views
+
+
+def test_websocket_delivery_swaps_the_save_node(app_module):
+    workflow = app_module.prepare_workflow('flux1_dev', text_prompt='a lighthouse', seed=1, websocket_output=True)
+    classes = {node['class_type'] for node in workflow.values()}
+    assert 'SaveImageWebsocket' in classes
+    assert 'SaveImage' not in classes
+
+
+def test_images_pass_through_unless_a_format_is_asked_for(client, auth, stub):
+    images = generate(client, auth).get_json()['images']
+    assert [base64.b64decode(image) for image in images] == [stub.image]
+
+    webp = base64.b64decode(generate(client, auth, format='webp', quality=80).get_json()['images'][0])
+    assert webp[:4] == b'RIFF' and webp[8:12] == b'WEBP'
+
+
+def test_response_modes(client, auth, stub):
+    raw = generate(client, auth, query='?response=binary')
+    assert raw.mimetype == 'image/png'
+    assert raw.data == stub.image
+
+    streamed = generate(client, auth, query='?response=stream')
+    assert [base64.b64decode(image) for image in json.loads(streamed.data)['images']] == [stub.image]
+
+    multipart = client.post('/generate_image', json={'text_prompt': 'a lighthouse'},
+                            headers=dict(auth, Accept='multipart/mixed'))
+    assert multipart.mimetype == 'multipart/mixed'
+    boundary = multipart.mimetype_params['boundary'].encode()
+    parts = [part for part in multipart.data.split(b'--' + boundary) if part.strip(b'\r\n-')]
+    assert len(parts) == 1
+    assert parts[0].rstrip(b'\r\n').endswith(stub.image)
@@ -0,0 +1,71 @@
+import base64
+import io
+import os
+
+from PIL import Image
+
+
+def png_bytes(size=(32, 32)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'red').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def static_files(app_module):
+    return set(os.listdir(app_module.STATIC_DIR)) if os.path.isdir(app_module.STATIC_DIR) else set()
+
+
+def test_base64_image_reaches_omnigen(client, auth, stub):
+    uploads = stub.stats['uploads']
+    response = client.post('/omnigen/image_to_image', headers=auth, json={
+        'text_prompt': 'make it blue',
+        'base64_image': base64.b64encode(png_bytes()).decode(),
+    })
+    assert response.status_code == 200, response.get_json()
+    assert stub.stats['uploads'] == uploads + 1
+
+
+def test_omnigen_requires_some_image(client, auth):
+    response = client.post('/omnigen/image_to_image', headers=auth, json={'text_prompt': 'make it blue'})
+    assert response.status_code == 400
+    assert 'image_url' in response.get_json()['error']
+
+
+def test_oversized_upload_is_rejected(app_module, client, auth, monkeypatch):
+    monkeypatch.setattr(app_module, 'MAX_IMAGE_BYTES', 1000)
+    before = static_files(app_module)
+    response = client.post('/v1/image_to_video', headers=auth, content_type='multipart/form-data', data={
+        'text_prompt': 'waves',
+        'image': (io.BytesIO(png_bytes((256, 256)) + os.urandom(2000)), 'big.png'),
+    })
+    assert response.status_code == 400
+    assert 'byte limit' in response.get_json()['error']
+    assert static_files(app_module) == before
+
+
+def test_upload_must_be_an_image(app_module, client, auth):
+    before = static_files(app_module)
+    response = client.post('/omnigen/image_to_image', headers=auth, content_type='multipart/form-data', data={
+        'text_prompt': 'make it blue',
+        'image': (io.BytesIO(b'<html>not an image</html>'), 'page.png'),
+    })
+    assert response.status_code == 400
+    assert 'not a PNG, JPEG or WebP' in response.get_json()['error']
+    assert static_files(app_module) == before
+
+
+def test_inputs_are_uploaded_to_the_backend_that_runs_them(app_module, tmp_path, stub, monkeypatch):
+    image_path = tmp_path / 'input.png'
+    image_path.write_bytes(png_bytes())
+    backend = app_module.backend_pool.backends[0]
+    uploads = stub.stats['uploads']
+
+    resolved = app_module.resolve_input_image(str(image_path), 'https://api.example.com/static/input.png', 'tok', backend)
+    assert stub.stats['uploads'] == uploads + 1
+    workflow = app_module.prepare_workflow('omnigen_image_to_image', text_prompt='make it blue', **resolved)
+    assert workflow[app_module.workflow_registry['omnigen_image_to_image'].image_node]['class_type'] == 'LoadImage'
+
+    monkeypatch.setattr(app_module, 'IMAGE_INPUT_MODE', 'url')
+    resolved = app_module.resolve_input_image(str(image_path), 'https://api.example.com/static/input.png', 'tok', backend)
+    assert resolved == {'image_url': 'https://api.example.com/static/input.png'}
+    assert stub.stats['uploads'] == uploads + 1
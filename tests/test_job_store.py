@@ -0,0 +1,44 @@
+import time
+
+import pytest
+
+OTHER = {'Authorization': 'Bearer someone-else'}
+
+
+@pytest.fixture
+def finished_prompt(client, auth):
+    """An async image job that has finished and been pulled into the result cache."""
+    response = client.post('/v1/workflows/deliberate_v6/run', json={'text_prompt': 'a fox', 'async': True}, headers=auth)
+    assert response.status_code == 202
+    prompt_id = response.get_json()['prompt_id']
+    deadline = time.time() + 30
+    while client.get(f'/v1/image_tasks/{prompt_id}', headers=auth).status_code == 202:
+        assert time.time() < deadline
+        time.sleep(0.05)
+    return prompt_id
+
+
+def test_owner_sees_the_stored_task(client, auth, finished_prompt):
+    response = client.get(f'/v1/tasks/{finished_prompt}', headers=auth)
+    assert response.status_code == 200
+    task = response.get_json()
+    assert task['status'] == 'completed'
+    assert task['workflow'] == 'deliberate_v6'
+    assert 'token_hash' not in task
+
+
+@pytest.mark.parametrize('route', ['/v1/tasks/{}', '/v1/image_tasks/{}', '/v1/video_tasks/{}', '/v1/tasks/{}/events'])
+def test_other_tokens_get_404(client, finished_prompt, route):
+    response = client.get(route.format(finished_prompt), headers=OTHER)
+    assert response.status_code == 404
+
+
+def test_cached_outputs_are_not_served_to_other_tokens(app_module, client, auth, finished_prompt):
+    assert app_module.result_cache.list(finished_prompt)
+    assert client.get(f'/v1/image_tasks/{finished_prompt}', headers=auth).status_code == 200
+    assert client.get(f'/v1/image_tasks/{finished_prompt}', headers=OTHER).status_code == 404
+
+
+def test_settle_does_not_create_ownerless_tasks(app_module):
+    app_module.job_store.settle('never-recorded', {'outputs': {}, 'status': {'status_str': 'success'}})
+    assert app_module.job_store.get('never-recorded') is None
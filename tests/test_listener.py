@@ -0,0 +1,22 @@
+import threading
+
+
+def test_concurrent_prompts_share_one_websocket(app_module, stub):
+    headers = {'Authorization': 'Bearer shared-listener'}
+    connections = stub.stats['ws_connections']
+    statuses = []
+
+    def request():
+        client = app_module.app.test_client()
+        statuses.append(client.post('/generate_image', headers=headers, json={'text_prompt': 'a lighthouse'}).status_code)
+
+    threads = [threading.Thread(target=request) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert statuses == [200] * 5
+    listeners = [key for key in app_module._listeners if key[1] == 'shared-listener']
+    assert len(listeners) == 1
+    assert stub.stats['ws_connections'] <= connections + 1
@@ -0,0 +1,12 @@
+def test_requests_and_stages_are_measured(client, auth):
+    assert client.post('/generate_image', headers=auth, json={'text_prompt': 'a lighthouse'}).status_code == 200
+    text = client.get('/metrics').data.decode()
+    assert 'comfyui_api_request_seconds_count{' in text
+    assert 'route="generate_image",status="200",workflow="flux1_dev"' in text
+    assert 'comfyui_api_stage_seconds_count{' in text
+
+
+def test_metrics_token(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, 'METRICS_TOKEN', 'scrape')
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer scrape'}).status_code == 200
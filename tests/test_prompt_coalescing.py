@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def workflow(app_module):
+    return app_module.prepare_workflow('flux1_dev', text_prompt='a coalesced fox', seed=7)
+
+
+def test_async_leader_survives_a_prompt_that_finishes_before_it_is_marked_queued(app_module, workflow, monkeypatch):
+    def finishes_at_once(workflow, token, callback_url=None, on_done=None):
+        on_done({'prompt_id': 'fast-prompt', 'status': 'failed', 'error': 'no images'})
+        return 'fast-prompt'
+    monkeypatch.setattr(app_module, 'submit_image_job', finishes_at_once)
+
+    result = []
+    leader = threading.Thread(target=lambda: result.append(app_module.run_deterministic(workflow, 'tok', wait=False)))
+    leader.start()
+    leader.join(5)
+
+    assert not leader.is_alive()
+    assert result == ['fast-prompt']
+    assert app_module.workflow_fingerprint(workflow) not in app_module.prompt_coalescer._inflight
+
+
+def test_followers_stop_waiting_after_the_prompt_timeout(app_module, workflow, monkeypatch):
+    monkeypatch.setattr(app_module, 'IMAGE_PROMPT_TIMEOUT', 0.2)
+    fingerprint = app_module.workflow_fingerprint(workflow)
+    _, leader = app_module.prompt_coalescer.join(fingerprint)
+    assert leader
+    try:
+        with pytest.raises(app_module.PromptTimeout):
+            app_module.run_deterministic(workflow, 'tok', wait=True)
+        with pytest.raises(app_module.PromptTimeout):
+            app_module.run_deterministic(workflow, 'tok', wait=False)
+    finally:
+        app_module.prompt_coalescer.finish(fingerprint, error=RuntimeError('test over'))
+
+
+def test_identical_requests_share_one_prompt(app_module, workflow, stub):
+    before = stub.stats['prompts']
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(app_module.run_deterministic(workflow, 'tok')))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert len(set(results)) == 1 and len(results) == 3
+    assert stub.stats['prompts'] - before == 1
+    # Later requests are answered from the result cache
+    assert app_module.run_deterministic(workflow, 'tok') == results[0]
+    assert stub.stats['prompts'] - before == 1
+
+
+def poll_image(client, prompt_id, headers):
+    deadline = time.time() + 30
+    while True:
+        response = client.get(f'/v1/image_tasks/{prompt_id}', headers=headers)
+        if response.status_code != 202 or time.time() > deadline:
+            return response
+        time.sleep(0.05)
+
+
+def test_shared_prompts_are_readable_by_every_token_that_asked(client):
+    body = {'text_prompt': 'a fox shared by two tokens', 'seed': 11, 'async': True}
+    alice, bob, carol = ({'Authorization': f'Bearer {name}'} for name in ('alice', 'bob', 'carol'))
+
+    prompt_id = client.post('/generate_image', json=body, headers=alice).get_json()['prompt_id']
+    joined = client.post('/generate_image', json=body, headers=bob).get_json()['prompt_id']
+    assert joined == prompt_id
+
+    assert poll_image(client, prompt_id, alice).status_code == 200
+    assert poll_image(client, prompt_id, bob).status_code == 200
+    assert client.get(f'/v1/tasks/{prompt_id}', headers=bob).status_code == 200
+    assert client.get(f'/v1/image_tasks/{prompt_id}', headers=carol).status_code == 404
+
+    # Answered from the result cache, the same prompt becomes readable by the new caller too
+    assert client.post('/generate_image', json=body, headers=carol).get_json()['prompt_id'] == prompt_id
+    assert client.get(f'/v1/image_tasks/{prompt_id}', headers=carol).status_code == 200
+
+
+def test_followers_of_a_failed_prompt_get_the_leaders_error(app_module, client, monkeypatch):
+    def no_images(prompt_id, token):
+        time.sleep(0.5)  # Long enough for the follower to join
+        return 0
+    monkeypatch.setattr(app_module, 'cache_prompt_outputs', no_images)
+    workflow = app_module.prepare_workflow('flux1_dev', text_prompt='a fox that fails', seed=13)
+
+    leader = threading.Thread(target=app_module.run_deterministic, args=(workflow, 'alice'))
+    leader.start()
+    time.sleep(0.1)
+    response = client.post('/generate_image', json={'text_prompt': 'a fox that fails', 'seed': 13},
+                           headers={'Authorization': 'Bearer bob'})
+    leader.join(30)
+
+    assert response.status_code == 502
+    assert response.get_json()['error'] == 'Prompt produced no images'
+    assert response.get_json()['prompt_id']
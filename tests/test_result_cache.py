@@ -0,0 +1,89 @@
+import os
+import time
+
+import pytest
+
+
+@pytest.fixture
+def make_cache(app_module, tmp_path):
+    def make(max_bytes=10_000, ttl=3600):
+        return app_module.ResultCache(str(tmp_path / 'results'), max_bytes, ttl)
+    return make
+
+
+def test_put_and_list_roundtrip(make_cache):
+    cache = make_cache()
+    cache.put('p1', 'a.png', b'first', 'image/png', index=1)
+    cache.put('p1', 'b.png', b'second', 'image/png', index=0)
+    assert cache.list('p1') is None  # Not complete yet
+
+    cache.mark_complete('p1')
+    entries = cache.list('p1')
+    assert [entry['filename'] for entry in entries] == ['b.png', 'a.png']
+    with open(entries[1]['path'], 'rb') as f:
+        assert f.read() == b'first'
+
+
+def test_identical_outputs_share_one_blob(make_cache):
+    cache = make_cache()
+    first = cache.put('p1', 'a.png', b'same bytes', 'image/png')
+    second = cache.put('p2', 'a.png', b'same bytes', 'image/png')
+    assert first['path'] == second['path']
+    assert len(os.listdir(cache.blob_dir)) == 1
+
+
+def test_least_recently_used_entries_are_evicted(make_cache):
+    cache = make_cache(max_bytes=3500)
+    for name in ('old', 'used', 'new'):
+        cache.put(name, 'a.png', os.urandom(1000), 'image/png')
+        time.sleep(0.02)
+    cache.get('old', 'a.png')  # Touching an entry makes it recent again
+    time.sleep(0.02)
+
+    cache.put('newest', 'a.png', os.urandom(1000), 'image/png')
+
+    assert cache.get('used', 'a.png') is None
+    for name in ('old', 'new', 'newest'):
+        assert cache.get(name, 'a.png') is not None
+    assert cache.bytes_estimate <= 3500
+
+
+def test_expired_entries_are_not_served(make_cache):
+    cache = make_cache(ttl=0.05)
+    cache.put('p1', 'a.png', b'data', 'image/png')
+    cache.mark_complete('p1')
+    time.sleep(0.1)
+    assert cache.get('p1', 'a.png') is None
+    assert cache.list('p1') is None
+
+
+def test_writes_below_the_limit_do_not_rescan(make_cache):
+    cache = make_cache(max_bytes=100_000)
+    scans = []
+    original = cache.evict
+    cache.evict = lambda: scans.append(1) or original()
+
+    for index in range(20):
+        cache.put(f'p{index}', 'a.png', os.urandom(1000), 'image/png')
+
+    # One scan to learn the starting size; after that the running total is enough
+    assert len(scans) == 1
+    assert cache.bytes_estimate == 20_000
+
+
+def test_full_cache_rescans_once_per_low_water_margin(make_cache):
+    cache = make_cache(max_bytes=20_000)
+    for index in range(20):
+        cache.put(f'fill{index}', 'a.png', os.urandom(1000), 'image/png')
+        time.sleep(0.002)
+    scans = []
+    original = cache.evict
+    cache.evict = lambda: scans.append(1) or original()
+
+    for index in range(20):
+        cache.put(f'p{index}', 'a.png', os.urandom(1000), 'image/png')
+        time.sleep(0.002)
+
+    # Eviction frees 10% of the limit, i.e. two entries, per scan
+    assert len(scans) <= 10
+    assert cache.bytes_estimate <= 20_000
@@ -0,0 +1,140 @@
+import time
+
+import pytest
+
+
+@pytest.fixture
+def make_scheduler(app_module, tmp_path):
+    """A scheduler on its own queue; dispatch is driven by the test through _claim."""
+    def make(aging=300, affinity_wait=0, name='jobs.db'):
+        return app_module.JobScheduler(str(tmp_path / name), True, 100, 1, aging, 60, 30, 3600, affinity_wait, 50)
+    return make
+
+
+def image_workflow(app_module, name='flux1_dev', prompt='a lighthouse'):
+    return app_module.prepare_workflow(name, text_prompt=prompt, seed=1)
+
+
+def backdate(scheduler, prompt_id, seconds):
+    with scheduler._connect() as db:
+        db.execute("UPDATE jobs SET created_at = created_at - ? WHERE prompt_id = ?", (seconds, prompt_id))
+
+
+def claim_all(scheduler, backend):
+    claimed = []
+    while True:
+        job = scheduler._claim(backend)
+        if job is None:
+            return claimed
+        claimed.append(job['prompt_id'])
+
+
+def test_interactive_jobs_go_before_batch_jobs(app_module, make_scheduler, backend):
+    scheduler = make_scheduler()
+    batch = scheduler.enqueue(image_workflow(app_module), 'tok', interactive=False)
+    interactive = scheduler.enqueue(image_workflow(app_module), 'tok', interactive=True)
+    assert claim_all(scheduler, backend) == [interactive, batch]
+
+
+def test_waiting_jobs_age_into_higher_classes(app_module, make_scheduler, backend):
+    scheduler = make_scheduler(aging=1)
+    batch = scheduler.enqueue(image_workflow(app_module), 'tok', interactive=False)
+    backdate(scheduler, batch, 5)
+    interactive = scheduler.enqueue(image_workflow(app_module), 'other', interactive=True)
+    assert claim_all(scheduler, backend) == [batch, interactive]
+
+
+def test_tokens_take_turns_within_a_class(app_module, make_scheduler, backend):
+    scheduler = make_scheduler()
+    owners = {}
+    for index in range(4):
+        owners[scheduler.enqueue(image_workflow(app_module, prompt=f'h{index}'), 'heavy', interactive=False)] = 'heavy'
+    for index in range(2):
+        owners[scheduler.enqueue(image_workflow(app_module, prompt=f'l{index}'), 'light', interactive=False)] = 'light'
+
+    order = []
+    for prompt_id in claim_all(scheduler, backend):
+        order.append(owners[prompt_id])
+        time.sleep(0.01)  # Distinct dispatch times
+    assert order == ['heavy', 'light', 'heavy', 'light', 'heavy', 'heavy']
+
+
+def model_workflows(app_module, make_scheduler, backend):
+    """Two image workflows on different models, the one dispatched first without affinity coming first."""
+    workflows = [image_workflow(app_module, 'flux1_dev'), image_workflow(app_module, 'deliberate_v6')]
+    plain = make_scheduler(name='plain.db')
+    ids = [plain.enqueue(workflow, 'tok') for workflow in workflows]
+    if plain._claim(backend)['prompt_id'] != ids[0]:
+        workflows.reverse()
+    return workflows
+
+
+def test_affinity_prefers_the_loaded_model_while_the_head_is_young(app_module, make_scheduler, backend):
+    head, other = model_workflows(app_module, make_scheduler, backend)
+    scheduler = make_scheduler(affinity_wait=30)
+    scheduler.enqueue(head, 'tok')
+    preferred = scheduler.enqueue(other, 'tok')
+    backend.loaded_model = app_module.model_signature(other)
+    avoided = backend.switches_avoided
+
+    assert scheduler._claim(backend)['prompt_id'] == preferred
+    assert backend.switches_avoided == avoided + 1
+
+
+def test_affinity_gives_way_once_the_head_has_waited(app_module, make_scheduler, backend):
+    head, other = model_workflows(app_module, make_scheduler, backend)
+    scheduler = make_scheduler(affinity_wait=30)
+    first = scheduler.enqueue(head, 'tok')
+    scheduler.enqueue(other, 'tok')
+    backdate(scheduler, first, 60)
+    backend.loaded_model = app_module.model_signature(other)
+
+    assert scheduler._claim(backend)['prompt_id'] == first
+
+
+def test_affinity_never_lets_another_class_overtake_the_head(app_module, make_scheduler, backend):
+    scheduler = make_scheduler(affinity_wait=30)
+    image = scheduler.enqueue(image_workflow(app_module, 'flux1_dev'), 'tok', interactive=True)
+    video_workflow = app_module.prepare_workflow('cogvideox_text_to_video', text_prompt='waves')
+    scheduler.enqueue(video_workflow, 'tok', interactive=False)
+    backend.loaded_model = app_module.model_signature(video_workflow)
+    avoided = backend.switches_avoided
+
+    assert scheduler._claim(backend)['prompt_id'] == image
+    assert backend.switches_avoided == avoided
+
+
+def test_job_fails_when_comfyui_replaces_its_prompt_id(app_module, make_scheduler, extra_stub):
+    backend, stub = extra_stub(ignore_prompt_id=True)
+    scheduler = make_scheduler()
+    prompt_id = scheduler.enqueue(image_workflow(app_module), 'tok', backend=backend)
+    job = scheduler._claim(backend)
+
+    assert scheduler._send(job, backend)
+    assert 'ignored prompt_id' in scheduler.failure(prompt_id)
+    assert stub.stats['prompts'] == 1
+
+
+def stored_tokens(scheduler, prompt_id):
+    with scheduler._connect() as db:
+        row = db.execute("SELECT token, token_hash FROM jobs WHERE prompt_id = ?", (prompt_id,)).fetchone()
+    return row['token'], row['token_hash']
+
+
+def test_raw_token_is_dropped_once_the_job_is_sent(app_module, make_scheduler, extra_stub):
+    backend, stub = extra_stub()
+    scheduler = make_scheduler()
+    prompt_id = scheduler.enqueue(image_workflow(app_module), 'secret-token', backend=backend)
+    assert stored_tokens(scheduler, prompt_id) == ('secret-token', app_module.token_hash('secret-token'))
+
+    assert scheduler._send(scheduler._claim(backend), backend)
+    assert stored_tokens(scheduler, prompt_id) == ('', app_module.token_hash('secret-token'))
+
+
+def test_raw_token_is_dropped_when_the_job_fails(app_module, make_scheduler, extra_stub):
+    backend, stub = extra_stub(ignore_prompt_id=True)
+    scheduler = make_scheduler()
+    prompt_id = scheduler.enqueue(image_workflow(app_module), 'secret-token', backend=backend)
+
+    assert scheduler._send(scheduler._claim(backend), backend)
+    assert stored_tokens(scheduler, prompt_id)[0] == ''
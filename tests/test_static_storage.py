@@ -0,0 +1,70 @@
+import os
+import time
+
+
+def write_static(app_module, name, data=b'data'):
+    os.makedirs(app_module.STATIC_DIR, exist_ok=True)
+    path = os.path.join(app_module.STATIC_DIR, name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def test_files_are_served_from_a_custom_static_dir(app_module, client):
+    # conftest points STATIC_DIR at a temporary folder outside the checkout
+    assert not app_module.STATIC_DIR.startswith(os.path.dirname(app_module.__file__) + os.sep)
+    write_static(app_module, 'served.txt', b'hello')
+
+    response = client.get('/static/served.txt')
+    assert response.status_code == 200
+    assert response.data == b'hello'
+    assert client.get('/static/missing.txt').status_code == 404
+
+
+def test_static_urls_point_at_the_static_route(app_module):
+    url = app_module.static_url(os.path.join(app_module.STATIC_DIR, 'input image.png'))
+    assert url == f'{app_module.PUBLIC_BASE_URL}/static/input%20image.png'
+
+
+def test_serving_a_file_marks_it_recently_used(app_module, client):
+    path = write_static(app_module, 'recent.png')
+    os.utime(path, (1, 1))
+    assert client.get('/static/recent.png').status_code == 200
+    assert os.path.getmtime(path) > 1
+
+
+def test_sweep_evicts_least_recently_used_unpinned_files(app_module, tmp_path):
+    storage = app_module.StaticStorage(str(tmp_path), max_bytes=3000, ttl=3600, grace=0, sweep_interval=0)
+    now = time.time()
+    paths = {}
+    for age, name in ((30, 'oldest'), (20, 'pinned'), (10, 'middle'), (0, 'newest')):
+        paths[name] = str(tmp_path / f'{name}.png')
+        with open(paths[name], 'wb') as f:
+            f.write(b'x' * 1000)
+        os.utime(paths[name], (now - age, now - age))
+    storage.track(paths['pinned'], 'prompt-1', delete_on_release=False)
+    storage.touch(paths['oldest'])
+
+    storage.sweep()
+
+    assert os.path.exists(paths['oldest'])  # Served just now
+    assert os.path.exists(paths['pinned'])  # Its prompt is still running
+    assert not os.path.exists(paths['middle'])
+    assert os.path.exists(paths['newest'])
+    assert storage.stats()['files_reclaimed'] == 1
+
+
+def test_sweep_drops_expired_files_and_release_deletes_inputs(app_module, tmp_path):
+    storage = app_module.StaticStorage(str(tmp_path), max_bytes=10 ** 9, ttl=60, grace=0, sweep_interval=0)
+    expired, upload = str(tmp_path / 'expired.mp4'), str(tmp_path / 'upload.png')
+    for path in (expired, upload):
+        open(path, 'wb').close()
+    os.utime(expired, (1, 1))
+    storage.track(upload, 'prompt-2')
+
+    storage.sweep()
+    assert not os.path.exists(expired)
+    assert os.path.exists(upload)
+
+    storage.release('prompt-2')
+    assert not os.path.exists(upload)
@@ -0,0 +1,50 @@
+import json
+import time
+
+
+def read_events(response):
+    """Parse a finished SSE response into (event, data) pairs, skipping keepalive comments."""
+    events = []
+    for block in response.get_data(as_text=True).split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+        if 'event' in lines:
+            events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+
+def submit(client, auth):
+    response = client.post('/v1/workflows/deliberate_v6/run', json={'text_prompt': 'a fox', 'async': True}, headers=auth)
+    assert response.status_code == 202
+    return response.get_json()['prompt_id']
+
+
+def test_unknown_prompt_ids_get_404(client, auth):
+    started = time.time()
+    response = client.get('/v1/tasks/does-not-exist/events', headers=auth)
+    assert response.status_code == 404
+    assert time.time() - started < 5
+
+
+def test_stream_ends_with_a_complete_event(client, auth):
+    prompt_id = submit(client, auth)
+    events = read_events(client.get(f'/v1/tasks/{prompt_id}/events', headers=auth))
+    name, data = events[-1]
+    assert name == 'complete'
+    assert data['prompt_id'] == prompt_id
+    assert data['get_image_url'].endswith(f'/v1/image_tasks/{prompt_id}')
+
+
+def test_stream_times_out_with_a_terminal_event(app_module, client, auth, stub, monkeypatch):
+    monkeypatch.setattr(app_module, 'VIDEO_PROMPT_TIMEOUT', 0.5)
+    monkeypatch.setattr(stub, 'execution_time', 5)
+    prompt_id = submit(client, auth)
+    try:
+        started = time.time()
+        events = read_events(client.get(f'/v1/tasks/{prompt_id}/events', headers=auth))
+        assert time.time() - started < 5
+        name, data = events[-1]
+        assert name == 'timeout'
+        assert data['prompt_id'] == prompt_id
+    finally:
+        stub.interrupt()
+        app_module.cancel_prompt(prompt_id, 'test-token', 'timeout')
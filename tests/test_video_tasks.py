@@ -0,0 +1,58 @@
+import time
+
+
+def wait_for_video(client, auth, prompt_id, method='GET', timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        response = client.open(f'/v1/video_tasks/{prompt_id}', method=method, headers=auth)
+        if response.status_code != 202:
+            return response
+        time.sleep(0.05)
+    raise AssertionError(f'{prompt_id} did not finish')
+
+
+def test_video_task_links_use_the_public_base_url(app_module, client, auth, monkeypatch):
+    monkeypatch.setattr(app_module, 'PUBLIC_BASE_URL', 'https://api.example.com')
+    response = client.post('/v1/text_to_video', headers=auth, json={'text_prompt': 'waves'})
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body['get_video_url'] == f"https://api.example.com/v1/video_tasks/{body['prompt_id']}"
+    assert wait_for_video(client, auth, body['prompt_id']).status_code == 200
+
+
+def finished_video(client, auth):
+    response = client.post('/v1/text_to_video', headers=auth, json={'text_prompt': 'waves'})
+    prompt_id = response.get_json()['prompt_id']
+    wait_for_video(client, auth, prompt_id, method='HEAD')
+    return prompt_id
+
+
+def test_video_supports_head_range_and_revalidation(client, auth, stub):
+    prompt_id = finished_video(client, auth)
+    url = f'/v1/video_tasks/{prompt_id}'
+    size = len(stub.video)
+
+    head = client.head(url, headers=auth)
+    assert head.status_code == 200
+    assert int(head.headers['Content-Length']) == size
+    assert head.headers['Accept-Ranges'] == 'bytes'
+    assert head.data == b''
+
+    # Proxied from ComfyUI before the video has been cached
+    partial = client.get(url, headers=dict(auth, Range='bytes=100-199'))
+    assert partial.status_code == 206
+    assert partial.headers['Content-Range'] == f'bytes 100-199/{size}'
+    assert partial.data == stub.video[100:200]
+
+    full = client.get(url, headers=auth)
+    assert full.status_code == 200
+    assert full.data == stub.video
+    etag = full.headers['ETag']
+
+    # Served from the result cache once a full download has passed through
+    views = stub.stats['views']
+    assert client.get(url, headers=dict(auth, **{'If-None-Match': etag})).status_code == 304
+    cached = client.get(url, headers=dict(auth, Range=f'bytes={size - 10}-'))
+    assert cached.status_code == 206
+    assert cached.data == stub.video[-10:]
+    assert stub.stats['views'] == views
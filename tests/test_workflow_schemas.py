@@ -0,0 +1,103 @@
+import json
+import os
+import time
+
+import pytest
+
+WORKFLOW = 'deliberate_v6_workflow_api.json'
+
+
+@pytest.fixture
+def write_schema(app_module, tmp_path):
+    """Write a schema for the Deliberate workflow and compile it."""
+    def write(params, **extra):
+        path = tmp_path / 'custom.json'
+        path.write_text(json.dumps(dict({'workflow': os.path.join(app_module.WORKFLOWS_DIR, WORKFLOW),
+                                         'params': params}, **extra)))
+        return app_module.WorkflowTemplate('custom', str(path))
+    return write
+
+
+PROMPT = {'node': '6', 'input': 'text', 'type': 'string', 'required': True}
+STEPS = {'node': '3', 'input': 'steps', 'type': 'integer', 'min': 1, 'max': 150}
+
+
+def test_built_in_schemas_compile(app_module):
+    assert set(app_module.workflow_registry) >= {'flux1_dev', 'deliberate_v6', 'cogvideox_text_to_video'}
+
+
+@pytest.mark.parametrize('params, extra, message', [
+    ({'steps': dict(STEPS, type='float')}, {}, "type 'float'"),
+    ({'steps': dict(STEPS, minimum=1)}, {}, 'unknown keys'),
+    ({'steps': {'node': '3', 'type': 'integer'}}, {}, 'node id and an input name'),
+    ({'steps': dict(STEPS, default=500)}, {}, 'default of'),
+    ({'steps': dict(STEPS, max='$NOT_A_SETTING')}, {}, 'Unknown schema reference'),
+    ({'text_prompt': PROMPT}, {'outputs': '9'}, 'unknown keys'),
+])
+def test_invalid_schemas_are_rejected(write_schema, params, extra, message):
+    with pytest.raises(ValueError, match=message):
+        write_schema(params, **extra)
+
+
+def test_schema_must_name_existing_inputs_and_nodes(write_schema):
+    with pytest.raises(KeyError, match='no input'):
+        write_schema({'steps': dict(STEPS, input='stepz')})
+    with pytest.raises(KeyError, match='no node'):
+        write_schema({'text_prompt': PROMPT}, output_node='999')
+
+
+def test_values_are_coerced_and_checked(app_module, write_schema):
+    template = write_schema({'text_prompt': PROMPT, 'steps': STEPS,
+                             'sampler': {'node': '3', 'input': 'sampler_name', 'type': 'string',
+                                         'choices': ['euler', 'dpmpp_2m']}})
+    assert template.validate(steps='20', sampler='euler') == {'steps': 20, 'sampler': 'euler'}
+
+    for values, message in [({'steps': 'many'}, 'must be of type integer'),
+                            ({'steps': 0}, 'at least 1'),
+                            ({'steps': 151}, 'at most 150'),
+                            ({'sampler': 'ddim'}, 'must be one of'),
+                            ({'cfg': 7}, "Unknown parameter 'cfg'")]:
+        with pytest.raises(app_module.WorkflowParameterError, match=message):
+            template.validate(**values)
+
+
+def test_prepare_injects_values_and_requires_required_ones(app_module, write_schema):
+    template = write_schema({'text_prompt': dict(PROMPT, format='a photo of {}'), 'steps': dict(STEPS, default=25)})
+    workflow = template.prepare(text_prompt='a fox')
+    assert workflow['6']['inputs']['text'] == 'a photo of a fox'
+    assert workflow['3']['inputs']['steps'] == 25
+    # The template itself is left untouched
+    assert template.nodes['6']['inputs']['text'] != 'a photo of a fox'
+
+    with pytest.raises(app_module.WorkflowParameterError, match='text_prompt is required'):
+        template.prepare(steps=10)
+
+
+def test_run_endpoint_answers_400_for_invalid_parameters(client, auth):
+    response = client.post('/v1/workflows/deliberate_v6/run', json={'text_prompt': 'x', 'steps': 0}, headers=auth)
+    assert response.status_code == 400
+    assert 'steps' in response.get_json()['error']
+
+    response = client.post('/v1/workflows/deliberate_v6/run', json={'steps': 10}, headers=auth)
+    assert response.status_code == 400
+
+    assert client.post('/v1/workflows/nope/run', json={}, headers=auth).status_code == 404
+
+
+def test_templates_reload_when_their_files_change(app_module, write_schema, monkeypatch):
+    monkeypatch.setattr(app_module, 'WORKFLOW_RELOAD_INTERVAL', 0)
+    template = write_schema({'text_prompt': PROMPT, 'steps': dict(STEPS, default=25)})
+    assert template.prepare(text_prompt='a fox')['3']['inputs']['steps'] == 25
+
+    schema = json.loads(open(template.schema_path).read())
+    schema['params']['steps']['default'] = 30
+    with open(template.schema_path, 'w') as f:
+        json.dump(schema, f)
+    os.utime(template.schema_path, (time.time() + 5, time.time() + 5))
+    assert template.prepare(text_prompt='a fox')['3']['inputs']['steps'] == 30
+
+    # A broken edit keeps the last good template in service
+    with open(template.schema_path, 'w') as f:
+        f.write('{not json')
+    os.utime(template.schema_path, (time.time() + 10, time.time() + 10))
+    assert template.prepare(text_prompt='a fox')['3']['inputs']['steps'] == 30